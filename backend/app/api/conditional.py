@@ -0,0 +1,81 @@
+"""Conditional GET helpers (ETag / Last-Modified / 304).
+
+Validators are derived from cheap columns (updated_at, last_data_time and
+station_latest.data_id) so a matching request is answered before the
+heavy queries run. cached_response puts the shared response cache in
+front of a view: a hit (or a 304 from the stored ETag) does not touch the
+database at all."""
+import hashlib
+import time
+from functools import wraps
+
+from flask import Response, make_response, request
+
+from app.core.config import settings
+from app.core.shared_cache import FLEET, response_cache
+
+
+class Validators:
+    def __init__(self, *parts, last_modified=None, relative_window=False):
+        """parts: values that change whenever the response would change.
+        relative_window: the response covers "the last N hours", so it also
+        changes as time passes; the ETag then rolls over every
+        ETAG_WINDOW_S seconds."""
+        args = sorted(request.args.items(multi=True))
+        if relative_window:
+            parts += (int(time.time() // settings.ETAG_WINDOW_S),)
+        raw = repr((request.path, args) + parts).encode()
+        self.etag = hashlib.sha1(raw).hexdigest()[:24]
+        self.last_modified = last_modified
+        self.relative_window = relative_window
+
+    def not_modified(self):
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(self.etag)
+        # If-Modified-Since solo si no hay If-None-Match (RFC 9110)
+        ims = request.if_modified_since
+        if ims and self.last_modified and not self.relative_window:
+            return self.last_modified.replace(microsecond=0) <= ims.replace(tzinfo=None)
+        return False
+
+    def apply(self, resp):
+        resp.set_etag(self.etag)
+        if self.last_modified and not self.relative_window:
+            resp.last_modified = self.last_modified
+        resp.cache_control.public = True
+        resp.cache_control.max_age = settings.CACHE_MAX_AGE_S
+        resp.vary.add('Accept-Encoding')
+        return resp
+
+    def response_304(self):
+        return self.apply(Response(status=304))
+
+
+def cached_response(station_arg=None):
+    """Serve a GET view from the shared response cache.
+
+    station_arg: name of the view argument holding the station the response
+    depends on; None when it depends on every station (FLEET). Only 200,
+    non-streamed responses are stored."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not settings.RESPONSE_CACHE_ENABLED:
+                return view(**kwargs)
+            scope = kwargs[station_arg] if station_arg else FLEET
+            key = response_cache.key(request.path, request.args)
+            entry, generations = response_cache.get(key, scope)
+            if entry is not None:
+                status, headers, body = entry
+                resp = Response(body, status=status, headers=headers)
+                resp.headers['X-Cache'] = 'HIT'
+                return resp.make_conditional(request)
+
+            resp = make_response(view(**kwargs))
+            if resp.status_code == 200 and not resp.is_streamed:
+                response_cache.set(key, scope, generations, resp.status_code,
+                                   resp.headers.items(), resp.get_data())
+            resp.headers['X-Cache'] = 'MISS'
+            return resp
+        return wrapper
+    return decorator
@@ -5,8 +5,13 @@ from datetime import datetime, timedelta, timezone
 def _now():
     return datetime.now(timezone.utc).replace(tzinfo=None)
 
-from app.core.database import SessionLocal
-from app.models.station import WeatherStation, WeatherData
+from app.api.conditional import cached_response
+from app.core.config import settings
+from app.core.database import SessionLocal, ReadSessionLocal
+from app.models.station import WeatherData
+from app.services.ingest import parse_reading, existing_station_ids, store_readings
+from app.services.ingest_queue import ingest_queue
+from app.services.partitions import load
 
 bp = Blueprint('data', __name__, url_prefix='/api/data')
 
@@ -18,62 +23,106 @@ def submit_data():
         data = request.get_json()
         
         # Validación
-        if 'station_id' not in data or 'temperature' not in data:
+        if not data or 'station_id' not in data or 'temperature' not in data:
             return jsonify({"detail": "Missing station_id or temperature"}), 400
+        row = parse_reading(data)
         
         # Verificar que estación existe
-        station = db.query(WeatherStation).filter(
-            WeatherStation.id == data['station_id']
-        ).first()
-        
-        if not station:
+        if not existing_station_ids(db, [row['station_id']]):
             return jsonify({"detail": "Station not found"}), 404
         
-        # Crear registro de datos
-        weather_data = WeatherData(
-            station_id=data['station_id'],
-            temperature=float(data['temperature']),
-            humidity=float(data.get('humidity', 0)),
-            wind_speed_ms=float(data.get('wind_speed_ms', 0)),
-            wind_gust_ms=float(data.get('wind_gust_ms', 0)),
-            wind_direction_degrees=float(data.get('wind_direction_degrees', 0)),
-            total_rainfall=float(data.get('total_rainfall', 0)),
-            total_tips=int(data.get('total_tips', 0)),
-            rain_rate_mm_per_hour=float(data.get('rain_rate_mm_per_hour', 0))
-        )
-        
-        db.add(weather_data)
+        if settings.INGEST_MODE == 'buffered':
+            if not ingest_queue.put(row):
+                resp = jsonify({"detail": "Ingest queue full, retry later"})
+                resp.headers['Retry-After'] = str(settings.INGEST_RETRY_AFTER_S)
+                return resp, 503
+            return jsonify({
+                "status": "queued",
+                "timestamp": row['timestamp'].isoformat()
+            }), 202
         
-        # Actualizar last_data_time de la estación
-        station.last_data_time = _now()
-        
-        db.commit()
-        db.refresh(weather_data)
+        new_id, = store_readings(db, [row])
+        if new_id is None:
+            return jsonify({"detail": "Station not found"}), 404
         
         return jsonify({
-            "id": weather_data.id,
+            "id": new_id,
             "status": "success",
-            "timestamp": weather_data.timestamp.isoformat()
+            "timestamp": row['timestamp'].isoformat()
         }), 201
     except (ValueError, KeyError) as e:
         return jsonify({"detail": str(e)}), 400
     finally:
         db.close()
 
+@bp.route('/submit/batch', methods=['POST'])
+def submit_batch():
+    """Submit many readings (one or several stations) in a single transaction.
+    Body: a JSON array of readings, or {"station_id": ..., "readings": [...]}
+    where station_id is the default for readings that omit it."""
+    db = SessionLocal()
+    try:
+        data = request.get_json(silent=True)
+        default_station = None
+        if isinstance(data, dict):
+            default_station = data.get('station_id')
+            data = data.get('readings')
+        if not isinstance(data, list) or not data:
+            return jsonify({"detail": "Expected a non-empty array of readings"}), 400
+        if len(data) > settings.INGEST_BATCH_MAX:
+            return jsonify({"detail": f"Batch too large (max {settings.INGEST_BATCH_MAX})"}), 413
+
+        # Validar todo el lote en una sola pasada
+        results = [None] * len(data)
+        parsed = []
+        for i, item in enumerate(data):
+            try:
+                parsed.append((i, parse_reading(item, default_station)))
+            except ValueError as e:
+                results[i] = {"index": i, "status": "rejected", "detail": str(e)}
+
+        known = existing_station_ids(db, [row['station_id'] for _, row in parsed])
+        accepted = []
+        for i, row in parsed:
+            if row['station_id'] in known:
+                accepted.append((i, row))
+            else:
+                results[i] = {"index": i, "status": "rejected", "detail": "Station not found"}
+
+        ids = store_readings(db, [row for _, row in accepted])
+        stored = 0
+        for (i, _), new_id in zip(accepted, ids):
+            if new_id is None:
+                # Borrada por otro worker mientras se validaba el lote
+                results[i] = {"index": i, "status": "rejected", "detail": "Station not found"}
+            else:
+                results[i] = {"index": i, "status": "accepted", "id": new_id}
+                stored += 1
+
+        rejected = len(data) - stored
+        return jsonify({
+            "accepted": stored,
+            "rejected": rejected,
+            "results": results
+        }), 207 if rejected else 201
+    finally:
+        db.close()
+
 @bp.route('/station/<station_id>', methods=['GET'])
+@cached_response('station_id')
 def get_station_data(station_id):
     """Get latest data from a station"""
-    db = SessionLocal()
+    db = ReadSessionLocal()
     try:
         hours = request.args.get('hours', 24, type=int)
         limit = request.args.get('limit', 100, type=int)
         
         since = _now() - timedelta(hours=hours)
         
-        data = db.query(WeatherData).filter(
+        data = load(db, db.query(WeatherData).filter(
             WeatherData.station_id == station_id,
             WeatherData.timestamp >= since
-        ).order_by(desc(WeatherData.timestamp)).limit(limit).all()
+        ).order_by(desc(WeatherData.timestamp)).limit(limit), since)
         
         return jsonify([{
             'temperature': d.temperature,
@@ -0,0 +1,71 @@
+"""Keyset (cursor) pagination.
+
+A cursor is the sort key (timestamp, id) of the last row already sent,
+encoded as opaque base64url. The next page asks for the rows strictly
+before it in (timestamp DESC, id DESC) order, which the (..., timestamp)
+indexes answer with a range seek: page N costs the same as page 1, while
+OFFSET reads and discards every earlier row.
+
+The body stays a plain JSON array; the cursor for the next page travels in
+the X-Next-Cursor header and in a Link: <...>; rel="next" header."""
+import base64
+import json
+from datetime import datetime
+from urllib.parse import urlencode
+
+from flask import request
+from sqlalchemy import and_, or_
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(ts, row_id):
+    raw = json.dumps([ts.isoformat() if ts else None, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).rstrip(b'=').decode()
+
+
+def decode_cursor(token):
+    """(timestamp or None, id) from a cursor; raises InvalidCursor."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        ts, row_id = json.loads(raw)
+        if not isinstance(row_id, (int, str)) or isinstance(row_id, bool):
+            raise TypeError(row_id)
+        return (datetime.fromisoformat(ts) if ts is not None else None), row_id
+    except (ValueError, TypeError):
+        raise InvalidCursor("Cursor inválido")
+
+
+def before(ts_col, id_col, key, nullable=False):
+    """WHERE clause for rows after `key` in (ts DESC, id DESC) order.
+
+    Written as ts <= t AND (ts < t OR id < i) rather than a row-value
+    comparison so SQLite uses ts as the upper bound of the index range.
+    nullable: ts may be NULL (sorted last in DESC order)."""
+    ts, row_id = key
+    if ts is None:
+        return and_(ts_col.is_(None), id_col < row_id)
+    clause = and_(ts_col <= ts, or_(ts_col < ts, id_col < row_id))
+    return or_(clause, ts_col.is_(None)) if nullable else clause
+
+
+def cursor_arg():
+    """Decoded ?cursor= of the current request, or None."""
+    token = request.args.get('cursor')
+    return decode_cursor(token) if token else None
+
+
+def set_next_page(resp, rows, limit, key):
+    """Add X-Next-Cursor/Link when the query returned more than `limit`
+    rows (it is run with limit + 1). `key(row)` -> (timestamp, id) of the
+    last row sent."""
+    if len(rows) <= limit or limit <= 0:
+        return resp
+    token = encode_cursor(*key(rows[limit - 1]))
+    args = [(k, v) for k, v in request.args.items(multi=True) if k not in ('cursor', 'skip')]
+    args.append(('cursor', token))
+    resp.headers['X-Next-Cursor'] = token
+    resp.headers['Link'] = f'<{request.path}?{urlencode(args)}>; rel="next"'
+    return resp
@@ -1,18 +1,47 @@
-from flask import Blueprint, request, jsonify
-from sqlalchemy import desc, func
+from flask import Blueprint, Response, request, jsonify, send_file
+from sqlalchemy import desc, func, select
 from datetime import datetime, timedelta, timezone
 
 def _now():
     """UTC now as naive datetime (compatible with SQLite)."""
     return datetime.now(timezone.utc).replace(tzinfo=None)
+import math
+import queue
+import tempfile
+import time
 import uuid
-import statistics as stats_module
 
-from app.core.database import SessionLocal
-from app.models.station import WeatherStation, WeatherData
+from app.api.conditional import Validators, cached_response
+from app.api.pagination import InvalidCursor, before, cursor_arg, set_next_page
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.database import SessionLocal, ReadSessionLocal
+from app.core.shared_cache import response_cache
+from app.models.station import WeatherStation, WeatherData, StationLatest
+from app.services.ingest import invalidate_station
+from app.services.counters import bump, read_counters
+from app.services.rollups import (
+    window_aggregates, describe, remove_station_rollups, fleet_avg_temperature
+)
+from app.services.live import live_hub, fetch_events, max_reading_id
+from app.services.partitions import registered, route, load, delete_station_rows
+from app.services.sketch import QuantileSketch
+from app.services.export import CONTENT_TYPES, stream_export, write_npz
+from app.services.spatial import index_station, unindex_station, nearest, parse_bbox, within_clause
+from app.services.downsample import (
+    SERIES, FILLS, MAX_BUCKETS, parse_resolution, iter_arrays, series_select, bucketize, lttb_ids,
+    to_epoch, epoch_to_iso, aligned_select, align, matrix_lists
+)
 
 bp = Blueprint('stations', __name__, url_prefix='/api/stations')
 
+overview_cache = TTLCache(maxsize=1, ttl=settings.OVERVIEW_CACHE_TTL_S)
+
+NEAREST_MAX_K = 100
+COMPARE_MAX_STATIONS = 50
+# Celdas por variable (estaciones × intervalos) en /compare
+COMPARE_MAX_CELLS = 200000
+
 
 # ── Helpers ────────────────────────────────────────────────────────────────────
 
@@ -38,15 +67,68 @@ def _data_to_dict(d):
         'humidity': d.humidity,
         'dew_point': d.dew_point,
         'wind_speed_ms': d.wind_speed_ms,
+        'wind_speed_mph': d.wind_speed_mph,
         'wind_gust_ms': d.wind_gust_ms,
+        'wind_gust_mph': d.wind_gust_mph,
         'wind_direction_degrees': d.wind_direction_degrees,
         'wind_direction_name': d.wind_direction_name,
         'total_rainfall': d.total_rainfall,
         'rain_rate_mm_per_hour': d.rain_rate_mm_per_hour,
+        'rain_rate_in_per_hour': d.rain_rate_in_per_hour,
         'timestamp': d.timestamp.isoformat(),
     }
 
 
+def _with_latest(db):
+    """Stations joined with their newest reading (station_latest) in one query."""
+    return db.query(WeatherStation, WeatherData).outerjoin(
+        StationLatest, StationLatest.station_id == WeatherStation.id
+    ).outerjoin(
+        WeatherData, WeatherData.id == StationLatest.data_id
+    )
+
+
+def _fill_archived_latest(db, rows):
+    """Stations whose newest reading was moved to a monthly partition get
+    no match from the weather_data join; look those few up by id."""
+    missing = [s.id for s, latest in rows if latest is None]
+    if not missing or not registered(db):
+        return rows
+    pointers = dict(db.query(StationLatest.station_id, StationLatest.data_id).filter(
+        StationLatest.station_id.in_(missing)
+    ).all())
+    if not pointers:
+        return rows
+    found = {d.id: d for d in load(db, db.query(WeatherData).filter(WeatherData.id.in_(list(pointers.values()))))}
+    return [(s, latest if latest is not None else found.get(pointers.get(s.id))) for s, latest in rows]
+
+
+def _station_validators(db, station_id, relative_window=False):
+    """Validators for one station: changes to the station row or a new
+    latest reading. None if the station does not exist."""
+    row = db.query(
+        WeatherStation.updated_at, WeatherStation.last_data_time, StationLatest.data_id
+    ).outerjoin(
+        StationLatest, StationLatest.station_id == WeatherStation.id
+    ).filter(WeatherStation.id == station_id).first()
+    if row is None:
+        return None
+    modified = max(t for t in (row.updated_at, row.last_data_time) if t is not None)
+    return Validators(*row, last_modified=modified, relative_window=relative_window)
+
+
+def _fleet_validators(db, relative_window=False):
+    """Validators for the station list, from one aggregate over stations."""
+    row = db.query(
+        func.count(WeatherStation.id), func.max(WeatherStation.updated_at),
+        func.max(WeatherStation.last_data_time), func.max(StationLatest.data_id)
+    ).outerjoin(
+        StationLatest, StationLatest.station_id == WeatherStation.id
+    ).one()
+    modified = max((t for t in row[1:3] if t is not None), default=None)
+    return Validators(*row, last_modified=modified, relative_window=relative_window)
+
+
 # ── Stations CRUD ───────────────────────────────────────────────────────────────
 
 @bp.route('/', methods=['POST'])
@@ -73,7 +155,11 @@ def create_station():
         )
 
         db.add(station)
+        index_station(db, station.id, station.latitude, station.longitude)
+        bump(db, total_stations=1, active_stations=1)
         db.commit()
+        overview_cache.invalidate()
+        response_cache.bump()
         db.refresh(station)
         return jsonify(_station_to_dict(station)), 201
     except ValueError as e:
@@ -83,51 +169,69 @@ def create_station():
 
 
 @bp.route('/', methods=['GET'])
+@cached_response()
 def list_stations():
-    """List all weather stations with latest_data included"""
-    db = SessionLocal()
+    """List all weather stations with latest_data included.
+    Pages by ?cursor= (keyset on updated_at, id; see X-Next-Cursor);
+    ?skip= is still accepted for the first page."""
+    db = ReadSessionLocal()
     try:
+        validators = _fleet_validators(db)
+        if validators.not_modified():
+            return validators.response_304()
+
         active_param = request.args.get('active')
         skip = request.args.get('skip', 0, type=int)
         limit = request.args.get('limit', 100, type=int)
+        try:
+            cursor = cursor_arg()
+        except InvalidCursor as e:
+            return jsonify({"detail": str(e)}), 400
 
-        query = db.query(WeatherStation)
+        query = _with_latest(db)
 
         if active_param is not None:
             query = query.filter(WeatherStation.active == (active_param.lower() == 'true'))
+        if cursor:
+            query = query.filter(before(WeatherStation.updated_at, WeatherStation.id, cursor, nullable=True))
+        elif skip:
+            query = query.offset(skip)
 
-        stations = query.order_by(desc(WeatherStation.updated_at)).offset(skip).limit(limit).all()
+        rows = query.order_by(desc(WeatherStation.updated_at), desc(WeatherStation.id)).limit(limit + 1).all()
+        rows = _fill_archived_latest(db, rows)
 
         results = []
-        for s in stations:
+        for s, latest in rows[:limit]:
             d = _station_to_dict(s)
-            latest = db.query(WeatherData).filter(
-                WeatherData.station_id == s.id
-            ).order_by(desc(WeatherData.timestamp)).first()
             d['latest_data'] = _data_to_dict(latest) if latest else None
             results.append(d)
 
-        return jsonify(results)
+        resp = set_next_page(jsonify(results), rows, limit, lambda r: (r[0].updated_at, r[0].id))
+        return validators.apply(resp)
     finally:
         db.close()
 
 
 @bp.route('/<station_id>', methods=['GET'])
+@cached_response('station_id')
 def get_station(station_id):
     """Get station details with latest data"""
-    db = SessionLocal()
+    db = ReadSessionLocal()
     try:
-        station = db.query(WeatherStation).filter(WeatherStation.id == station_id).first()
-        if not station:
+        validators = _station_validators(db, station_id)
+        if validators is None:
             return jsonify({"detail": "Station not found"}), 404
+        if validators.not_modified():
+            return validators.response_304()
 
-        latest_data = db.query(WeatherData).filter(
-            WeatherData.station_id == station_id
-        ).order_by(desc(WeatherData.timestamp)).first()
+        row = _with_latest(db).filter(WeatherStation.id == station_id).first()
+        if not row:
+            return jsonify({"detail": "Station not found"}), 404
 
+        station, latest_data = _fill_archived_latest(db, [row])[0]
         result = _station_to_dict(station)
         result['latest_data'] = _data_to_dict(latest_data) if latest_data else None
-        return jsonify(result)
+        return validators.apply(jsonify(result))
     finally:
         db.close()
 
@@ -142,6 +246,7 @@ def update_station(station_id):
             return jsonify({"detail": "Station not found"}), 404
 
         data = request.get_json() or {}
+        was_active = bool(station.active)
         for field in ('name', 'location', 'description', 'active'):
             if field in data:
                 setattr(station, field, data[field])
@@ -149,9 +254,16 @@ def update_station(station_id):
             station.latitude = float(data['latitude'])
         if 'longitude' in data:
             station.longitude = float(data['longitude'])
+        if 'latitude' in data or 'longitude' in data:
+            index_station(db, station_id, station.latitude, station.longitude)
 
         station.updated_at = _now()
+        if bool(station.active) != was_active:
+            bump(db, active_stations=1 if station.active else -1)
         db.commit()
+        invalidate_station(station_id)
+        overview_cache.invalidate()
+        response_cache.bump([station_id])
         db.refresh(station)
         return jsonify(_station_to_dict(station))
     finally:
@@ -167,30 +279,125 @@ def delete_station(station_id):
         if not station:
             return jsonify({"detail": "Station not found"}), 404
 
+        records = db.query(func.count(WeatherData.id)).filter(
+            WeatherData.station_id == station_id
+        ).scalar()
+        records += delete_station_rows(db, station_id)
+        bump(db, total_stations=-1, active_stations=-1 if station.active else 0, total_records=-records)
+        remove_station_rollups(db, station_id)
+        unindex_station(db, station_id)
         db.delete(station)
         db.commit()
+        invalidate_station(station_id)
+        overview_cache.invalidate()
+        response_cache.bump([station_id])
         return '', 204
     finally:
         db.close()
 
 
+# ── Spatial ─────────────────────────────────────────────────────────────────────
+
+def _spatial_results(db, query, with_latest):
+    rows = query.all() if with_latest else [(s, None) for s in query.all()]
+    if with_latest:
+        rows = _fill_archived_latest(db, rows)
+    results = []
+    for s, latest in rows:
+        d = _station_to_dict(s)
+        if with_latest:
+            d['latest_data'] = _data_to_dict(latest) if latest else None
+        results.append(d)
+    return results
+
+
+@bp.route('/within', methods=['GET'])
+@cached_response()
+def stations_within():
+    """Stations inside ?bbox=west,south,east,north (degrees, the order of
+    Leaflet's getBounds().toBBoxString()). Uses the R*Tree station index;
+    latest=false leaves out latest_data."""
+    try:
+        west, south, east, north = parse_bbox(request.args.get('bbox', ''))
+    except ValueError as e:
+        return jsonify({"detail": str(e)}), 400
+    limit = request.args.get('limit', 1000, type=int)
+    with_latest = request.args.get('latest', 'true').lower() != 'false'
+
+    db = ReadSessionLocal()
+    try:
+        validators = _fleet_validators(db)
+        if validators.not_modified():
+            return validators.response_304()
+
+        query = _with_latest(db) if with_latest else db.query(WeatherStation)
+        query = query.filter(within_clause(west, south, east, north))
+        active_param = request.args.get('active')
+        if active_param is not None:
+            query = query.filter(WeatherStation.active == (active_param.lower() == 'true'))
+        query = query.order_by(WeatherStation.id).limit(limit)
+        return validators.apply(jsonify(_spatial_results(db, query, with_latest)))
+    finally:
+        db.close()
+
+
+@bp.route('/nearest', methods=['GET'])
+@cached_response()
+def stations_nearest():
+    """The k stations closest to ?lat=&lon= (great-circle distance), nearest
+    first, each with distance_km. latest=false leaves out latest_data."""
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    k = request.args.get('k', 10, type=int)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({"detail": "lat (-90..90) y lon (-180..180) son obligatorios"}), 400
+    if not 1 <= k <= NEAREST_MAX_K:
+        return jsonify({"detail": f"k debe estar entre 1 y {NEAREST_MAX_K}"}), 400
+    with_latest = request.args.get('latest', 'true').lower() != 'false'
+
+    db = ReadSessionLocal()
+    try:
+        validators = _fleet_validators(db)
+        if validators.not_modified():
+            return validators.response_304()
+
+        distances = dict(nearest(db, lat, lon, k))
+        query = _with_latest(db) if with_latest else db.query(WeatherStation)
+        results = _spatial_results(db, query.filter(WeatherStation.id.in_(list(distances))), with_latest)
+        for d in results:
+            d['distance_km'] = distances[d['id']]
+        results.sort(key=lambda d: (d['distance_km'], d['id']))
+        return validators.apply(jsonify(results))
+    finally:
+        db.close()
+
+
 # ── Data (frontend usa /api/stations/<id>/data) ────────────────────────────────
 
 @bp.route('/<station_id>/data', methods=['GET'])
+@cached_response('station_id')
 def get_station_data(station_id):
     """Get historical weather data for a station.
-    Supports either date range (start_date/end_date) or relative hours."""
-    db = SessionLocal()
+    Supports either date range (start_date/end_date) or relative hours.
+    With buckets=N or resolution=5m|1h|... the series is downsampled on the
+    server: mode=avg (default) returns avg/min/max per time bucket and
+    mode=lttb returns the raw readings that best preserve the chart shape.
+    Raw readings are paged newest first with ?cursor= (keyset on
+    timestamp, id; see X-Next-Cursor)."""
+    db = ReadSessionLocal()
     try:
-        station = db.query(WeatherStation).filter(WeatherStation.id == station_id).first()
-        if not station:
+        absolute = bool(request.args.get('start_date') and request.args.get('end_date'))
+        validators = _station_validators(db, station_id, relative_window=not absolute)
+        if validators is None:
             return jsonify({"detail": "Station not found"}), 404
+        if validators.not_modified():
+            return validators.response_304()
 
         limit = request.args.get('limit', 2000, type=int)
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
 
-        query = db.query(WeatherData).filter(WeatherData.station_id == station_id)
+        filters = [WeatherData.station_id == station_id]
 
         if start_date and end_date:
             try:
@@ -198,104 +405,349 @@ def get_station_data(station_id):
                 end = datetime.fromisoformat(end_date).replace(hour=23, minute=59, second=59)
             except ValueError:
                 return jsonify({"detail": "Formato de fecha inválido. Usa YYYY-MM-DD"}), 400
-            query = query.filter(WeatherData.timestamp >= start, WeatherData.timestamp <= end)
+            filters += [WeatherData.timestamp >= start, WeatherData.timestamp <= end]
         else:
             hours = request.args.get('hours', 24, type=int)
-            since = _now() - timedelta(hours=hours)
-            query = query.filter(WeatherData.timestamp >= since)
+            end = None
+            start = _now() - timedelta(hours=hours)
+            filters.append(WeatherData.timestamp >= start)
+
+        buckets = request.args.get('buckets', type=int)
+        resolution = request.args.get('resolution')
+        if buckets or resolution:
+            # +1 s: el límite superior es inclusivo
+            result = _downsampled(db, filters, start, (end or _now()) + timedelta(seconds=1))
+            return validators.apply(result) if isinstance(result, Response) else result
+
+        try:
+            cursor = cursor_arg()
+        except InvalidCursor as e:
+            return jsonify({"detail": str(e)}), 400
+        if cursor:
+            filters.append(before(WeatherData.timestamp, WeatherData.id, cursor))
+            if cursor[0] is not None:
+                # Las particiones posteriores al cursor ya no hacen falta
+                end = min(end, cursor[0]) if end else cursor[0]
+
+        query = db.query(WeatherData).filter(*filters).order_by(
+            desc(WeatherData.timestamp), desc(WeatherData.id)
+        ).limit(limit + 1)
+        data = load(db, query, start, end + timedelta(seconds=1) if end else None)
+        resp = jsonify([_data_to_dict(d) for d in data[:limit]])
+        return validators.apply(set_next_page(resp, data, limit, lambda d: (d.timestamp, d.id)))
+    finally:
+        db.close()
+
+
+def _downsampled(db, filters, start, end):
+    """Downsampled series, newest first like the raw endpoint."""
+    span = max((end - start).total_seconds(), 1.0)
+    try:
+        if request.args.get('resolution'):
+            width = parse_resolution(request.args['resolution']).total_seconds()
+        else:
+            width = span / max(request.args.get('buckets', type=int), 1)
+    except ValueError as e:
+        return jsonify({"detail": str(e)}), 400
 
-        data = query.order_by(desc(WeatherData.timestamp)).limit(limit).all()
-        return jsonify([_data_to_dict(d) for d in data])
+    mode = request.args.get('mode', 'avg')
+    if mode == 'lttb':
+        field = request.args.get('field', 'temperature')
+        if field not in SERIES:
+            return jsonify({"detail": f"field must be one of {list(SERIES)}"}), 400
+        ids = lttb_ids(db, filters, field, math.ceil(span / width), start, end)
+        rows = []
+        for i in range(0, len(ids), 500):
+            rows += load(db, db.query(WeatherData).filter(WeatherData.id.in_(ids[i:i + 500])), start, end)
+        rows.sort(key=lambda d: (d.timestamp, d.id), reverse=True)
+        return jsonify([_data_to_dict(d) for d in rows])
+    if mode != 'avg':
+        return jsonify({"detail": "mode must be 'avg' or 'lttb'"}), 400
+
+    chunks = iter_arrays(db, route(db, series_select(*filters), start, end), ['t'] + list(SERIES))
+    result = bucketize(chunks, to_epoch(start), to_epoch(end), width)
+    result.reverse()
+    return jsonify(result)
+
+
+@bp.route('/compare', methods=['GET'])
+@cached_response()
+def compare_stations():
+    """Several stations' readings resampled onto one time grid.
+    ?station_ids=a,b,c with start_date/end_date or hours (24);
+    resolution (5m), fill=none|ffill|linear, fields=temperature,... (all).
+    One range query for every station; each field comes back as a
+    stations x timestamps matrix, null where a station has no data."""
+    ids = list(dict.fromkeys(s.strip() for s in request.args.get('station_ids', '').split(',') if s.strip()))
+    if not ids:
+        return jsonify({"detail": "station_ids parameter required"}), 400
+    if len(ids) > COMPARE_MAX_STATIONS:
+        return jsonify({"detail": f"At most {COMPARE_MAX_STATIONS} stations"}), 400
+    fields = [f.strip() for f in request.args.get('fields', ','.join(SERIES)).split(',') if f.strip()]
+    unknown = [f for f in fields if f not in SERIES]
+    if unknown or not fields:
+        return jsonify({"detail": f"fields must be among {list(SERIES)}"}), 400
+    fill = request.args.get('fill', 'none')
+    if fill not in FILLS:
+        return jsonify({"detail": f"fill must be one of {list(FILLS)}"}), 400
+    try:
+        width = parse_resolution(request.args.get('resolution', '5m')).total_seconds()
+    except ValueError as e:
+        return jsonify({"detail": str(e)}), 400
+
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    if start_date and end_date:
+        try:
+            start = datetime.fromisoformat(start_date)
+            end = datetime.fromisoformat(end_date).replace(hour=23, minute=59, second=59) + timedelta(seconds=1)
+        except ValueError:
+            return jsonify({"detail": "Formato de fecha inválido. Usa YYYY-MM-DD"}), 400
+    else:
+        end = _now()
+        start = end - timedelta(hours=request.args.get('hours', 24, type=int))
+
+    # Rejilla alineada a múltiplos de la resolución: mismas marcas entre llamadas
+    grid_start = math.floor(to_epoch(start) / width) * width
+    n = max(1, math.ceil((to_epoch(end) - grid_start) / width))
+    if n > MAX_BUCKETS or n * len(ids) > COMPARE_MAX_CELLS:
+        return jsonify({"detail": "Too many points: use a coarser resolution or a shorter window"}), 400
+
+    db = ReadSessionLocal()
+    try:
+        validators = _fleet_validators(db, relative_window=not (start_date and end_date))
+        if validators.not_modified():
+            return validators.response_304()
+
+        found = {sid for sid, in db.query(WeatherStation.id).filter(WeatherStation.id.in_(ids))}
+        missing = [sid for sid in ids if sid not in found]
+        if missing:
+            return jsonify({"detail": f"Stations not found: {missing}"}), 404
+
+        stmt = aligned_select(ids, fields, WeatherData.station_id.in_(ids),
+                              WeatherData.timestamp >= start, WeatherData.timestamp < end)
+        chunks = iter_arrays(db, route(db, stmt, start, end), ['t', 's'] + fields)
+        series, counts = align(chunks, len(ids), grid_start, width, n, fields, fill)
+
+        resp = jsonify({
+            "stations": ids,
+            "resolution_s": int(width),
+            "fill": fill,
+            "timestamps": [epoch_to_iso(grid_start + i * width) for i in range(n)],
+            "counts": counts.tolist(),
+            "series": {f: matrix_lists(values, 1 if f == 'wind_direction_degrees' else 2)
+                       for f, values in series.items()},
+        })
+        return validators.apply(resp)
+    finally:
+        db.close()
+
+
+# ── Live feed (SSE) ──────────────────────────────────────────────────────────────
+
+@bp.route('/live', methods=['GET'])
+def live_fleet():
+    """Server-Sent Events with every new reading of every station."""
+    return _live(None)
+
+
+@bp.route('/<station_id>/live', methods=['GET'])
+def live_station(station_id):
+    """Server-Sent Events with each new reading of one station.
+    Event id is the reading id; on reconnect the browser sends
+    Last-Event-ID and the missed readings are replayed."""
+    db = ReadSessionLocal()
+    try:
+        if not db.query(WeatherStation.id).filter(WeatherStation.id == station_id).first():
+            return jsonify({"detail": "Station not found"}), 404
+    finally:
+        db.close()
+    return _live(station_id)
+
+
+def _live(station_id):
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return jsonify({"detail": "Last-Event-ID must be a reading id"}), 400
+
+    sub = live_hub.subscribe(station_id)
+    if sub is None:
+        resp = jsonify({"detail": "Too many live subscribers, retry later"})
+        resp.headers['Retry-After'] = str(settings.LIVE_HEARTBEAT_S)
+        return resp, 503
+
+    # Suscrito antes de leer: lo que llegue durante el replay queda en la cola
+    db = ReadSessionLocal()
+    try:
+        replay = []
+        if last_id is None:
+            last_id = max_reading_id(db)
+        else:
+            after = last_id
+            while len(replay) < settings.LIVE_REPLAY_MAX:
+                events = fetch_events(db, after, station_id)
+                replay += events
+                if len(events) < 500:
+                    break
+                after = events[-1][0]
+    except Exception:
+        live_hub.unsubscribe(sub)
+        raise
     finally:
         db.close()
 
+    resp = Response(_live_stream(sub, replay, last_id), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    # Por si el generador nunca llega a arrancar
+    resp.call_on_close(lambda: live_hub.unsubscribe(sub))
+    return resp
+
+
+def _live_stream(sub, replay, last_id):
+    """Replay, then queued events with heartbeats. The stream ends after
+    LIVE_MAX_DURATION_S (or if the client fell behind) and EventSource
+    reconnects, which frees the worker thread for a while."""
+    try:
+        yield "retry: 1000\n\n"
+        for event_id, _, frame in replay:
+            last_id = event_id
+            yield frame
+        deadline = time.monotonic() + settings.LIVE_MAX_DURATION_S
+        while not sub.overflowed and time.monotonic() < deadline:
+            try:
+                event_id, _, frame = sub.queue.get(timeout=settings.LIVE_HEARTBEAT_S)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            if event_id <= last_id:
+                continue
+            last_id = event_id
+            yield frame
+    finally:
+        live_hub.unsubscribe(sub)
+
 
 # ── Stats ───────────────────────────────────────────────────────────────────────
 
 @bp.route('/stats/overview', methods=['GET'])
 def get_stats_overview():
-    """System-wide statistics"""
-    db = SessionLocal()
+    """System-wide statistics.
+    Totals come from system_counters and the 24 h average from the fleet-wide
+    hourly rollup; the assembled result is cached for OVERVIEW_CACHE_TTL_S."""
+    cached = overview_cache.get('overview')
+    if cached is not None:
+        return _overview_response(cached)
+
+    db = ReadSessionLocal()
     try:
-        total = db.query(WeatherStation).count()
-        active = db.query(WeatherStation).filter(WeatherStation.active == True).count()
-        total_records = db.query(WeatherData).count()
+        counters = read_counters(db)
+        total = counters['total_stations']
+        active = counters['active_stations']
 
-        since_24h = _now() - timedelta(hours=24)
+        now = _now()
+        since_24h = now - timedelta(hours=24)
         recent_stations = db.query(WeatherStation).filter(
             WeatherStation.last_data_time >= since_24h
         ).count()
 
-        avg_temp = db.query(func.avg(WeatherData.temperature)).filter(
-            WeatherData.timestamp >= since_24h
-        ).scalar()
+        avg_temp = fleet_avg_temperature(db, since_24h, now)
 
-        return jsonify({
+        result = {
             "total_stations": total,
             "active_stations": active,
             "inactive_stations": total - active,
-            "total_records": total_records,
+            "total_records": counters['total_records'],
             "recent_stations": recent_stations,
             "avg_temperature_24h": round(avg_temp, 2) if avg_temp else None,
-            "timestamp": _now().isoformat()
-        })
+            "timestamp": now.isoformat()
+        }
+        overview_cache.set('overview', result)
+        return _overview_response(result)
     finally:
         db.close()
 
 
+def _overview_response(result):
+    resp = jsonify(result)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = min(settings.CACHE_MAX_AGE_S, settings.OVERVIEW_CACHE_TTL_S)
+    return resp
+
+
+def _percentiles(db, station_id, since):
+    """p50/p90/p99 of temperature, humidity and wind from one streaming pass
+    over a column-only cursor, in bounded memory."""
+    columns = {'temperature': WeatherData.temperature,
+               'humidity': WeatherData.humidity,
+               'wind_speed': WeatherData.wind_speed_ms}
+    sketches = {name: QuantileSketch() for name in columns}
+    stmt = select(*columns.values()).where(
+        WeatherData.station_id == station_id, WeatherData.timestamp >= since
+    )
+    for chunk in iter_arrays(db, route(db, stmt, since), list(columns)):
+        for name, sketch in sketches.items():
+            sketch.add_array(chunk[name])
+
+    def summary(sketch):
+        if not sketch.count:
+            return None
+        return {f"p{int(q * 100)}": round(sketch.quantile(q), 2) for q in (0.5, 0.9, 0.99)}
+
+    return {name: summary(sketch) for name, sketch in sketches.items()}
+
+
 @bp.route('/<station_id>/stats', methods=['GET'])
+@cached_response('station_id')
 def get_station_stats(station_id):
-    """Statistics for a station over N hours"""
-    db = SessionLocal()
+    """Statistics for a station over N hours.
+    percentiles=true adds p50/p90/p99 (approximate, 1% relative error)."""
+    db = ReadSessionLocal()
     try:
+        validators = _station_validators(db, station_id, relative_window=True)
+        if validators is None:
+            return jsonify({"detail": "Station not found"}), 404
+        if validators.not_modified():
+            return validators.response_304()
+
         station = db.query(WeatherStation).filter(WeatherStation.id == station_id).first()
         if not station:
             return jsonify({"detail": "Station not found"}), 404
 
         hours = request.args.get('hours', 24, type=int)
-        since = _now() - timedelta(hours=hours)
+        now = _now()
+        since = now - timedelta(hours=hours)
 
-        data = db.query(WeatherData).filter(
-            WeatherData.station_id == station_id,
-            WeatherData.timestamp >= since
-        ).all()
+        agg = window_aggregates(db, since, now, station_id=station_id)
 
-        if not data:
-            return jsonify({
+        if not agg['count']:
+            return validators.apply(jsonify({
                 "station_id": station_id,
                 "station_name": station.name,
                 "period_hours": hours,
                 "record_count": 0
-            })
-
-        temps = [d.temperature for d in data if d.temperature is not None]
-        humids = [d.humidity for d in data if d.humidity is not None]
-        winds = [d.wind_speed_ms for d in data if d.wind_speed_ms is not None]
-        rainfall = sum(d.total_rainfall or 0 for d in data)
-
-        def agg(values):
-            if not values:
-                return None
-            return {
-                "avg": round(sum(values) / len(values), 2),
-                "min": round(min(values), 2),
-                "max": round(max(values), 2),
-                "std_dev": round(stats_module.stdev(values), 2) if len(values) > 1 else 0
-            }
+            }))
+
+        winds = describe(agg, 'wind_speed')
 
-        return jsonify({
+        result = {
             "station_id": station_id,
             "station_name": station.name,
             "period_hours": hours,
-            "record_count": len(data),
-            "temperature": agg(temps),
-            "humidity": agg(humids),
+            "record_count": agg['count'],
+            "temperature": describe(agg, 'temperature'),
+            "humidity": describe(agg, 'humidity'),
             "wind": {
-                "avg_speed": round(sum(winds) / len(winds), 2) if winds else None,
-                "max_speed": round(max(winds), 2) if winds else None
+                "avg_speed": winds['avg'],
+                "max_speed": winds['max']
             },
-            "total_rainfall": round(rainfall, 2)
-        })
+            "total_rainfall": round(agg['rainfall_sum'], 2)
+        }
+        if request.args.get('percentiles', '').lower() in ('1', 'true'):
+            result["percentiles"] = _percentiles(db, station_id, since)
+        return validators.apply(jsonify(result))
     finally:
         db.close()
 
@@ -305,9 +757,16 @@ def get_station_stats(station_id):
 @bp.route('/bulk/export', methods=['GET'])
 def bulk_export():
     """Export data from selected stations.
-    Supports date range (start_date/end_date) or relative hours."""
-    db = SessionLocal()
+    Supports date range (start_date/end_date) or relative hours.
+    format=json (default) returns one document; format=ndjson|csv streams
+    the readings row by row with flat memory; format=npz returns typed
+    columnar arrays (see services/export.write_npz)."""
+    db = ReadSessionLocal()
     try:
+        fmt = request.args.get('format', 'json')
+        if fmt not in ('json', 'npz') and fmt not in CONTENT_TYPES:
+            return jsonify({"detail": f"format must be one of {['json', 'npz'] + list(CONTENT_TYPES)}"}), 400
+
         ids_param = request.args.get('station_ids', '')
         if not ids_param:
             return jsonify({"detail": "station_ids parameter required"}), 400
@@ -329,17 +788,35 @@ def bulk_export():
             time_filter = lambda sid: (WeatherData.station_id == sid,
                                        WeatherData.timestamp >= start,
                                        WeatherData.timestamp <= end)
+            window = (start, end + timedelta(seconds=1))
         else:
             hours = request.args.get('hours', 24, type=int)
             since = _now() - timedelta(hours=hours)
             time_filter = lambda sid: (WeatherData.station_id == sid,
                                        WeatherData.timestamp >= since)
+            window = (since, None)
+
+        if fmt in CONTENT_TYPES:
+            found = {s.id for s in stations}
+            station_ids = [sid for sid in ids if sid in found]
+            resp = Response(stream_export(fmt, station_ids, time_filter, window), mimetype=CONTENT_TYPES[fmt])
+            resp.headers['Content-Disposition'] = f'attachment; filename="weather_export.{fmt}"'
+            # Que nginx no acumule la respuesta antes de enviarla
+            resp.headers['X-Accel-Buffering'] = 'no'
+            return resp
+
+        if fmt == 'npz':
+            buf = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+            write_npz(buf, db, stations, time_filter, window)
+            buf.seek(0)
+            return send_file(buf, mimetype='application/octet-stream',
+                             as_attachment=True, download_name='weather_export.npz')
 
         result = {}
         for station in stations:
-            data = db.query(WeatherData).filter(
+            data = load(db, db.query(WeatherData).filter(
                 *time_filter(station.id)
-            ).order_by(WeatherData.timestamp).all()
+            ).order_by(WeatherData.timestamp), *window)
 
             result[station.id] = {
                 "station": _station_to_dict(station),
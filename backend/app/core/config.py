@@ -21,7 +21,87 @@ class Settings:
     # CORS
     CORS_ORIGINS: list = ["*"]
     
+    # Perfil de almacenamiento SQLite (PRAGMAs aplicados a cada conexión).
+    # Un valor vacío deja el valor por defecto de SQLite.
+    SQLITE_JOURNAL_MODE: str = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    # Solo tiene efecto al crear la base (o tras `manage.py vacuum`)
+    SQLITE_AUTO_VACUUM: str = os.getenv("SQLITE_AUTO_VACUUM", "INCREMENTAL")
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_CACHE_SIZE: str = os.getenv("SQLITE_CACHE_SIZE", "-16000")      # KiB si es negativo
+    SQLITE_MMAP_SIZE: str = os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024))
+    SQLITE_BUSY_TIMEOUT_MS: str = os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")
+    SQLITE_TEMP_STORE: str = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
+    # Motor de solo lectura separado para las rutas GET
+    SQLITE_READ_POOL_SIZE: int = int(os.getenv("SQLITE_READ_POOL_SIZE", 8))
+
+    # Ingesta
+    INGEST_BATCH_MAX: int = int(os.getenv("INGEST_BATCH_MAX", 5000))
+    # "sync": commit por petición | "buffered": cola en memoria + escritor en grupo (202)
+    INGEST_MODE: str = os.getenv("INGEST_MODE", "sync")
+    INGEST_QUEUE_MAX: int = int(os.getenv("INGEST_QUEUE_MAX", 10000))
+    INGEST_FLUSH_ROWS: int = int(os.getenv("INGEST_FLUSH_ROWS", 500))
+    INGEST_FLUSH_MS: int = int(os.getenv("INGEST_FLUSH_MS", 250))
+    INGEST_RETRY_AFTER_S: int = int(os.getenv("INGEST_RETRY_AFTER_S", 2))
+    # Caché de existencia de estaciones y escritura diferida de last_data_time
+    STATION_CACHE_SIZE: int = int(os.getenv("STATION_CACHE_SIZE", 10000))
+    STATION_CACHE_TTL_S: int = int(os.getenv("STATION_CACHE_TTL_S", 60))
+    STATION_TOUCH_INTERVAL_S: int = int(os.getenv("STATION_TOUCH_INTERVAL_S", 30))
+
+    # Caché del resumen /stats/overview (segundos)
+    OVERVIEW_CACHE_TTL_S: int = int(os.getenv("OVERVIEW_CACHE_TTL_S", 10))
+
+    # GET condicional: max-age de Cache-Control (micro-caché de nginx) y
+    # ventana en la que caduca el ETag de las consultas "últimas N horas"
+    CACHE_MAX_AGE_S: int = int(os.getenv("CACHE_MAX_AGE_S", 5))
+    ETAG_WINDOW_S: int = int(os.getenv("ETAG_WINDOW_S", 60))
+
+    # Feed en vivo (SSE): límites por worker. Cada conexión ocupa un hilo de gunicorn.
+    LIVE_MAX_SUBSCRIBERS: int = int(os.getenv("LIVE_MAX_SUBSCRIBERS", 8))
+    LIVE_QUEUE_SIZE: int = int(os.getenv("LIVE_QUEUE_SIZE", 256))
+    LIVE_POLL_MS: int = int(os.getenv("LIVE_POLL_MS", 500))
+    LIVE_HEARTBEAT_S: int = int(os.getenv("LIVE_HEARTBEAT_S", 15))
+    LIVE_MAX_DURATION_S: int = int(os.getenv("LIVE_MAX_DURATION_S", 300))
+    LIVE_REPLAY_MAX: int = int(os.getenv("LIVE_REPLAY_MAX", 1000))
+
+    # Caché de respuestas compartida entre workers (archivo SQLite aparte).
+    # Invalidada por generación de estación; TTL como cota para ventanas relativas
+    RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    RESPONSE_CACHE_PATH: str = os.getenv("RESPONSE_CACHE_PATH", "")
+    RESPONSE_CACHE_MAX_BYTES: int = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    RESPONSE_CACHE_MAX_ENTRY_BYTES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", 1024 * 1024))
+    RESPONSE_CACHE_TTL_S: int = int(os.getenv("RESPONSE_CACHE_TTL_S", 60))
+    # La ingesta invalida las respuestas de toda la flota como mucho una vez por intervalo
+    RESPONSE_CACHE_FLEET_INTERVAL_S: float = float(os.getenv("RESPONSE_CACHE_FLEET_INTERVAL_S", 5))
+
+    # Métricas Prometheus en /metrics: cada worker vuelca las suyas en
+    # METRICS_DIR/<pid>.json cada METRICS_FLUSH_S s (vacío = directorio temporal)
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_DIR: str = os.getenv("METRICS_DIR", "")
+    METRICS_FLUSH_S: float = float(os.getenv("METRICS_FLUSH_S", 5))
+    # /metrics solo se publica con un token (Authorization: Bearer ...) o una
+    # lista de IPs/redes permitidas (p. ej. "10.0.0.0/8,fdaa::/16"); sin
+    # ninguno de los dos no existe la ruta
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
+    METRICS_ALLOW: str = os.getenv("METRICS_ALLOW", "")
+
+    # Perfilado SQL por petición (cabeceras Server-Timing/X-Query-Count, N+1 y
+    # log de consultas lentas con su plan). Solo para diagnóstico.
+    SQL_PROFILE: bool = os.getenv("SQL_PROFILE", "false").lower() == "true"
+    SQL_SLOW_MS: float = float(os.getenv("SQL_SLOW_MS", 100))
+    SQL_N_PLUS_ONE_MIN: int = int(os.getenv("SQL_N_PLUS_ONE_MIN", 5))
+
     # Retención de datos (días)
-    DATA_RETENTION_DAYS: int = 30
+    DATA_RETENTION_DAYS: int = int(os.getenv("DATA_RETENTION_DAYS", 30))
+    RETENTION_BATCH_SIZE: int = int(os.getenv("RETENTION_BATCH_SIZE", 2000))
+    RETENTION_PAUSE_MS: int = int(os.getenv("RETENTION_PAUSE_MS", 50))
+    # true: lo borrado sigue resumido en las rollups horarias/diarias
+    RETENTION_ARCHIVE: bool = os.getenv("RETENTION_ARCHIVE", "true").lower() == "true"
+    # Particiones mensuales: weather_data guarda el mes en curso y N meses
+    # anteriores; lo más antiguo pasa a weather_data_AAAAMM (antes de cada purga)
+    PARTITION_ENABLED: bool = os.getenv("PARTITION_ENABLED", "true").lower() == "true"
+    PARTITION_HOT_MONTHS: int = int(os.getenv("PARTITION_HOT_MONTHS", 1))
+    PARTITION_REGISTRY_TTL_S: int = int(os.getenv("PARTITION_REGISTRY_TTL_S", 10))
+    # Purga automática cada N minutos en segundo plano (0 = desactivada)
+    RETENTION_INTERVAL_MIN: int = int(os.getenv("RETENTION_INTERVAL_MIN", 0))
 
 settings = Settings()
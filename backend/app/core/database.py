@@ -1,10 +1,15 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, extract, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 import logging
 import os
+import time
 from pathlib import Path
 
+from app.core.config import settings
+from app.core import metrics
+
 logger = logging.getLogger(__name__)
 
 DATABASE_URL = os.getenv(
@@ -12,16 +17,139 @@ DATABASE_URL = os.getenv(
     f"sqlite:///{Path(__file__).parent.parent.parent}/weather.db"
 )
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in DATABASE_URL else {},
-    pool_pre_ping=True,
-    echo=False
-)
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+# Una base en memoria es distinta en cada conexión: no se puede separar lector/escritor
+_IS_MEMORY = IS_SQLITE and (":memory:" in DATABASE_URL or DATABASE_URL.rstrip("/") in ("sqlite:", "sqlite:/"))
+
+# (pragma, valor configurado, aplica también al lector)
+_PRAGMAS = [
+    ("auto_vacuum", settings.SQLITE_AUTO_VACUUM, False),
+    ("journal_mode", settings.SQLITE_JOURNAL_MODE, False),
+    ("synchronous", settings.SQLITE_SYNCHRONOUS, True),
+    ("cache_size", settings.SQLITE_CACHE_SIZE, True),
+    ("mmap_size", settings.SQLITE_MMAP_SIZE, True),
+    ("busy_timeout", settings.SQLITE_BUSY_TIMEOUT_MS, True),
+    ("temp_store", settings.SQLITE_TEMP_STORE, True),
+]
+
+
+def _apply_pragmas(dbapi_conn, read_only):
+    cursor = dbapi_conn.cursor()
+    try:
+        for name, value, on_reader in _PRAGMAS:
+            if value and (on_reader or not read_only):
+                cursor.execute(f"PRAGMA {name}={value}")
+        if read_only:
+            cursor.execute("PRAGMA query_only=ON")
+    finally:
+        cursor.close()
+
+
+class _TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waits."""
+
+    def connect(self):
+        t0 = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            # recreate() conserva logging_name: sirve de etiqueta tras un dispose()
+            metrics.pool_wait.observe(time.perf_counter() - t0, self.logging_name)
+
+
+_STATEMENT_OPS = {"select", "insert", "update", "delete"}
+
+
+def is_busy_error(exc):
+    """True for SQLite's 'database is locked/busy': transient, worth a retry."""
+    message = str(getattr(exc, "orig", None) or exc).lower()
+    return "locked" in message or "busy" in message
+
+
+def _instrument(eng, label):
+    @event.listens_for(eng, "before_cursor_execute")
+    def _start(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_t0 = time.perf_counter()
+
+    @event.listens_for(eng, "after_cursor_execute")
+    def _stop(conn, cursor, statement, parameters, context, executemany):
+        t0 = getattr(context, "_metrics_t0", None)
+        if t0 is not None:
+            op = statement.lstrip()[:6].lower()
+            metrics.query_latency.observe(time.perf_counter() - t0, label,
+                                          op if op in _STATEMENT_OPS else "other")
+
+    @event.listens_for(eng, "handle_error")
+    def _error(context):
+        if is_busy_error(context.original_exception):
+            metrics.db_busy.inc(label)
+
+
+def _make_engine(read_only=False, **kwargs):
+    label = "reader" if read_only else "writer"
+    if settings.METRICS_ENABLED and not _IS_MEMORY:
+        kwargs.update(poolclass=_TimedQueuePool, pool_logging_name=label)
+    eng = create_engine(
+        DATABASE_URL,
+        connect_args={"check_same_thread": False} if IS_SQLITE else {},
+        pool_pre_ping=True,
+        echo=False,
+        **kwargs
+    )
+    if IS_SQLITE:
+        event.listen(eng, "connect", lambda conn, _: _apply_pragmas(conn, read_only))
+    if settings.METRICS_ENABLED:
+        _instrument(eng, label)
+    return eng
+
+
+engine = _make_engine()
+
+# Con WAL los lectores no bloquean al escritor (ni al revés); usan su propio pool
+if IS_SQLITE and not _IS_MEMORY:
+    read_engine = _make_engine(read_only=True, pool_size=settings.SQLITE_READ_POOL_SIZE)
+else:
+    read_engine = engine
+
+
+def _pool_stats():
+    stats = {}
+    for label, eng in (("writer", engine), ("reader", read_engine)):
+        pool = eng.pool
+        if isinstance(pool, QueuePool):
+            stats[(label, "size")] = pool.size()
+            stats[(label, "checked_out")] = pool.checkedout()
+            stats[(label, "idle")] = pool.checkedin()
+            stats[(label, "overflow")] = max(pool.overflow(), 0)
+        if read_engine is engine:
+            break
+    return stats
+
+
+metrics.registry.gauge(
+    "weather_db_pool_connections", "Connection pool state per worker summed over workers",
+    ("engine", "state"), callback=_pool_stats)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
 Base = declarative_base()
 
+def dialect_insert(table):
+    """INSERT builder with ON CONFLICT support for the active dialect."""
+    if engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+def epoch_seconds(column):
+    """SQL expression for a DateTime column as float Unix seconds, so bulk
+    reads can skip building Python datetime objects."""
+    if engine.dialect.name == "postgresql":
+        return extract("epoch", column)
+    return (func.julianday(column) - 2440587.5) * 86400.0
+
 def get_db():
     """Dependency for getting DB session"""
     db = SessionLocal()
@@ -37,3 +165,21 @@ def init_db():
         logger.info("Database initialized successfully")
     except Exception as e:
         logger.warning(f"Database initialization warning: {e}")
+
+def report_storage():
+    """Log the PRAGMAs actually in effect on the writer and reader connections."""
+    if not IS_SQLITE:
+        return {}
+    report = {}
+    for label, eng in (("writer", engine), ("reader", read_engine)):
+        with eng.connect() as conn:
+            values = {
+                name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+                for name, _, _ in _PRAGMAS
+            }
+            values["query_only"] = conn.exec_driver_sql("PRAGMA query_only").scalar()
+        report[label] = values
+        logger.info(f"SQLite {label}: " + ", ".join(f"{k}={v}" for k, v in values.items()))
+        if eng is engine and read_engine is engine:
+            break
+    return report
@@ -0,0 +1,325 @@
+"""In-process metrics in the Prometheus text format, aggregated across
+gunicorn workers.
+
+Each worker keeps its counters and histograms in memory (one lock, a dict
+update per observation) and a daemon thread dumps them every
+METRICS_FLUSH_S seconds to METRICS_DIR/<pid>.json. /metrics merges the
+files of every worker: counters and histograms are summed, gauges only
+from live workers. The files of a worker that died are folded into
+dead.json first, so totals never go backwards when gunicorn replaces a
+worker."""
+import atexit
+import fcntl
+import hmac
+import ipaddress
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from flask import g, has_request_context
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+ROW_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = registry._lock
+        self._values = {}
+        registry.metrics[name] = self
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(k): v if isinstance(v, (int, float)) else list(v)
+                    for k, v in self._values.items()}
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value read from a callback when the worker flushes: callback() ->
+    {label values tuple: value}. Workers' values are summed, unless shared
+    (the same value seen by every worker, e.g. a shared file): then the
+    maximum is taken."""
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help, labels=(), callback=None, shared=False):
+        super().__init__(registry, name, help, labels)
+        self.callback = callback
+        self.shared = shared
+
+    def snapshot(self):
+        try:
+            values = self.callback() if self.callback else {}
+        except Exception as e:
+            logger.debug(f"Gauge {self.name} failed: {e}")
+            values = {}
+        return {json.dumps(k): v for k, v in values.items()}
+
+
+class Histogram(_Metric):
+    """Cumulative buckets are computed on export; in memory each series is
+    [count per bucket..., count above the last bucket, sum]."""
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        i = 0
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+
+class Registry:
+    def __init__(self, directory, flush_s):
+        self.metrics = {}
+        self.directory = Path(directory)
+        self.flush_s = flush_s
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def counter(self, name, help, labels=()):
+        return Counter(self, name, help, labels)
+
+    def gauge(self, name, help, labels=(), callback=None, shared=False):
+        return Gauge(self, name, help, labels, callback, shared)
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return Histogram(self, name, help, labels, buckets)
+
+    # ── Archivos por worker ────────────────────────────────────────────────────
+
+    def start(self):
+        """Start the flush thread of this worker (idempotent)."""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Un archivo con nuestro pid es de una ejecución anterior: se archiva
+        self._fold_dead(include_own=True)
+        self._thread = threading.Thread(target=self._run, name="metrics-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_s):
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning(f"Metrics flush failed: {e}")
+
+    def _snapshot(self):
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+    def flush(self):
+        """Write this worker's values to <pid>.json (atomic rename)."""
+        if self._pid != os.getpid():
+            return
+        with self._file_lock:
+            path = self.directory / f"{self._pid}.json"
+            tmp = path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(self._snapshot()))
+            os.replace(tmp, path)
+
+    def _locked(self):
+        lock = open(self.directory / '.lock', 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _fold_dead(self, include_own=False):
+        """Merge the counters/histograms of finished workers into dead.json."""
+        with self._locked():
+            dead_path = self.directory / 'dead.json'
+            dead = _read(dead_path)
+            folded = False
+            for path in self.directory.glob('[0-9]*.json'):
+                pid = int(path.stem)
+                if _alive(pid) and not (include_own and pid == os.getpid()):
+                    continue
+                _merge(dead, _read(path), self.metrics, with_gauges=False)
+                path.unlink(missing_ok=True)
+                folded = True
+            if folded:
+                tmp = dead_path.with_suffix('.tmp')
+                tmp.write_text(json.dumps(dead))
+                os.replace(tmp, dead_path)
+
+    def collect(self):
+        """Merged values of every worker: {name: {labels json: value}}."""
+        self.flush()
+        self._fold_dead()
+        merged = _read(self.directory / 'dead.json')
+        for path in self.directory.glob('[0-9]*.json'):
+            _merge(merged, _read(path), self.metrics, with_gauges=True)
+        return merged
+
+    def render(self):
+        """Prometheus text exposition (version 0.0.4)."""
+        merged = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(merged.get(name, {}).items()):
+                labels = list(zip(metric.labels, json.loads(key)))
+                if metric.kind != 'histogram':
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (math.inf,), value[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == math.inf else _number(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + [('le', le)])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _read(path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(into, values, metrics, with_gauges):
+    for name, series in values.items():
+        metric = metrics.get(name)
+        if metric is None or (metric.kind == 'gauge' and not with_gauges):
+            continue
+        target = into.setdefault(name, {})
+        for key, value in series.items():
+            if isinstance(value, list):
+                current = target.get(key)
+                target[key] = [a + b for a, b in zip(current, value)] if current else list(value)
+            elif metric.kind == 'gauge' and metric.shared:
+                target[key] = max(target.get(key, value), value)
+            else:
+                target[key] = target.get(key, 0) + value
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+registry = Registry(
+    settings.METRICS_DIR or os.path.join(tempfile.gettempdir(), "weather-metrics"),
+    settings.METRICS_FLUSH_S,
+)
+
+http_requests = registry.counter(
+    "weather_http_requests_total", "HTTP requests by route, method and status",
+    ("route", "method", "status"))
+http_latency = registry.histogram(
+    "weather_http_request_duration_seconds",
+    "Time to build the response (to the first byte for streams)", ("route", "method"))
+read_rows = registry.histogram(
+    "weather_read_rows", "weather_data rows read per request", ("route",), ROW_BUCKETS)
+ingest_rows = registry.counter(
+    "weather_ingest_rows_total", "Readings stored (rate() gives rows/s)")
+ingest_retries = registry.counter(
+    "weather_ingest_retries_total", "Failed write-behind flushes that were retried")
+ingest_dropped = registry.counter(
+    "weather_ingest_dropped_total", "Queued readings dropped because they cannot be stored")
+pool_wait = registry.histogram(
+    "weather_db_pool_checkout_seconds",
+    "Time to get a connection from the pool (queue wait + connect)", ("engine",), WAIT_BUCKETS)
+query_latency = registry.histogram(
+    "weather_db_statement_seconds",
+    "Statement time; for writes under contention it includes the SQLite lock wait (busy_timeout)",
+    ("engine", "op"), WAIT_BUCKETS)
+db_busy = registry.counter(
+    "weather_db_busy_errors_total", "Statements that failed with 'database is locked/busy'", ("engine",))
+
+
+def _networks(value):
+    networks = []
+    for item in filter(None, (v.strip() for v in value.split(','))):
+        try:
+            networks.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            logger.warning(f"METRICS_ALLOW: ignoring invalid network {item!r}")
+    return networks
+
+
+scrape_networks = _networks(settings.METRICS_ALLOW)
+
+
+def scrape_configured():
+    """/metrics is only served when a token or an allow-list is set."""
+    return bool(settings.METRICS_TOKEN or scrape_networks)
+
+
+def scrape_allowed(request):
+    """Bearer METRICS_TOKEN, or a client address in METRICS_ALLOW. The
+    address is the TCP peer, not X-Forwarded-For, which a client can set."""
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}".encode()
+        if hmac.compare_digest(request.headers.get("Authorization", "").encode(), expected):
+            return True
+    if scrape_networks:
+        try:
+            address = ipaddress.ip_address(request.remote_addr or "")
+        except ValueError:
+            return False
+        return any(address in network for network in scrape_networks)
+    return False
+
+
+def add_read_rows(n):
+    """Add n to the rows read by the current request (no-op outside one)."""
+    if has_request_context():
+        g.metrics_rows = g.get('metrics_rows', 0) + n
@@ -0,0 +1,107 @@
+"""Opt-in per-request SQL profiler (SQL_PROFILE=true).
+
+Counts the statements and DB time of each request and returns them in the
+Server-Timing and X-Query-Count headers. Statement shapes (the SQL text
+with IN lists collapsed) repeated SQL_N_PLUS_ONE_MIN or more times within
+one request are logged as likely N+1 loops, and statements slower than
+SQL_SLOW_MS go to the "sql.slow" logger with their EXPLAIN QUERY PLAN.
+
+Statements run by a streamed body (SSE, export) happen after the headers
+are sent: they still reach the slow log but not the headers."""
+import logging
+import re
+import time
+from collections import Counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from app.core.config import settings
+from app.core.database import engine, read_engine
+
+logger = logging.getLogger(__name__)
+slow_logger = logging.getLogger("sql.slow")
+
+# IN (?, ?, ?) y VALUES (...), (...) cambian de longitud con los datos
+_IN_LIST = re.compile(r"\((?:\?|%s|%\(\w+\)s)(?:,\s*(?:\?|%s|%\(\w+\)s))*\)")
+_VALUES_ROWS = re.compile(r"(\(\.\.\.\))(?:,\s*\(\.\.\.\))+")
+_SPACES = re.compile(r"\s+")
+
+
+def statement_shape(statement):
+    """SQL text with bound-parameter lists collapsed, whitespace normalized."""
+    shape = _IN_LIST.sub("(...)", statement)
+    return _SPACES.sub(" ", _VALUES_ROWS.sub(r"\1", shape)).strip()
+
+
+def _explain(cursor, statement, parameters):
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    explain = cursor.connection.cursor()
+    try:
+        explain.execute(prefix + statement, parameters)
+        return "\n".join("  " + " ".join(str(v) for v in row) for row in explain.fetchall())
+    except Exception as e:
+        return f"  (sin plan: {e})"
+    finally:
+        explain.close()
+
+
+def _before(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._profile_t0 = time.perf_counter()
+
+
+def _after(conn, cursor, statement, parameters, context, executemany):
+    t0 = getattr(context, "_profile_t0", None)
+    if t0 is None:
+        return
+    elapsed = time.perf_counter() - t0
+    if has_request_context():
+        profile = g.get("sql_profile")
+        if profile is not None:
+            profile["count"] += 1
+            profile["seconds"] += elapsed
+            profile["shapes"][statement_shape(statement)] += 1
+    if elapsed * 1000 >= settings.SQL_SLOW_MS:
+        where = f"{request.method} {request.path}" if has_request_context() else "-"
+        # Un executemany no tiene un único juego de parámetros que explicar
+        plan = "  (executemany)" if executemany else _explain(cursor, statement, parameters)
+        slow_logger.warning(
+            f"{elapsed * 1000:.1f} ms [{where}] {_SPACES.sub(' ', statement).strip()}\n"
+            f"  params: {str(parameters)[:300]}\n{plan}"
+        )
+
+
+def _start_request():
+    g.sql_profile = {"count": 0, "seconds": 0.0, "shapes": Counter(), "t0": time.perf_counter()}
+
+
+def _finish_request(response):
+    profile = g.pop("sql_profile", None)
+    if profile is None:
+        return response
+    total_ms = (time.perf_counter() - profile["t0"]) * 1000
+    db_ms = profile["seconds"] * 1000
+    response.headers["X-Query-Count"] = str(profile["count"])
+    response.headers.add(
+        "Server-Timing",
+        f'db;dur={db_ms:.1f};desc="{profile["count"]} queries", app;dur={total_ms - db_ms:.1f}'
+    )
+    repeated = [(n, shape) for shape, n in profile["shapes"].items()
+                if n >= settings.SQL_N_PLUS_ONE_MIN]
+    for n, shape in sorted(repeated, reverse=True):
+        logger.warning(f"Possible N+1 in {request.method} {request.path}: {n}x {shape[:300]}")
+    return response
+
+
+def install(app):
+    """Attach the engine events and the request hooks."""
+    for eng in {engine, read_engine}:
+        event.listen(eng, "before_cursor_execute", _before)
+        event.listen(eng, "after_cursor_execute", _after)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    logger.info(
+        f"SQL profiler on (slow >= {settings.SQL_SLOW_MS} ms, "
+        f"N+1 >= {settings.SQL_N_PLUS_ONE_MIN} repeats)"
+    )
@@ -0,0 +1,239 @@
+"""Response cache shared by every gunicorn worker, in a separate SQLite file.
+
+An entry holds a rendered 200 response (body, headers) under the request
+path plus its sorted query args. Entries belong to a scope (one station,
+or FLEET for responses that cover every station) and record the scope's
+generation when they were filled; writers bump the generation after
+committing, which makes every older entry of that scope stale at once,
+for all workers. Station CRUD and bulk loads bump FLEET too; ingest bumps
+it at most once per RESPONSE_CACHE_FLEET_INTERVAL_S, so a busy feed does
+not keep emptying the fleet-wide responses.
+
+Size is bounded by RESPONSE_CACHE_MAX_BYTES with LRU eviction on
+last_access (refreshed at most once a second per entry, so a hit is
+usually a single read). The file is memory-mapped; a cache error or a
+busy lock is treated as a miss, never as a failed request."""
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from app.core.config import settings
+from app.core import metrics
+from app.core.database import DATABASE_URL, IS_SQLITE, engine
+
+logger = logging.getLogger(__name__)
+
+FLEET = '*'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    scope TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    fleet_generation INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access);
+CREATE TABLE IF NOT EXISTS generations (
+    scope TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_GET = """
+SELECT e.status, e.headers, e.body, e.generation = coalesce(s.value, 0)
+       AND e.fleet_generation = coalesce(f.value, 0) AND e.expires > ?, e.last_access
+FROM entries e
+LEFT JOIN generations s ON s.scope = e.scope
+LEFT JOIN generations f ON f.scope = '*'
+WHERE e.key = ?
+"""
+
+_GENERATIONS = """
+SELECT coalesce((SELECT value FROM generations WHERE scope = ?), 0),
+       coalesce((SELECT value FROM generations WHERE scope = '*'), 0)
+"""
+
+# Cabeceras que no se guardan: las recalcula Flask o son por petición
+_SKIP_HEADERS = {'content-length', 'set-cookie', 'x-cache'}
+
+requests = metrics.registry.counter(
+    "weather_response_cache_requests_total", "Response cache lookups (hit, miss, stale)", ("result",))
+evictions = metrics.registry.counter(
+    "weather_response_cache_evictions_total", "Entries evicted to stay under RESPONSE_CACHE_MAX_BYTES")
+
+
+class SharedCache:
+    def __init__(self, path, max_bytes, max_entry_bytes, ttl):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            # Autocommit: las escrituras abren BEGIN IMMEDIATE explícito. Las
+            # lecturas no esperan nunca (WAL); las escrituras duran microsegundos
+            conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(f"PRAGMA mmap_size={self.max_bytes * 2}")
+            conn.executescript(_SCHEMA)
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @staticmethod
+    def key(path, args):
+        """Route plus sorted query args: ?a=1&b=2 and ?b=2&a=1 share an entry."""
+        return path + '?' + urlencode(sorted(args.items(multi=True)))
+
+    def get(self, key, scope):
+        """(entry or None, generations). entry is (status, headers, body);
+        generations must be passed to set() when filling a miss."""
+        try:
+            conn = self._conn()
+            now = time.time()
+            row = conn.execute(_GET, (now, key)).fetchone()
+            if row and row[3]:
+                if row[4] < now - 1:
+                    self._touch(conn, key, now)
+                requests.inc('hit')
+                return (row[0], _decode_headers(row[1]), row[2]), None
+            requests.inc('stale' if row else 'miss')
+            return None, conn.execute(_GENERATIONS, (scope,)).fetchone()
+        except sqlite3.Error as e:
+            logger.debug(f"Response cache get failed: {e}")
+            return None, None
+
+    @staticmethod
+    def _touch(conn, key, now):
+        try:
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+        except sqlite3.Error:
+            pass
+
+    def set(self, key, scope, generations, status, headers, body):
+        """Store a response filled under `generations` (from get())."""
+        size = len(body) + len(key)
+        if generations is None or size > self.max_entry_bytes:
+            return
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, scope, generations[0], generations[1], status,
+                     _encode_headers(headers), body, size, now + self.ttl, now)
+                )
+                self._evict(conn, now)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.debug(f"Response cache set failed: {e}")
+
+    def _evict(self, conn, now):
+        total = conn.execute("SELECT coalesce(sum(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Primero lo caducado, luego lo menos usado hasta quedar en el 90 %
+        conn.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        total = conn.execute("SELECT coalesce(sum(size), 0) FROM entries").fetchone()[0]
+        target = self.max_bytes * 0.9
+        removed = 0
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if total <= target:
+                break
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        if removed:
+            evictions.inc(amount=removed)
+
+    def bump(self, station_ids=(), fleet=True):
+        """Invalidate the entries of these stations and, with fleet, every
+        FLEET entry. Call after the change is committed."""
+        scopes = [(sid,) for sid in set(station_ids)] + ([(FLEET,)] if fleet else [])
+        if not scopes:
+            return
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO generations (scope, value) VALUES (?, 1) "
+                    "ON CONFLICT (scope) DO UPDATE SET value = value + 1", scopes
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            # Sin bump una entrada podría servir datos viejos: mejor vaciar
+            logger.warning(f"Response cache bump failed, clearing: {e}")
+            self.clear()
+
+    def clear(self):
+        """Drop every entry (e.g. after a purge removed old readings)."""
+        for attempt in range(3):
+            try:
+                self._conn().execute("DELETE FROM entries")
+                return
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache clear failed (attempt {attempt + 1}): {e}")
+                time.sleep(0.1)
+
+    def usage(self):
+        """Entry count and bytes currently stored."""
+        count, size = self._conn().execute(
+            "SELECT count(*), coalesce(sum(size), 0) FROM entries").fetchone()
+        return {'entries': count, 'bytes': size}
+
+
+def default_path():
+    """Next to the SQLite database (<db>.response-cache), or in the temp
+    directory under a hash of DATABASE_URL: two databases on one host must
+    never share entries or generations."""
+    if IS_SQLITE and engine.url.database not in (None, '', ':memory:'):
+        return os.path.abspath(engine.url.database) + ".response-cache"
+    digest = hashlib.sha1(DATABASE_URL.encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"weather-response-cache-{digest}.db")
+
+
+def _encode_headers(headers):
+    return "\n".join(f"{k}: {v}" for k, v in headers if k.lower() not in _SKIP_HEADERS)
+
+
+def _decode_headers(text):
+    return [tuple(line.split(": ", 1)) for line in text.split("\n") if line]
+
+
+response_cache = SharedCache(
+    settings.RESPONSE_CACHE_PATH or default_path(),
+    max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    max_entry_bytes=settings.RESPONSE_CACHE_MAX_ENTRY_BYTES,
+    ttl=settings.RESPONSE_CACHE_TTL_S,
+)
+
+metrics.registry.gauge(
+    "weather_response_cache_bytes", "Bytes held by the shared response cache",
+    callback=lambda: {(): response_cache.usage()['bytes']}, shared=True)
+metrics.registry.gauge(
+    "weather_response_cache_entries", "Entries in the shared response cache",
+    callback=lambda: {(): response_cache.usage()['entries']}, shared=True)
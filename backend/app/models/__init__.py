@@ -1,3 +1,9 @@
-from app.models.station import WeatherStation, WeatherData
+from app.models.station import (
+    WeatherStation, WeatherData, StationLatest, WeatherRollupHourly, WeatherRollupDaily,
+    SystemCounter, SystemRollupHourly, WeatherPartition
+)
 
-__all__ = ["WeatherStation", "WeatherData"]
+__all__ = [
+    "WeatherStation", "WeatherData", "StationLatest", "WeatherRollupHourly", "WeatherRollupDaily",
+    "SystemCounter", "SystemRollupHourly", "WeatherPartition"
+]
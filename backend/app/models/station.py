@@ -26,6 +26,7 @@ class WeatherStation(Base):
     
     # Relationships
     data_points = relationship("WeatherData", back_populates="station", cascade="all, delete-orphan")
+    latest = relationship("StationLatest", uselist=False, cascade="all, delete-orphan")
     
     __table_args__ = (
         Index('idx_station_active_updated', 'active', 'updated_at'),
@@ -66,4 +67,77 @@ class WeatherData(Base):
     __table_args__ = (
         Index('idx_data_station_timestamp', 'station_id', 'timestamp'),
         Index('idx_data_timestamp', 'timestamp'),
+        # Los ids no se reutilizan aunque la tabla se vacíe: las particiones los conservan
+        {'sqlite_autoincrement': True},
     )
+
+class StationLatest(Base):
+    """Pointer to each station's newest reading, kept up to date by ingest."""
+    __tablename__ = "station_latest"
+    
+    station_id = Column(String(36), ForeignKey("weather_stations.id"), primary_key=True)
+    data_id = Column(Integer, ForeignKey("weather_data.id"), nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+
+class _RollupColumns:
+    """Mergeable aggregates for one station and one time bucket."""
+    station_id = Column(String(36), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    
+    temperature_sum = Column(Float, nullable=False, default=0.0)
+    temperature_sumsq = Column(Float, nullable=False, default=0.0)
+    temperature_min = Column(Float, nullable=True)
+    temperature_max = Column(Float, nullable=True)
+    
+    humidity_sum = Column(Float, nullable=False, default=0.0)
+    humidity_sumsq = Column(Float, nullable=False, default=0.0)
+    humidity_min = Column(Float, nullable=True)
+    humidity_max = Column(Float, nullable=True)
+    
+    wind_speed_sum = Column(Float, nullable=False, default=0.0)
+    wind_speed_sumsq = Column(Float, nullable=False, default=0.0)
+    wind_speed_min = Column(Float, nullable=True)
+    wind_speed_max = Column(Float, nullable=True)
+    
+    rainfall_sum = Column(Float, nullable=False, default=0.0)
+    wind_gust_max = Column(Float, nullable=True)
+
+class WeatherRollupHourly(_RollupColumns, Base):
+    __tablename__ = "weather_rollup_hourly"
+    
+    __table_args__ = (
+        Index('idx_rollup_hourly_bucket', 'bucket_start'),
+    )
+
+class WeatherRollupDaily(_RollupColumns, Base):
+    __tablename__ = "weather_rollup_daily"
+    
+    __table_args__ = (
+        Index('idx_rollup_daily_bucket', 'bucket_start'),
+    )
+
+class SystemCounter(Base):
+    """Running totals (stations, records) maintained by ingest and station CRUD."""
+    __tablename__ = "system_counters"
+    
+    name = Column(String(50), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+class SystemRollupHourly(Base):
+    """Fleet-wide hourly totals used for the 24 h figures of the overview."""
+    __tablename__ = "system_rollup_hourly"
+    
+    bucket_start = Column(DateTime, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+    temperature_sum = Column(Float, nullable=False, default=0.0)
+
+class WeatherPartition(Base):
+    """Registry of monthly weather_data partitions: readings with
+    month_start <= timestamp < month_end live in table `name`."""
+    __tablename__ = "weather_partitions"
+    
+    name = Column(String(32), primary_key=True)
+    month_start = Column(DateTime, nullable=False, unique=True)
+    month_end = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=_utcnow)
@@ -0,0 +1,344 @@
+"""Bulk loads into weather_data: synthetic history and CSV archives.
+
+Readings travel as NumPy column batches, are written with a driver-level
+executemany of multi-row INSERTs and committed every commit_rows rows.
+Rollups and counters are updated per batch from the same arrays
+(rollups.apply_rollup_columns)
+and station_latest once at the end, instead of per reading as on the
+ingest path. With drop_indexes the secondary indexes of weather_data are dropped
+for the load and rebuilt afterwards: one sort per index instead of a
+B-tree insert per row. Meant for maintenance windows: while the indexes
+are gone the dashboard queries scan the table."""
+import csv
+import logging
+import sqlite3
+import time
+import uuid
+import warnings
+from datetime import datetime
+from itertools import islice
+from operator import itemgetter
+
+import numpy as np
+from sqlalchemy import or_, update
+
+from app.core.config import settings
+from app.core.database import IS_SQLITE, SessionLocal, engine
+from app.core.shared_cache import response_cache
+from app.models.station import WeatherStation, WeatherData
+from app.services.counters import bump
+from app.services.derived import DERIVED, INPUTS, derive
+from app.services.ingest import _parse_timestamp, existing_station_ids
+from app.services.latest import rebuild_latest
+from app.services.rollups import apply_rollup_columns, stored_datetimes
+from app.services.spatial import index_station
+
+logger = logging.getLogger(__name__)
+
+FLOAT_COLUMNS = ['temperature', 'humidity', 'wind_speed_ms', 'wind_gust_ms',
+                 'wind_direction_degrees', 'total_rainfall', 'rain_rate_mm_per_hour']
+INSERT_COLUMNS = ['station_id', 'timestamp'] + FLOAT_COLUMNS + ['total_tips'] + DERIVED
+
+
+# ── Loader ─────────────────────────────────────────────────────────────────────
+
+def bulk_load(batches, drop_indexes=True, commit_rows=500_000):
+    """Insert column batches into weather_data and return a report dict.
+
+    A batch is a dict with 'station_id' (str or sequence of str),
+    'timestamp' (datetime64 array), every FLOAT_COLUMNS array and
+    'total_tips' (int array). Derived columns are computed here."""
+    t0 = time.monotonic()
+    insert = _Insert(len(INSERT_COLUMNS))
+    indexes = sorted(WeatherData.__table__.indexes, key=lambda i: i.name) if drop_indexes else []
+    total = 0
+    newest = {}
+    index_s = 0.0
+
+    # Una sola conexión de Core: el PRAGMA queda en la conexión que carga
+    with engine.connect() as conn:
+        if IS_SQLITE:
+            conn.exec_driver_sql("PRAGMA synchronous=OFF")
+        for index in indexes:
+            index.drop(bind=conn, checkfirst=True)
+        conn.commit()
+        try:
+            pending = 0
+            for batch in batches:
+                n = len(batch['timestamp'])
+                if not n:
+                    continue
+                stations = batch['station_id']
+                _track_newest(newest, stations, batch['timestamp'])
+                floats = {c: np.asarray(batch[c], dtype=np.float64) for c in FLOAT_COLUMNS}
+                values = derive(*[floats[c] for c in INPUTS])
+                insert(conn, [
+                    stations, stored_datetimes(batch['timestamp']),
+                    *[floats[c] for c in FLOAT_COLUMNS],
+                    np.asarray(batch['total_tips'], dtype=np.int64),
+                    *[values[name] for name in DERIVED],
+                ])
+                apply_rollup_columns(conn, batch['station_id'], batch['timestamp'], floats)
+                pending += n
+                if pending >= commit_rows:
+                    _finish_transaction(conn, pending)
+                    total += pending
+                    pending = 0
+                    logger.info(f"Bulk load: {total} rows, {total / (time.monotonic() - t0):.0f} rows/s")
+            if pending:
+                _finish_transaction(conn, pending)
+                total += pending
+        finally:
+            conn.rollback()
+            t1 = time.monotonic()
+            for index in indexes:
+                index.create(bind=conn, checkfirst=True)
+            conn.commit()
+            index_s = time.monotonic() - t1
+            if IS_SQLITE and settings.SQLITE_SYNCHRONOUS:
+                conn.exec_driver_sql(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+
+    with SessionLocal() as db:
+        _touch_stations(db, newest)
+        rebuild_latest(db)
+    response_cache.bump(newest)
+
+    seconds = time.monotonic() - t0
+    report = {
+        "rows": total,
+        "stations": len(newest),
+        "index_seconds": round(index_s, 2),
+        "seconds": round(seconds, 2),
+        "rows_per_s": round(total / seconds) if seconds else 0,
+    }
+    logger.info("Bulk load: " + ", ".join(f"{k}={v}" for k, v in report.items()))
+    return report
+
+
+def _track_newest(newest, stations, timestamps):
+    """Keep newest[station] = latest timestamp loaded for it."""
+    if isinstance(stations, str):
+        names, latest = [stations], [timestamps.max()]
+    else:
+        names, codes = np.unique(np.asarray(stations), return_inverse=True)
+        latest = np.full(len(names), np.iinfo(np.int64).min)
+        np.maximum.at(latest, codes, timestamps.astype('datetime64[us]').astype(np.int64))
+        latest = latest.astype('datetime64[us]')
+    for sid, ts in zip(names, latest):
+        if sid not in newest or ts > newest[sid]:
+            newest[sid] = ts
+
+
+class _Insert:
+    """executemany of a multi-row INSERT: ROWS_PER_STATEMENT rows per
+    execution instead of one roughly halves SQLite's per-row cost (statement
+    step, sqlite_sequence update of AUTOINCREMENT)."""
+
+    ROWS_PER_STATEMENT = 200
+
+    def __init__(self, n_columns):
+        mark = '?' if IS_SQLITE else '%s'
+        # SQLite < 3.32 admite 999 parámetros por sentencia
+        limit = 999 if IS_SQLITE and sqlite3.sqlite_version_info < (3, 32) else 32766
+        self.per = max(1, min(self.ROWS_PER_STATEMENT, limit // n_columns))
+        self.n_columns = n_columns
+        row = f"({', '.join([mark] * n_columns)})"
+        head = f"INSERT INTO weather_data ({', '.join(INSERT_COLUMNS)}) VALUES "
+        self.one = head + row
+        self.many = head + ', '.join([row] * self.per)
+
+    def __call__(self, conn, columns):
+        """columns: one sequence (or scalar) per INSERT_COLUMNS entry."""
+        n = len(columns[1])
+        params = np.empty((n, self.n_columns), dtype=object)
+        for j, values in enumerate(columns):
+            params[:, j] = values
+        full = n - n % self.per
+        if full:
+            groups = params[:full].reshape(-1, self.per * self.n_columns)
+            conn.exec_driver_sql(self.many, list(map(tuple, groups)))
+        if full < n:
+            conn.exec_driver_sql(self.one, list(map(tuple, params[full:])))
+
+
+def _finish_transaction(conn, rows):
+    bump(conn, total_records=rows)
+    conn.commit()
+
+
+def _touch_stations(db, newest):
+    for sid, ts in newest.items():
+        ts = ts.astype('datetime64[us]').astype(datetime)
+        db.execute(
+            update(WeatherStation)
+            .where(WeatherStation.id == sid)
+            .where(or_(WeatherStation.last_data_time.is_(None), WeatherStation.last_data_time < ts))
+            .values(last_data_time=ts),
+            execution_options={"synchronize_session": False},
+        )
+    db.commit()
+
+
+# ── Synthetic history ──────────────────────────────────────────────────────────
+
+def create_stations(count, prefix='synth'):
+    """Create `count` demo stations and return their ids."""
+    with SessionLocal() as db:
+        ids = []
+        for i in range(count):
+            station = WeatherStation(
+                id=str(uuid.uuid4()), name=f"{prefix}_{i:04d}", location="Sintética",
+                latitude=19.4326 + np.random.uniform(-1, 1), longitude=-99.1332 + np.random.uniform(-1, 1),
+            )
+            db.add(station)
+            index_station(db, station.id, station.latitude, station.longitude)
+            ids.append(station.id)
+        bump(db, total_stations=count, active_stations=count)
+        db.commit()
+    return ids
+
+
+def _rain_mask(rng, n, probability):
+    """Rain events like the simulator: an event starts with `probability`
+    per reading and lasts 3 to 7 readings."""
+    starts = np.flatnonzero(rng.random(n) < probability)
+    edges = np.zeros(n + 8, dtype=np.int64)
+    np.add.at(edges, starts, 1)
+    np.add.at(edges, starts + rng.integers(3, 8, len(starts)), -1)
+    return np.cumsum(edges)[:n] > 0
+
+
+def synthetic_series(rng, times, rain_probability=0.10):
+    """Column batch for datetime64[s] times, using the sensor model of
+    simulate_station.sensor_reading (diurnal temperature 15-32 °C,
+    humidity inversely correlated, light wind, random rain events),
+    vectorized."""
+    n = len(times)
+    hour = (times.astype(np.int64) / 3600) % 24
+    cycle = np.sin(np.pi * (hour - 6) / 12)
+    wind = np.abs(rng.normal(3.5, 1.2, n))
+    rain = _rain_mask(rng, n, rain_probability)
+    rain_rate = np.where(rain, rng.uniform(0.5, 8.0, n), 0.0)
+    return {
+        'timestamp': times,
+        'temperature': np.round(23.5 + 8.5 * cycle + rng.normal(0, 0.4, n), 2),
+        'humidity': np.round(np.clip(65 - 18 * cycle + rng.normal(0, 1.5, n), 20.0, 100.0), 2),
+        'wind_speed_ms': np.round(wind, 2),
+        'wind_gust_ms': np.round(wind + np.abs(rng.normal(1.5, 0.8, n)), 2),
+        'wind_direction_degrees': np.round((180 + rng.normal(0, 30, n)) % 360, 1),
+        'rain_rate_mm_per_hour': np.round(rain_rate, 2),
+        'total_tips': np.where(rain, rng.integers(1, 5, n), 0),
+        'total_rainfall': np.round(rain_rate / 2, 2),
+    }
+
+
+def synthetic_batches(station_ids, start, end, interval_s=300, chunk=100_000, seed=None,
+                      rain_probability=0.10):
+    """Yield column batches with one reading every interval_s seconds per
+    station in [start, end), station by station."""
+    rng = np.random.default_rng(seed)
+    first = np.datetime64(start, 's')
+    count = int((np.datetime64(end, 's') - first) // np.timedelta64(interval_s, 's'))
+    for sid in station_ids:
+        for offset in range(0, count, chunk):
+            steps = np.arange(offset, min(offset + chunk, count), dtype=np.int64) * interval_s
+            batch = synthetic_series(rng, first + steps.astype('timedelta64[s]'), rain_probability)
+            batch['station_id'] = sid
+            yield batch
+
+
+# ── CSV import ─────────────────────────────────────────────────────────────────
+
+class CsvSource:
+    """Column batches from a CSV with a header row (the format of
+    /bulk/export?format=csv works as is; id and derived columns are
+    ignored). Rows with an unknown station, unparsable or non-finite
+    values or an empty temperature are counted in .rejected and skipped."""
+
+    DEFAULTS = {c: 0.0 for c in FLOAT_COLUMNS}
+
+    def __init__(self, path, station_id=None, chunk=100_000):
+        self.path = path
+        self.station_id = station_id
+        self.chunk = chunk
+        self.rejected = 0
+        self.known = set()
+
+    def __iter__(self):
+        with open(self.path, newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            col = {name.strip(): i for i, name in enumerate(header)}
+            if 'temperature' not in col or 'timestamp' not in col:
+                raise ValueError(f"{self.path}: el CSV necesita columnas timestamp y temperature")
+            if self.station_id is None and 'station_id' not in col:
+                raise ValueError(f"{self.path}: falta la columna station_id (o usa --station-id)")
+            while True:
+                rows = list(islice(reader, self.chunk))
+                if not rows:
+                    break
+                yield self._batch(rows, col)
+
+    def _batch(self, rows, col):
+        if self.station_id is None:
+            stations = [r[col['station_id']] for r in rows]
+        else:
+            stations = [self.station_id] * len(rows)
+        with SessionLocal() as db:
+            self.known |= existing_station_ids(db, set(stations) - self.known)
+        try:
+            batch = self._columns(rows, col)
+        except (ValueError, IndexError):
+            batch, rows, stations = self._row_by_row(rows, col, stations)
+        keep = np.fromiter((s in self.known for s in stations), dtype=bool, count=len(stations))
+        # float() acepta "nan" e "inf": NaN rompería el NOT NULL a mitad de la carga
+        for name in FLOAT_COLUMNS + ['total_tips']:
+            keep &= np.isfinite(batch[name])
+        self.rejected += int((~keep).sum())
+        batch = {name: values[keep] for name, values in batch.items()}
+        batch['total_tips'] = batch['total_tips'].astype(np.int64)
+        stations = [s for s, k in zip(stations, keep) if k]
+        # Un archivo por estación es lo habitual: un id escalar evita agrupar por cadena
+        batch['station_id'] = stations[0] if len(set(stations)) == 1 else stations
+        return batch
+
+    def _columns(self, rows, col):
+        """Fast path: whole columns converted by NumPy."""
+        # Solo las columnas usadas: zip(*rows) transpondría también las derivadas
+        def column(name):
+            return list(map(itemgetter(col[name]), rows))
+
+        batch = {}
+        for name in FLOAT_COLUMNS:
+            batch[name] = (np.array(column(name), dtype=np.float64) if name in col
+                           else np.full(len(rows), self.DEFAULTS[name]))
+        batch['total_tips'] = (np.array(column('total_tips'), dtype=np.float64)
+                               if 'total_tips' in col else np.zeros(len(rows)))
+        with warnings.catch_warnings():
+            # Los desplazamientos de zona se convierten a UTC, como en la ingesta
+            warnings.simplefilter('ignore')
+            batch['timestamp'] = np.array(column('timestamp'), dtype='datetime64[us]')
+        if np.isnat(batch['timestamp']).any():
+            raise ValueError("empty timestamp")
+        return batch
+
+    def _row_by_row(self, rows, col, stations):
+        """Slow path for a chunk with bad values: parse each row, drop the bad ones."""
+        good, good_stations = [], []
+        for row, sid in zip(rows, stations):
+            try:
+                ts = _parse_timestamp(row[col['timestamp']])
+                values = {name: (float(row[col[name]]) if name in col and row[col[name]] != ''
+                                 else self.DEFAULTS[name]) for name in FLOAT_COLUMNS}
+                if 'temperature' not in col or row[col['temperature']] == '':
+                    raise ValueError("temperature")
+                tips = float(row[col['total_tips']] or 0) if 'total_tips' in col else 0.0
+            except (ValueError, IndexError, TypeError):
+                self.rejected += 1
+                continue
+            good.append((ts, tips, values))
+            good_stations.append(sid)
+        batch = {name: np.array([v[name] for _, _, v in good], dtype=np.float64) for name in FLOAT_COLUMNS}
+        batch['total_tips'] = np.array([t for _, t, _ in good], dtype=np.float64)
+        batch['timestamp'] = np.array([ts for ts, _, _ in good], dtype='datetime64[us]')
+        return batch, good, good_stations
@@ -0,0 +1,50 @@
+"""system_counters: running totals so the overview never scans whole tables."""
+import logging
+
+from app.core.database import dialect_insert
+from app.models.station import WeatherStation, SystemCounter
+from app.services.partitions import count_rows
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('total_stations', 'active_stations', 'total_records')
+
+
+def bump(db, **deltas):
+    """Add deltas to counters inside the caller's transaction,
+    e.g. bump(db, total_records=len(rows))."""
+    rows = [{'name': name, 'value': delta} for name, delta in deltas.items() if delta]
+    if not rows:
+        return
+    table = SystemCounter.__table__
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.name],
+        set_={'value': table.c.value + stmt.excluded.value},
+    )
+    db.execute(stmt, rows)
+
+
+def read_counters(db):
+    values = dict(db.query(SystemCounter.name, SystemCounter.value).all())
+    return {name: values.get(name, 0) for name in COUNTERS}
+
+
+def rebuild_counters(db):
+    """Recompute every counter with COUNT(*) queries (all partitions)."""
+    values = {
+        'total_stations': db.query(WeatherStation).count(),
+        'active_stations': db.query(WeatherStation).filter(WeatherStation.active == True).count(),
+        'total_records': count_rows(db),
+    }
+    db.query(SystemCounter).delete()
+    db.add_all([SystemCounter(name=k, value=v) for k, v in values.items()])
+    db.commit()
+    logger.info("Counters rebuilt: " + ", ".join(f"{k}={v}" for k, v in values.items()))
+    return values
+
+
+def ensure_counters(db):
+    """Seed the counters on first start against an existing database."""
+    if db.query(SystemCounter.name).first() is None:
+        rebuild_counters(db)
@@ -0,0 +1,281 @@
+"""Server-side downsampling of a station's series.
+
+Readings are streamed in chunks as NumPy arrays and reduced into a fixed
+number of time buckets, so memory and payload depend on the number of
+buckets requested, not on how often the station reports."""
+import math
+import re
+from itertools import chain
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import case, select
+
+from app.core.database import epoch_seconds
+from app.core.metrics import add_read_rows
+from app.models.station import WeatherData
+from app.services.partitions import route
+
+MAX_BUCKETS = 10000
+CHUNK_SIZE = 50000
+
+# campo de salida -> columna de weather_data
+SERIES = {
+    'temperature': WeatherData.temperature,
+    'humidity': WeatherData.humidity,
+    'wind_speed_ms': WeatherData.wind_speed_ms,
+    'wind_gust_ms': WeatherData.wind_gust_ms,
+    'wind_direction_degrees': WeatherData.wind_direction_degrees,
+    'total_rainfall': WeatherData.total_rainfall,
+    'rain_rate_mm_per_hour': WeatherData.rain_rate_mm_per_hour,
+}
+
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_EPOCH = datetime(1970, 1, 1)
+
+
+def parse_resolution(value):
+    """'300', '300s', '5m', '1h' or '1d' -> timedelta. Raises ValueError."""
+    match = re.fullmatch(r'\s*(\d+)\s*([smhd]?)\s*', str(value))
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError("Invalid resolution, use e.g. 300, 5m, 1h or 1d")
+    return timedelta(seconds=int(match.group(1)) * _UNITS[match.group(2) or 's'])
+
+
+def iter_arrays(db, stmt, columns, chunk_size=CHUNK_SIZE):
+    """Execute a column-only select and yield {name: ndarray} per chunk.
+    NULLs become NaN."""
+    # Core (db.connection()) en lugar de Session.execute: sin capa de carga ORM
+    result = db.connection().execute(stmt.execution_options(yield_per=chunk_size))
+    width = len(columns)
+    for part in result.partitions(chunk_size):
+        add_read_rows(len(part))
+        # fromiter sobre los valores planos evita que NumPy inspeccione cada Row
+        try:
+            flat = np.fromiter(chain.from_iterable(part), dtype=np.float64, count=len(part) * width)
+        except TypeError:
+            flat = np.array([np.nan if v is None else v for v in chain.from_iterable(part)],
+                            dtype=np.float64)
+        block = flat.reshape(len(part), width)
+        yield {name: block[:, i] for i, name in enumerate(columns)}
+
+
+def series_select(*filters):
+    """Epoch seconds + every numeric series, oldest first.
+    Column names for iter_arrays: ['t'] + list(SERIES)."""
+    cols = [epoch_seconds(WeatherData.timestamp)] + list(SERIES.values())
+    return select(*cols).where(*filters).order_by(WeatherData.timestamp)
+
+
+def to_epoch(dt):
+    return (dt - _EPOCH).total_seconds()
+
+
+def epoch_to_iso(seconds):
+    return (_EPOCH + timedelta(seconds=float(seconds))).isoformat()
+
+
+def bucketize(chunks, start, end, width):
+    """Average/min/max per bucket of width seconds over [start, end).
+
+    Returns one dict per non-empty bucket, oldest first. Wind direction is
+    averaged as a vector; rainfall is summed; gusts and rain rate keep the max."""
+    if (end - start) / width > MAX_BUCKETS:
+        width = (end - start) / MAX_BUCKETS
+    n = max(1, math.ceil((end - start) / width))
+    counts = np.zeros(n, dtype=np.int64)
+    sums = {k: np.zeros(n) for k in SERIES}
+    mins = {k: np.full(n, np.inf) for k in SERIES}
+    maxs = {k: np.full(n, -np.inf) for k in SERIES}
+    dir_x = np.zeros(n)
+    dir_y = np.zeros(n)
+
+    for arr in chunks:
+        idx = ((arr['t'] - start) // width).astype(np.int64)
+        keep = (idx >= 0) & (idx < n)
+        idx = idx[keep]
+        counts += np.bincount(idx, minlength=n)
+        for k in SERIES:
+            v = arr[k][keep]
+            sums[k] += np.bincount(idx, weights=v, minlength=n)
+            np.minimum.at(mins[k], idx, v)
+            np.maximum.at(maxs[k], idx, v)
+        rad = np.radians(arr['wind_direction_degrees'][keep])
+        dir_x += np.bincount(idx, weights=np.cos(rad), minlength=n)
+        dir_y += np.bincount(idx, weights=np.sin(rad), minlength=n)
+
+    filled = np.flatnonzero(counts)
+    c = counts[filled]
+    avg = {k: sums[k][filled] / c for k in SERIES}
+    direction = np.degrees(np.arctan2(dir_y[filled], dir_x[filled])) % 360
+
+    out = []
+    for j, b in enumerate(filled):
+        item = {
+            'timestamp': epoch_to_iso(start + b * width),
+            'count': int(c[j]),
+        }
+        for k in ('temperature', 'humidity', 'wind_speed_ms'):
+            item[k] = round(float(avg[k][j]), 2)
+            item[f'{k}_min'] = round(float(mins[k][b]), 2)
+            item[f'{k}_max'] = round(float(maxs[k][b]), 2)
+        item['wind_gust_ms'] = round(float(maxs['wind_gust_ms'][b]), 2)
+        item['wind_direction_degrees'] = round(float(direction[j]), 1) % 360
+        item['total_rainfall'] = round(float(sums['total_rainfall'][b]), 2)
+        item['rain_rate_mm_per_hour'] = round(float(maxs['rain_rate_mm_per_hour'][b]), 2)
+        out.append(item)
+    return out
+
+
+# ── Rejilla común para varias estaciones ─────────────────────────────────────
+
+FILLS = ('none', 'ffill', 'linear')
+# Cómo se resume cada serie dentro de un intervalo (como en bucketize)
+_ALIGN_HOW = {
+    'temperature': 'mean',
+    'humidity': 'mean',
+    'wind_speed_ms': 'mean',
+    'wind_gust_ms': 'max',
+    'wind_direction_degrees': 'direction',
+    'total_rainfall': 'sum',
+    'rain_rate_mm_per_hour': 'max',
+}
+
+
+def aligned_select(station_ids, fields, *filters):
+    """Epoch seconds, the station's position in station_ids and the given
+    series. Column names for iter_arrays: ['t', 's'] + fields."""
+    position = case({sid: i for i, sid in enumerate(station_ids)}, value=WeatherData.station_id)
+    return select(epoch_seconds(WeatherData.timestamp), position,
+                  *[SERIES[f] for f in fields]).where(*filters)
+
+
+def align(chunks, n_stations, start, width, n, fields, fill='none'):
+    """Resample readings of several stations onto the grid start + i * width
+    (i < n) in one pass: every row lands in cell station * n + bucket and
+    each field is reduced with bincount (or maximum.at), O(rows).
+
+    Returns ({field: (n_stations, n) array, NaN where no data}, counts).
+    fill='ffill' carries the last value forward, 'linear' interpolates
+    between known cells; neither extrapolates, and total_rainfall (a sum
+    per interval) is never filled."""
+    cells = n_stations * n
+    counts = np.zeros(cells, dtype=np.int64)
+    sums = {f: np.zeros(cells) for f in fields}
+    seen = {f: np.zeros(cells, dtype=np.int64) for f in fields}
+    maxs = {f: np.full(cells, -np.inf) for f in fields if _ALIGN_HOW[f] == 'max'}
+    dir_x, dir_y = np.zeros(cells), np.zeros(cells)
+
+    for arr in chunks:
+        bucket = np.floor((arr['t'] - start) / width).astype(np.int64)
+        keep = (bucket >= 0) & (bucket < n)
+        flat = arr['s'][keep].astype(np.int64) * n + bucket[keep]
+        counts += np.bincount(flat, minlength=cells)
+        for f in fields:
+            v = arr[f][keep]
+            valid = ~np.isnan(v)
+            idx, v = flat[valid], v[valid]
+            seen[f] += np.bincount(idx, minlength=cells)
+            how = _ALIGN_HOW[f]
+            if how == 'max':
+                np.maximum.at(maxs[f], idx, v)
+            elif how == 'direction':
+                rad = np.radians(v)
+                dir_x += np.bincount(idx, weights=np.cos(rad), minlength=cells)
+                dir_y += np.bincount(idx, weights=np.sin(rad), minlength=cells)
+            else:
+                sums[f] += np.bincount(idx, weights=v, minlength=cells)
+
+    out = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for f in fields:
+            how = _ALIGN_HOW[f]
+            empty = seen[f] == 0
+            if how == 'direction':
+                # Media vectorial; se rellena sobre las componentes para no saltar de 359° a 0°
+                x = np.where(empty, np.nan, dir_x / seen[f]).reshape(n_stations, n)
+                y = np.where(empty, np.nan, dir_y / seen[f]).reshape(n_stations, n)
+                x, y = _fill(x, fill), _fill(y, fill)
+                out[f] = np.degrees(np.arctan2(y, x)) % 360
+                continue
+            if how == 'max':
+                values = maxs[f]
+            elif how == 'sum':
+                values = sums[f]
+            else:
+                values = sums[f] / seen[f]
+            values = np.where(empty, np.nan, values).reshape(n_stations, n)
+            out[f] = values if how == 'sum' else _fill(values, fill)
+    return out, counts.reshape(n_stations, n)
+
+
+def _fill(a, fill):
+    if fill == 'none' or a.shape[1] == 0:
+        return a
+    n = a.shape[1]
+    cols = np.arange(n)
+    rows = np.arange(a.shape[0])[:, None]
+    known = ~np.isnan(a)
+    # Índice de la última celda conocida a la izquierda (0 si ninguna: sigue NaN)
+    prev = np.maximum.accumulate(np.where(known, cols, 0), axis=1)
+    if fill == 'ffill':
+        return a[rows, prev]
+    # ... y de la primera a la derecha (n si ninguna)
+    nxt = np.minimum.accumulate(np.where(known, cols, n)[:, ::-1], axis=1)[:, ::-1]
+    inside = ~known & known[rows, prev] & (nxt < n)
+    right = np.minimum(nxt, n - 1)
+    weight = (cols - prev) / np.maximum(right - prev, 1)
+    interpolated = a[rows, prev] + (a[rows, right] - a[rows, prev]) * weight
+    return np.where(inside, interpolated, a)
+
+
+def matrix_lists(values, digits):
+    """2-D float array -> nested lists for JSON, NaN as None."""
+    out = np.round(values, digits).astype(object)
+    out[np.isnan(values)] = None
+    return out.tolist()
+
+
+def lttb_ids(db, filters, field, n_out, start=None, end=None):
+    """ids of the readings LTTB keeps for one series. Only (t, value, id)
+    arrays are held in memory while the window [start, end) is scanned."""
+    stmt = select(epoch_seconds(WeatherData.timestamp), SERIES[field], WeatherData.id) \
+        .where(*filters).order_by(WeatherData.timestamp)
+    parts = list(iter_arrays(db, route(db, stmt, start, end), ['t', 'y', 'id']))
+    if not parts:
+        return []
+    x = np.concatenate([p['t'] for p in parts])
+    y = np.concatenate([p['y'] for p in parts])
+    ids = np.concatenate([p['id'] for p in parts]).astype(np.int64)
+    return ids[lttb(x, y, min(n_out, MAX_BUCKETS))].tolist()
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets: indices of n_out points that keep the
+    visual shape of (x, y). x must be sorted. The loop runs once per output
+    bucket; the work inside each bucket is vectorized."""
+    size = len(x)
+    if n_out >= size or n_out < 3:
+        return np.arange(size)
+
+    every = (size - 2) / (n_out - 2)
+    bounds = (np.arange(n_out - 1) * every).astype(np.int64) + 1
+    bounds[-1] = size - 1
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = size - 1
+    prev = 0
+    for i in range(n_out - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        # punto medio del siguiente bucket (el último punto para el bucket final)
+        if i + 2 < len(bounds):
+            nlo, nhi = bounds[i + 1], bounds[i + 2]
+        else:
+            nlo, nhi = size - 1, size
+        ax, ay = x[prev], y[prev]
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((ax - cx) * (y[lo:hi] - ay) - (ax - x[lo:hi]) * (cy - ay))
+        prev = lo + int(np.argmax(area))
+        selected[i + 1] = prev
+    return selected
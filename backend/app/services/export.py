@@ -0,0 +1,131 @@
+"""Bulk export formats beyond plain JSON.
+
+NDJSON / CSV are streamed: each station is read with its own index-ordered
+query in fixed-size chunks (server-side cursor + yield_per) and written out
+as it arrives, so memory stays flat whatever the range. The columnar .npz
+format returns typed contiguous arrays for analytics clients."""
+import csv
+import io
+import json
+import zipfile
+
+import numpy as np
+from sqlalchemy import select
+
+from app.core.database import ReadSessionLocal, epoch_seconds
+from app.models.station import WeatherData
+from app.services.partitions import route
+from app.services.downsample import iter_arrays
+
+CHUNK_SIZE = 2000
+
+# Mismas claves que _data_to_dict, más station_id
+EXPORT_COLUMNS = [
+    'station_id', 'id', 'timestamp', 'temperature', 'humidity', 'dew_point',
+    'wind_speed_ms', 'wind_gust_ms', 'wind_direction_degrees', 'wind_direction_name',
+    'total_rainfall', 'rain_rate_mm_per_hour',
+]
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def _iter_chunks(db, station_ids, time_filter, window):
+    cols = [getattr(WeatherData, c) for c in EXPORT_COLUMNS]
+    for sid in station_ids:
+        stmt = select(*cols).where(*time_filter(sid)).order_by(WeatherData.timestamp)
+        stmt = route(db, stmt, *window)
+        result = db.execute(stmt.execution_options(yield_per=CHUNK_SIZE))
+        for part in result.partitions(CHUNK_SIZE):
+            yield part
+
+
+def _ndjson(rows):
+    lines = []
+    for row in rows:
+        item = dict(zip(EXPORT_COLUMNS, row))
+        item['timestamp'] = item['timestamp'].isoformat()
+        lines.append(json.dumps(item, separators=(',', ':')))
+    return '\n'.join(lines) + '\n'
+
+
+def _csv(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerows(
+        [r[:2] + (r[2].isoformat(),) + tuple(r[3:]) for r in rows]
+    )
+    return buf.getvalue()
+
+
+def stream_export(fmt, station_ids, time_filter, window=(None, None)):
+    """Generator of text chunks for a streaming response. Opens its own
+    session because it outlives the request handler. window is the
+    (start, end) range used to pick partitions."""
+    db = ReadSessionLocal()
+    try:
+        if fmt == 'csv':
+            yield ','.join(EXPORT_COLUMNS) + '\r\n'
+        encode = _csv if fmt == 'csv' else _ndjson
+        for part in _iter_chunks(db, station_ids, time_filter, window):
+            yield encode(part)
+    finally:
+        db.close()
+
+
+# ── Columnar export (.npz) ─────────────────────────────────────────────────────
+
+NPZ_FLOAT_COLUMNS = [
+    'temperature', 'humidity', 'dew_point', 'wind_speed_ms', 'wind_gust_ms',
+    'wind_direction_degrees', 'total_rainfall', 'rain_rate_mm_per_hour',
+]
+
+
+def _write_member(zf, name, array):
+    if array.ndim:
+        array = np.ascontiguousarray(array)
+    with zf.open(f'{name}.npy', 'w', force_zip64=True) as f:
+        np.lib.format.write_array(f, array, allow_pickle=False)
+
+
+def write_npz(fileobj, db, stations, time_filter, window=(None, None)):
+    """Write an uncompressed NumPy .npz archive with one typed array per
+    station and column:
+
+        meta                       JSON (str) with format version, stations and columns
+        <station_id>/timestamp     int64, Unix epoch milliseconds (UTC), ascending
+        <station_id>/id            int64
+        <station_id>/<measure>     float32, NaN where the value is NULL
+
+    Each station is read in chunks and written before the next one starts,
+    so only one station's arrays are held in memory."""
+    columns = ['t', 'id'] + NPZ_FLOAT_COLUMNS
+    meta = {
+        'version': 1,
+        'timestamp_unit': 'ms',
+        'columns': {'timestamp': 'int64', 'id': 'int64', **{c: 'float32' for c in NPZ_FLOAT_COLUMNS}},
+        'stations': [],
+    }
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for station in stations:
+            stmt = select(
+                epoch_seconds(WeatherData.timestamp), WeatherData.id,
+                *[getattr(WeatherData, c) for c in NPZ_FLOAT_COLUMNS]
+            ).where(*time_filter(station.id)).order_by(WeatherData.timestamp)
+            parts = list(iter_arrays(db, route(db, stmt, *window), columns, chunk_size=CHUNK_SIZE * 10))
+
+            def col(name, dtype):
+                if not parts:
+                    return np.empty(0, dtype=dtype)
+                return np.concatenate([p[name] for p in parts]).astype(dtype)
+
+            _write_member(zf, f'{station.id}/timestamp', np.round(col('t', np.float64) * 1000).astype(np.int64))
+            _write_member(zf, f'{station.id}/id', col('id', np.int64))
+            for name in NPZ_FLOAT_COLUMNS:
+                _write_member(zf, f'{station.id}/{name}', col(name, np.float32))
+            meta['stations'].append({
+                'id': station.id, 'name': station.name, 'rows': sum(len(p['t']) for p in parts)
+            })
+        _write_member(zf, 'meta', np.array(json.dumps(meta)))
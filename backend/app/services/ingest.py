@@ -0,0 +1,231 @@
+"""Ingest path shared by /api/data/submit and /api/data/submit/batch."""
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, select, text, update
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.database import IS_SQLITE
+from app.core.metrics import ingest_rows
+from app.core.shared_cache import response_cache
+from app.models.station import WeatherStation, WeatherData
+from app.services.counters import bump
+from app.services.derived import fill_derived
+from app.services.latest import upsert_latest
+from app.services.live import live_hub
+from app.services.rollups import apply_rollups
+
+# Estaciones que sabemos que existen (solo positivos: una estación nueva
+# debe poder recibir datos en cuanto se crea). Es por proceso y puede
+# sobrevivir a un DELETE atendido por otro worker: solo ahorra la consulta
+# previa de las rutas; store_readings vuelve a comprobar dentro de la
+# transacción de escritura
+station_cache = TTLCache(settings.STATION_CACHE_SIZE, settings.STATION_CACHE_TTL_S)
+
+# Última vez (monotonic) que se escribió last_data_time por estación
+_touched = {}
+_touched_lock = threading.Lock()
+
+# Último bump (monotonic) de la generación FLEET de la caché de respuestas y
+# bump diferido pendiente (un Timer) si se saltó alguno dentro del intervalo
+_fleet_bumped = None
+_fleet_timer = None
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _parse_timestamp(value):
+    """ISO-8601 timestamp sent by the device (backlog uploads) or server time."""
+    if value in (None, ''):
+        return _now()
+    ts = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def parse_reading(data, station_id=None):
+    """Validate one raw reading and return the WeatherData column values.
+    Raises ValueError if the reading is malformed."""
+    if not isinstance(data, dict):
+        raise ValueError("Reading must be a JSON object")
+
+    station_id = data.get('station_id', station_id)
+    if station_id is None or 'temperature' not in data:
+        raise ValueError("Missing station_id or temperature")
+
+    try:
+        row = {
+            'station_id': str(station_id),
+            'temperature': float(data['temperature']),
+            'humidity': float(data.get('humidity', 0)),
+            'wind_speed_ms': float(data.get('wind_speed_ms', 0)),
+            'wind_gust_ms': float(data.get('wind_gust_ms', 0)),
+            'wind_direction_degrees': float(data.get('wind_direction_degrees', 0)),
+            'total_rainfall': float(data.get('total_rainfall', 0)),
+            'total_tips': int(data.get('total_tips', 0)),
+            'rain_rate_mm_per_hour': float(data.get('rain_rate_mm_per_hour', 0)),
+            'timestamp': _parse_timestamp(data.get('timestamp')),
+        }
+    except (TypeError, OverflowError) as e:
+        raise ValueError(str(e))
+    # float() acepta "nan", "inf" y "1e400": NaN acabaría como NULL y un
+    # infinito envenenaría medias y rollups
+    bad = [k for k, v in row.items() if isinstance(v, float) and not math.isfinite(v)]
+    if bad:
+        raise ValueError(f"Non-finite value for {', '.join(bad)}")
+    return row
+
+
+def existing_station_ids(db, station_ids):
+    """Return the subset of station_ids that exist.
+    Cached ids cost nothing; the rest are checked with a single query."""
+    found = set()
+    missing = set()
+    for sid in set(station_ids):
+        if station_cache.get(sid):
+            found.add(sid)
+        else:
+            missing.add(sid)
+    if missing:
+        rows = db.query(WeatherStation.id).filter(WeatherStation.id.in_(missing)).all()
+        for (sid,) in rows:
+            station_cache.set(sid, True)
+            found.add(sid)
+    return found
+
+
+def invalidate_station(station_id):
+    """Forget cached state for a station (called on update/delete)."""
+    station_cache.invalidate(station_id)
+    with _touched_lock:
+        _touched.pop(station_id, None)
+
+
+def _due_for_touch(station_ids):
+    """Stations whose last_data_time has not been written in the last
+    STATION_TOUCH_INTERVAL_S seconds (by this process)."""
+    now = time.monotonic()
+    due = []
+    with _touched_lock:
+        for sid in station_ids:
+            last = _touched.get(sid)
+            if last is None or now - last >= settings.STATION_TOUCH_INTERVAL_S:
+                _touched[sid] = now
+                due.append(sid)
+    return due
+
+
+def _due_for_fleet_bump():
+    """True at most once per RESPONSE_CACHE_FLEET_INTERVAL_S (per process):
+    ingest only invalidates the fleet-wide responses that often. A skipped
+    bump is not lost: a timer bumps FLEET when the interval ends, so the
+    last readings of a burst reach the fleet responses on time."""
+    global _fleet_bumped, _fleet_timer
+    now = time.monotonic()
+    interval = settings.RESPONSE_CACHE_FLEET_INTERVAL_S
+    with _touched_lock:
+        if _fleet_bumped is None or now - _fleet_bumped >= interval:
+            _fleet_bumped = now
+            return True
+        if _fleet_timer is None:
+            _fleet_timer = threading.Timer(_fleet_bumped + interval - now, _deferred_fleet_bump)
+            _fleet_timer.daemon = True
+            _fleet_timer.start()
+    return False
+
+
+def _deferred_fleet_bump():
+    global _fleet_bumped, _fleet_timer
+    with _touched_lock:
+        _fleet_bumped = time.monotonic()
+        _fleet_timer = None
+    response_cache.bump()
+
+
+def _insert_rows(db, rows):
+    """INSERT the rows and return their ids in order.
+
+    On SQLite an ordered RETURNING makes SQLAlchemy send one statement per
+    row, so the rows go through a plain executemany instead. The write lock
+    is held from the first row on and ids are assigned as max(id) + 1 (or
+    from sqlite_sequence), so the batch gets a contiguous range ending at
+    last_insert_rowid()."""
+    if not IS_SQLITE:
+        result = db.execute(
+            insert(WeatherData).returning(WeatherData.id, sort_by_parameter_order=True),
+            rows
+        )
+        return [r[0] for r in result]
+    db.execute(insert(WeatherData), rows)
+    last = db.execute(text("SELECT last_insert_rowid()")).scalar()
+    return list(range(last - len(rows) + 1, last + 1))
+
+
+def _deleted_stations(db, rows):
+    """Station ids of rows that no longer exist. Run after the INSERT: the
+    write lock is held, so no other worker can delete one in between."""
+    station_ids = {r['station_id'] for r in rows}
+    present = db.execute(select(WeatherStation.id).where(WeatherStation.id.in_(station_ids))).scalars()
+    return station_ids - set(present)
+
+
+def store_readings(db, rows):
+    """Insert already validated readings in one transaction.
+
+    The derived columns (dew point, mph, compass name, in/h) are computed
+    for the whole batch at once. Rows are written with one driver-level
+    executemany (see _insert_rows), and station_latest, the hourly/daily
+    rollups and the record counter are updated in the same transaction.
+    Each station's last_data_time is updated at most once per
+    STATION_TOUCH_INTERVAL_S rather than once per reading. After commit the
+    stations' cached responses are invalidated (the fleet-wide ones at most
+    once per RESPONSE_CACHE_FLEET_INTERVAL_S) and the live feed is woken up.
+
+    Returns the new ids in the same order as rows, None for rows whose
+    station was deleted in the meantime (not stored)."""
+    if not rows:
+        return []
+
+    # Actualizar last_data_time una sola vez por estación y por intervalo
+    station_ids = _due_for_touch({r['station_id'] for r in rows})
+    fill_derived(rows)
+    try:
+        ids = _insert_rows(db, rows)
+        gone = _deleted_stations(db, rows)
+        if gone:
+            db.rollback()
+            for sid in gone:
+                invalidate_station(sid)
+            with _touched_lock:
+                for sid in station_ids:
+                    _touched.pop(sid, None)
+            kept = iter(store_readings(db, [r for r in rows if r['station_id'] not in gone]))
+            return [None if r['station_id'] in gone else next(kept) for r in rows]
+        upsert_latest(db, rows, ids)
+        apply_rollups(db, rows)
+        bump(db, total_records=len(rows))
+
+        if station_ids:
+            db.execute(
+                update(WeatherStation)
+                .where(WeatherStation.id.in_(station_ids))
+                .values(last_data_time=_now()),
+                execution_options={"synchronize_session": False}
+            )
+
+        db.commit()
+    except Exception:
+        with _touched_lock:
+            for sid in station_ids:
+                _touched.pop(sid, None)
+        raise
+    ingest_rows.inc(amount=len(rows))
+    response_cache.bump({r['station_id'] for r in rows}, fleet=_due_for_fleet_bump())
+    live_hub.notify()
+    return ids
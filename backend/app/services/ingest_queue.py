@@ -0,0 +1,154 @@
+"""Write-behind ingest: readings are acknowledged once queued and a single
+writer thread commits them in grouped transactions."""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from app.core.config import settings
+from app.core.database import SessionLocal, is_busy_error
+from app.core.metrics import ingest_dropped, ingest_retries
+from app.services.ingest import existing_station_ids, store_readings
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueue:
+    """Bounded in-process queue drained by one writer thread.
+
+    A flush happens when flush_rows readings are pending or flush_ms have
+    passed since the first pending one, whichever comes first."""
+
+    def __init__(self, maxsize, flush_rows, flush_ms):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_ms / 1000
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        logger.info(
+            f"Ingest queue started (max={self._queue.maxsize}, "
+            f"flush={self.flush_rows} rows / {self.flush_interval * 1000:.0f} ms)"
+        )
+
+    def put(self, row):
+        """Queue a validated reading. Returns False when the queue is full."""
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            return False
+
+    def stop(self, timeout=30):
+        """Stop the writer and flush everything that was acknowledged."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        # Lo que quede (p. ej. si el hilo nunca arrancó) se escribe aquí
+        self._flush(self._drain(), retries=3)
+
+    def _drain(self, limit=None):
+        rows = []
+        while limit is None or len(rows) < limit:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+
+            rows = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.flush_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            rows.extend(self._drain(self.flush_rows - len(rows)))
+            self._flush(rows)
+
+        while True:
+            rows = self._drain(self.flush_rows)
+            if not rows:
+                break
+            self._flush(rows, retries=3)
+
+    def _flush(self, rows, retries=None):
+        """Write rows in one transaction. A busy database is retried with
+        backoff (without limit while running: the queue fills up and
+        submit_data answers 503). Any other error would fail again, so the
+        batch is split in halves until the offending rows are isolated and
+        dropped."""
+        if not rows:
+            return
+        attempt = 0
+        while True:
+            db = SessionLocal()
+            try:
+                # La estación pudo borrarse mientras la lectura esperaba en cola
+                known = existing_station_ids(db, [r['station_id'] for r in rows])
+                valid = [r for r in rows if r['station_id'] in known]
+                if len(valid) < len(rows):
+                    logger.warning(f"Dropped {len(rows) - len(valid)} queued readings for deleted stations")
+                    ingest_dropped.inc(amount=len(rows) - len(valid))
+                lost = store_readings(db, valid).count(None)
+                if lost:
+                    logger.warning(f"Dropped {lost} queued readings for deleted stations")
+                    ingest_dropped.inc(amount=lost)
+                return
+            except Exception as e:
+                db.rollback()
+                if not is_busy_error(e):
+                    self._bisect(rows, e, retries)
+                    return
+                attempt += 1
+                if retries is None and self._stop.is_set():
+                    retries = 3
+                if retries is not None and attempt > retries:
+                    logger.error(f"Ingest flush failed, {len(rows)} readings lost: {e}")
+                    ingest_dropped.inc(amount=len(rows))
+                    return
+                logger.warning(f"Ingest flush failed (attempt {attempt}): {e}")
+                ingest_retries.inc()
+                time.sleep(min(0.1 * 2 ** attempt, 5))
+            finally:
+                db.close()
+
+    def _bisect(self, rows, error, retries):
+        if len(rows) == 1:
+            row = rows[0]
+            logger.error(f"Dropped queued reading ({row['station_id']}, {row['timestamp']}): {error}")
+            ingest_dropped.inc()
+            return
+        mid = len(rows) // 2
+        self._flush(rows[:mid], retries)
+        self._flush(rows[mid:], retries)
+
+ingest_queue = IngestQueue(
+    maxsize=settings.INGEST_QUEUE_MAX,
+    flush_rows=settings.INGEST_FLUSH_ROWS,
+    flush_ms=settings.INGEST_FLUSH_MS,
+)
@@ -0,0 +1,66 @@
+"""station_latest: newest reading per station, so station listings need
+one join instead of one query per station."""
+import logging
+
+from sqlalchemy import delete, desc, insert, select
+
+from app.core.database import dialect_insert
+from app.models.station import WeatherStation, WeatherData, StationLatest
+from app.services.partitions import route
+
+logger = logging.getLogger(__name__)
+
+
+def upsert_latest(db, rows, ids):
+    """Point station_latest at the newest of the just-inserted rows.
+    Runs inside the ingest transaction; older backlog readings never
+    replace a newer pointer."""
+    newest = {}
+    for row, data_id in zip(rows, ids):
+        current = newest.get(row['station_id'])
+        if current is None or row['timestamp'] >= current['timestamp']:
+            newest[row['station_id']] = {
+                'station_id': row['station_id'],
+                'data_id': data_id,
+                'timestamp': row['timestamp'],
+            }
+
+    table = StationLatest.__table__
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.station_id],
+        set_={'data_id': stmt.excluded.data_id, 'timestamp': stmt.excluded.timestamp},
+        where=stmt.excluded.timestamp >= table.c.timestamp,
+    )
+    db.execute(stmt, list(newest.values()))
+
+
+def rebuild_latest(db):
+    """Recompute station_latest from weather_data and its partitions.
+    Returns the number of rows."""
+    newest_id = (
+        select(WeatherData.id)
+        .where(WeatherData.station_id == WeatherStation.id)
+        .order_by(desc(WeatherData.timestamp), desc(WeatherData.id))
+        .limit(1)
+        .correlate(WeatherStation)
+        .scalar_subquery()
+    )
+    source = route(db, (
+        select(WeatherStation.id, WeatherData.id, WeatherData.timestamp)
+        .join(WeatherData, WeatherData.id == newest_id)
+    ))
+    db.execute(delete(StationLatest))
+    db.execute(
+        insert(StationLatest).from_select(['station_id', 'data_id', 'timestamp'], source)
+    )
+    db.commit()
+    count = db.query(StationLatest).count()
+    logger.info(f"station_latest rebuilt: {count} stations")
+    return count
+
+
+def ensure_latest(db):
+    """Populate station_latest on first start against an existing database."""
+    if db.query(StationLatest.station_id).first() is None and db.query(WeatherData.id).first() is not None:
+        rebuild_latest(db)
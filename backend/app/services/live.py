@@ -0,0 +1,145 @@
+"""In-process pub/sub for the SSE live feed.
+
+Every worker runs one poller thread (only while someone is subscribed)
+that reads weather_data rows with id > watermark and fans them out to the
+subscribers' bounded queues. store_readings wakes the poller right after
+commit, so readings ingested by this worker are delivered at once and
+readings ingested by other gunicorn workers within LIVE_POLL_MS.
+
+Publishing never blocks: a subscriber whose queue is full is marked as
+overflowed and its stream ends; the browser reconnects with Last-Event-ID
+and the gap is replayed from the database."""
+import json
+import logging
+import queue
+import threading
+
+from sqlalchemy import func, select
+
+from app.core.config import settings
+from app.core.database import ReadSessionLocal
+from app.models.station import WeatherData
+
+logger = logging.getLogger(__name__)
+
+LIVE_COLUMNS = [
+    'id', 'station_id', 'timestamp', 'temperature', 'humidity', 'dew_point',
+    'wind_speed_ms', 'wind_gust_ms', 'wind_direction_degrees', 'wind_direction_name',
+    'total_rainfall', 'rain_rate_mm_per_hour',
+]
+
+
+def _event(row):
+    """(id, station_id, SSE frame) for one weather_data row."""
+    d = dict(zip(LIVE_COLUMNS, row))
+    d['timestamp'] = d['timestamp'].isoformat()
+    frame = f"id: {d['id']}\nevent: reading\ndata: {json.dumps(d)}\n\n"
+    return d['id'], d['station_id'], frame
+
+
+def fetch_events(db, after_id, station_id=None, limit=500):
+    """Readings with id > after_id, oldest first, as SSE events."""
+    stmt = select(*[getattr(WeatherData, c) for c in LIVE_COLUMNS]).where(WeatherData.id > after_id)
+    if station_id is not None:
+        stmt = stmt.where(WeatherData.station_id == station_id)
+    stmt = stmt.order_by(WeatherData.id).limit(limit)
+    return [_event(row) for row in db.execute(stmt)]
+
+
+def max_reading_id(db):
+    return db.query(func.max(WeatherData.id)).scalar() or 0
+
+
+class Subscriber:
+    def __init__(self, station_id, maxsize):
+        self.station_id = station_id
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+
+class LiveHub:
+    def __init__(self, max_subscribers, queue_size, poll_ms):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.poll_interval = poll_ms / 1000
+        self._subs = {}            # station_id (None = toda la red) -> set(Subscriber)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.watermark = None
+
+    def subscribe(self, station_id=None):
+        """Register a subscriber, or return None when the worker is full."""
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            sub = Subscriber(station_id, self.queue_size)
+            self._subs.setdefault(station_id, set()).add(sub)
+            self._count += 1
+            if self._thread is None or not self._thread.is_alive():
+                # Lo anterior a este punto lo cubre el replay de la ruta
+                with ReadSessionLocal() as db:
+                    self.watermark = max_reading_id(db)
+                self._thread = threading.Thread(target=self._run, name="live-poller", daemon=True)
+                self._thread.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subs.get(sub.station_id)
+            if subs and sub in subs:
+                subs.discard(sub)
+                self._count -= 1
+                if not subs:
+                    del self._subs[sub.station_id]
+
+    def notify(self):
+        """Wake the poller (called after a commit that inserted readings)."""
+        if self._count:
+            self._wake.set()
+
+    def publish(self, events):
+        with self._lock:
+            fleet = list(self._subs.get(None, ()))
+            by_station = {sid: list(subs) for sid, subs in self._subs.items() if sid is not None}
+        for event in events:
+            for sub in fleet + by_station.get(event[1], []):
+                sub.offer(event)
+
+    def _poll(self):
+        with ReadSessionLocal() as db:
+            while True:
+                events = fetch_events(db, self.watermark)
+                if not events:
+                    return
+                self.watermark = events[-1][0]
+                self.publish(events)
+                if len(events) < 500:
+                    return
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._count:
+                    self._thread = None
+                    return
+            self._wake.clear()
+            try:
+                self._poll()
+            except Exception as e:
+                logger.warning(f"Live poller error: {e}")
+            self._wake.wait(self.poll_interval)
+
+
+live_hub = LiveHub(
+    max_subscribers=settings.LIVE_MAX_SUBSCRIBERS,
+    queue_size=settings.LIVE_QUEUE_SIZE,
+    poll_ms=settings.LIVE_POLL_MS,
+)
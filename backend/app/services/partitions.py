@@ -0,0 +1,255 @@
+"""Monthly partitions of weather_data.
+
+`weather_data` is the hot partition: ingest always writes there and it
+keeps the current month plus PARTITION_HOT_MONTHS previous ones. Older
+months are moved (ids included) into tables weather_data_YYYYMM with a
+single (station_id, timestamp) index and listed in weather_partitions.
+
+Reads go through route(): a select written against WeatherData is
+rewritten to UNION ALL the hot table with only the partitions whose month
+overlaps the requested window. SQLite pushes the WHERE clause into every
+branch and merges the ordered index scans, so a recent window never
+touches the partitions at all.
+
+Every row lives in exactly one table at any time (rows are moved in small
+copy+delete transactions). Other workers cache the registry for
+PARTITION_REGISTRY_TTL_S, so rows are only moved into a new partition,
+and a partition is only dropped, after that long."""
+import logging
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, Index, MetaData, Table, delete, func, insert, select, text, union_all
+from sqlalchemy.sql.util import ClauseAdapter
+
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.core.database import IS_SQLITE, SessionLocal, engine
+from app.core.metrics import add_read_rows
+from app.models.station import WeatherData, WeatherPartition, StationLatest
+
+logger = logging.getLogger(__name__)
+
+_hot = WeatherData.__table__
+_columns = [c.name for c in _hot.columns]
+_metadata = MetaData()
+_registry = TTLCache(maxsize=1, ttl=settings.PARTITION_REGISTRY_TTL_S)
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def month_start(ts):
+    return ts.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_table(name):
+    """Table object for a partition (same columns as weather_data, no FKs)."""
+    if name not in _metadata.tables:
+        Table(
+            name, _metadata,
+            *[Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable) for c in _hot.columns],
+            Index(f'idx_{name}_station_timestamp', 'station_id', 'timestamp'),
+        )
+    return _metadata.tables[name]
+
+
+# ── Routing ────────────────────────────────────────────────────────────────────
+
+def registered(db):
+    """[(table, month_start, month_end)] oldest first, cached per process."""
+    parts = _registry.get('parts')
+    if parts is None:
+        rows = db.query(
+            WeatherPartition.name, WeatherPartition.month_start, WeatherPartition.month_end
+        ).order_by(WeatherPartition.month_start).all()
+        parts = [(partition_table(r.name), r.month_start, r.month_end) for r in rows]
+        _registry.set('parts', parts)
+    return parts
+
+
+def overlapping(db, start=None, end=None):
+    """Partition tables with rows that may fall in [start, end)."""
+    return [table for table, ms, me in registered(db)
+            if (start is None or me > start) and (end is None or ms < end)]
+
+
+def route(db, stmt, start=None, end=None):
+    """Rewrite a select over weather_data so it also reads the partitions
+    overlapping [start, end). Returns stmt unchanged when there are none."""
+    parts = overlapping(db, start, end)
+    if not parts:
+        return stmt
+    union = union_all(
+        select(_hot), *[select(*[p.c[name] for name in _columns]) for p in parts]
+    ).subquery('weather_data_all')
+    return ClauseAdapter(union).traverse(stmt)
+
+
+def load(db, query, start=None, end=None):
+    """Run an ORM query for WeatherData objects across partitions."""
+    stmt = route(db, query.statement, start, end)
+    if stmt is query.statement:
+        rows = query.all()
+    else:
+        rows = db.execute(select(WeatherData).from_statement(stmt)).scalars().all()
+    add_read_rows(len(rows))
+    return rows
+
+
+def all_tables(db):
+    return [_hot] + [table for table, _, _ in registered(db)]
+
+
+def count_rows(db):
+    return sum(db.execute(select(func.count()).select_from(t)).scalar() for t in all_tables(db))
+
+
+def delete_station_rows(db, station_id):
+    """Delete a station's readings from every partition (not the hot
+    table). Runs inside the caller's transaction; returns the row count."""
+    removed = 0
+    for table, _, _ in registered(db):
+        removed += db.execute(delete(table).where(table.c.station_id == station_id)).rowcount
+    return removed
+
+
+# ── Maintenance ────────────────────────────────────────────────────────────────
+
+def _wait_for_workers():
+    """Let every worker's registry cache expire before rows move or tables go."""
+    _registry.invalidate()
+    time.sleep(settings.PARTITION_REGISTRY_TTL_S * 2 + 1)
+
+
+def _uses_autoincrement():
+    if not IS_SQLITE:
+        return True
+    with engine.connect() as conn:
+        sql = conn.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'weather_data'")
+        ).scalar() or ''
+    return 'AUTOINCREMENT' in sql.upper()
+
+
+def _move_batch(db, table, ms, me, batch_size, keep_id):
+    query = select(_hot.c.id).where(_hot.c.timestamp >= ms, _hot.c.timestamp < me)
+    if keep_id is not None:
+        query = query.where(_hot.c.id != keep_id)
+    ids = db.execute(query.order_by(_hot.c.timestamp).limit(batch_size)).scalars().all()
+    if not ids:
+        return 0
+    db.execute(insert(table).from_select(
+        _columns, select(*[_hot.c[name] for name in _columns]).where(_hot.c.id.in_(ids))
+    ))
+    db.execute(delete(_hot).where(_hot.c.id.in_(ids)))
+    db.commit()
+    return len(ids)
+
+
+def archive_months(hot_months=None, batch_size=None, pause_ms=None, wait=True):
+    """Move every month older than the hot window out of weather_data.
+    Returns a report dict."""
+    hot_months = settings.PARTITION_HOT_MONTHS if hot_months is None else hot_months
+    batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+    pause = (settings.RETENTION_PAUSE_MS if pause_ms is None else pause_ms) / 1000
+    t0 = time.monotonic()
+    boundary = add_months(month_start(_now()), -hot_months)
+
+    with SessionLocal() as db:
+        oldest = db.query(func.min(WeatherData.timestamp)).scalar()
+        months = []
+        month = month_start(oldest) if oldest is not None else boundary
+        while month < boundary:
+            has_rows = db.query(WeatherData.id).filter(
+                WeatherData.timestamp >= month, WeatherData.timestamp < add_months(month, 1)
+            ).first()
+            if has_rows:
+                months.append(month)
+            month = add_months(month, 1)
+
+        known = {ms: table for table, ms, _ in registered(db)}
+        created = []
+        for month in months:
+            if month in known:
+                continue
+            table = partition_table(f"weather_data_{month:%Y%m}")
+            table.create(bind=db.connection(), checkfirst=True)
+            db.add(WeatherPartition(name=table.name, month_start=month, month_end=add_months(month, 1)))
+            created.append(table.name)
+        db.commit()
+
+    if created and wait:
+        _wait_for_workers()
+    _registry.invalidate()
+
+    # Sin AUTOINCREMENT SQLite reutilizaría ids si weather_data quedara vacía
+    keep_id = None
+    if not _uses_autoincrement():
+        with SessionLocal() as db:
+            keep_id = db.query(func.max(WeatherData.id)).scalar()
+
+    moved = 0
+    with SessionLocal() as db:
+        tables = {ms: table for table, ms, _ in registered(db)}
+    for month in months:
+        while True:
+            with SessionLocal() as db:
+                n = _move_batch(db, tables[month], month, add_months(month, 1), batch_size, keep_id)
+            if not n:
+                break
+            moved += n
+            time.sleep(pause)
+
+    report = {
+        "boundary": boundary.isoformat(),
+        "partitions_created": created,
+        "rows_moved": moved,
+        "seconds": round(time.monotonic() - t0, 2),
+    }
+    logger.info("Partitions: " + ", ".join(f"{k}={v}" for k, v in report.items()))
+    return report
+
+
+def unregister_expired(db, cutoff):
+    """Unlist partitions whose whole month is older than cutoff and clear
+    station_latest pointers into them, inside the caller's transaction.
+    Returns (tables, rows); pass the tables to drop_tables after commit."""
+    tables, rows = [], 0
+    for table, ms, me in registered(db):
+        if me > cutoff:
+            continue
+        rows += db.execute(select(func.count()).select_from(table)).scalar()
+        db.query(StationLatest).filter(
+            StationLatest.data_id.in_(select(table.c.id))
+        ).delete(synchronize_session=False)
+        db.query(WeatherPartition).filter(WeatherPartition.name == table.name).delete()
+        tables.append(table)
+    return tables, rows
+
+
+def drop_tables(tables, wait=True):
+    """DROP unlisted partitions once no worker can still be reading them."""
+    if wait:
+        _wait_for_workers()
+    _registry.invalidate()
+    for table in tables:
+        table.drop(bind=engine, checkfirst=True)
+        _metadata.remove(table)
+    logger.info(f"Dropped partitions {[t.name for t in tables]}")
+
+
+def describe_partitions(db):
+    """[{name, month_start, rows}] for the hot table and every partition."""
+    out = [{'name': _hot.name, 'month_start': None,
+            'rows': db.execute(select(func.count()).select_from(_hot)).scalar()}]
+    for table, ms, _ in registered(db):
+        out.append({'name': table.name, 'month_start': ms.isoformat(),
+                    'rows': db.execute(select(func.count()).select_from(table)).scalar()})
+    return out
@@ -0,0 +1,234 @@
+"""Retention: delete readings older than DATA_RETENTION_DAYS.
+
+Rows go in small batches ordered by the timestamp index, one short
+transaction each, so the ingest writer only ever waits for one batch.
+Expired readings stay summarised in the hourly/daily rollups (the
+downsampled archive) unless archive=False, in which case the expired
+rollup buckets are dropped as well. Freed pages are returned to the
+filesystem with PRAGMA incremental_vacuum.
+
+Monthly partitions (services/partitions.py) whose whole month is older
+than the cutoff are dropped; the partition holding the cutoff is trimmed
+row-wise, in id-range batches (partitions have no timestamp index). The
+scheduled job archives before purging, so old months reach their
+partition and expire with a DROP TABLE instead of row deletes."""
+import fcntl
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select
+
+from app.core.config import settings
+from app.core.database import IS_SQLITE, SessionLocal, engine
+from app.core.shared_cache import response_cache
+from app.models.station import (
+    WeatherData, StationLatest, WeatherRollupHourly, WeatherRollupDaily, SystemRollupHourly
+)
+from app.services.counters import bump
+from app.services.partitions import archive_months, drop_tables, overlapping, unregister_expired
+
+logger = logging.getLogger(__name__)
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _purge_batch(db, cutoff, batch_size):
+    ids = [r[0] for r in db.query(WeatherData.id).filter(
+        WeatherData.timestamp < cutoff
+    ).order_by(WeatherData.timestamp).limit(batch_size)]
+    if not ids:
+        return 0
+    deleted = db.query(WeatherData).filter(WeatherData.id.in_(ids)).delete(synchronize_session=False)
+    # Si se borra la lectura más reciente de una estación, ya no tiene datos
+    db.query(StationLatest).filter(StationLatest.data_id.in_(ids)).delete(synchronize_session=False)
+    bump(db, total_records=-deleted)
+    db.commit()
+    return deleted
+
+
+def _trim_batch(db, table, cutoff, after_id, batch_size):
+    """Delete the expired rows among the next batch_size ids of a partition.
+    Returns (deleted, last id of the window) or None past the end."""
+    window = db.execute(
+        select(table.c.id).where(table.c.id > after_id).order_by(table.c.id).limit(batch_size)
+    ).scalars().all()
+    if not window:
+        return None
+    ids = db.execute(select(table.c.id).where(
+        table.c.id.between(window[0], window[-1]), table.c.timestamp < cutoff
+    )).scalars().all()
+    if ids:
+        db.execute(delete(table).where(table.c.id.in_(ids)))
+        db.query(StationLatest).filter(StationLatest.data_id.in_(ids)).delete(synchronize_session=False)
+        bump(db, total_records=-len(ids))
+    db.commit()
+    return len(ids), window[-1]
+
+
+def _trim_partitions(cutoff, batch_size, pause):
+    """Row-wise purge of the partitions that straddle the cutoff."""
+    deleted = 0
+    with SessionLocal() as db:
+        tables = overlapping(db, end=cutoff)
+    for table in tables:
+        after_id = 0
+        while True:
+            with SessionLocal() as db:
+                step = _trim_batch(db, table, cutoff, after_id, batch_size)
+            if step is None:
+                break
+            n, after_id = step
+            deleted += n
+            if n:
+                time.sleep(pause)
+    return deleted
+
+
+def _purge_rollups(db, cutoff):
+    """Drop rollup buckets that end before cutoff."""
+    removed = 0
+    for model, start in ((WeatherRollupHourly, cutoff - timedelta(hours=1)),
+                         (WeatherRollupDaily, cutoff - timedelta(days=1)),
+                         (SystemRollupHourly, cutoff - timedelta(hours=1))):
+        removed += db.query(model).filter(model.bucket_start < start).delete(synchronize_session=False)
+    db.commit()
+    return removed
+
+
+def incremental_vacuum(step_pages=1000):
+    """Return free pages to the filesystem in steps of step_pages.
+    Only works if the database has auto_vacuum=INCREMENTAL (new databases
+    get it from SQLITE_AUTO_VACUUM; existing ones need `manage.py vacuum`)."""
+    if not IS_SQLITE:
+        return 0
+    freed = 0
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            logger.info("auto_vacuum is not INCREMENTAL; run `python manage.py vacuum` once to enable it")
+            return 0
+        free = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        while free:
+            conn.exec_driver_sql(f"PRAGMA incremental_vacuum({step_pages})")
+            conn.commit()
+            left = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if left >= free:
+                break
+            freed += free - left
+            free = left
+    return freed
+
+
+def purge_expired(days=None, batch_size=None, archive=None, pause_ms=None):
+    """Delete readings older than `days` and return a report dict."""
+    days = settings.DATA_RETENTION_DAYS if days is None else days
+    batch_size = batch_size or settings.RETENTION_BATCH_SIZE
+    archive = settings.RETENTION_ARCHIVE if archive is None else archive
+    pause = (settings.RETENTION_PAUSE_MS if pause_ms is None else pause_ms) / 1000
+
+    t0 = time.monotonic()
+    cutoff = _now() - timedelta(days=days)
+    deleted = batches = rollups = 0
+
+    with SessionLocal() as db:
+        expired, dropped_rows = unregister_expired(db, cutoff)
+        bump(db, total_records=-dropped_rows)
+        db.commit()
+    if expired:
+        drop_tables(expired)
+        deleted += dropped_rows
+    deleted += _trim_partitions(cutoff, batch_size, pause)
+
+    while True:
+        with SessionLocal() as db:
+            n = _purge_batch(db, cutoff, batch_size)
+        if not n:
+            break
+        deleted += n
+        batches += 1
+        # Deja pasar a la ingesta entre lotes
+        time.sleep(pause)
+
+    if not archive:
+        with SessionLocal() as db:
+            rollups = _purge_rollups(db, cutoff)
+
+    if deleted or rollups:
+        # Las respuestas por rango de fechas pueden incluir lo borrado
+        response_cache.clear()
+    freed = incremental_vacuum() if deleted or rollups else 0
+    report = {
+        "cutoff": cutoff.isoformat(),
+        "deleted": deleted,
+        "batches": batches,
+        "partitions_dropped": [t.name for t in expired],
+        "rollups_deleted": rollups,
+        "freed_pages": freed,
+        "seconds": round(time.monotonic() - t0, 2),
+    }
+    logger.info("Retention: " + ", ".join(f"{k}={v}" for k, v in report.items()))
+    return report
+
+
+class RetentionScheduler:
+    """Runs archive_months (then purge_expired) every interval_min minutes
+    in a daemon thread.
+
+    Every gunicorn worker starts one, but a run first takes a non-blocking
+    flock on <database>.retention.lock, so only one process purges at a time."""
+
+    def __init__(self, interval_min):
+        self.interval = interval_min * 60
+        self._stop = threading.Event()
+        self._thread = None
+        path = engine.url.database if IS_SQLITE else None
+        self.lock_path = f"{path}.retention.lock" if path and path != ":memory:" else None
+
+    def start(self):
+        if self._thread is not None or not self.interval:
+            return
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+        logger.info(f"Retention scheduler started (every {self.interval // 60} min, "
+                    f"keep {settings.DATA_RETENTION_DAYS} days)")
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        if self.lock_path is None:
+            return self._job()
+        with open(self.lock_path, "w") as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            try:
+                return self._job()
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _job():
+        # Primero archivar: lo caducado acaba en su partición y se borra con DROP TABLE
+        partitions = archive_months() if settings.PARTITION_ENABLED else None
+        report = purge_expired()
+        if partitions is not None:
+            report["partitions"] = partitions
+        return report
+
+    def _run(self):
+        # Primera pasada poco después de arrancar, luego cada intervalo
+        delay = min(60, self.interval)
+        while not self._stop.wait(delay):
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning(f"Retention run failed: {e}")
+            delay = self.interval
+
+
+retention_scheduler = RetentionScheduler(settings.RETENTION_INTERVAL_MIN)
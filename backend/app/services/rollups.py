@@ -0,0 +1,385 @@
+"""Hourly and daily rollups of weather_data.
+
+Each bucket stores count, sum, sum of squares, min and max per measure, so
+buckets can be merged freely: stats over any window are rebuilt from whole
+days, whole hours and only the raw readings at the window edges."""
+import logging
+import math
+from datetime import timedelta
+
+import numpy as np
+from sqlalchemy import and_, delete, func, or_, select
+
+from app.core.database import dialect_insert, engine
+from app.models.station import WeatherData, WeatherRollupHourly, WeatherRollupDaily, SystemRollupHourly
+from app.services.partitions import all_tables, route
+
+logger = logging.getLogger(__name__)
+
+# prefijo de columna en la rollup -> columna de weather_data
+MEASURES = {
+    'temperature': 'temperature',
+    'humidity': 'humidity',
+    'wind_speed': 'wind_speed_ms',
+}
+
+_RAW_COLUMNS = ['station_id', 'timestamp', 'total_rainfall', 'wind_gust_ms'] + list(MEASURES.values())
+
+if engine.dialect.name == 'postgresql':
+    _least, _greatest = func.least, func.greatest
+else:
+    # En SQLite min()/max() con dos argumentos son escalares
+    _least, _greatest = func.min, func.max
+
+
+def _hour(ts):
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _day(ts):
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ceil(ts, floor, step):
+    start = floor(ts)
+    return start if start == ts else start + step
+
+
+# ── Ingest side ────────────────────────────────────────────────────────────────
+
+def _fold(buckets, key, row):
+    b = buckets.get(key)
+    if b is None:
+        b = buckets[key] = {'station_id': key[0], 'bucket_start': key[1], 'count': 0,
+                            'rainfall_sum': 0.0, 'wind_gust_max': None}
+        for m in MEASURES:
+            b.update({f'{m}_sum': 0.0, f'{m}_sumsq': 0.0, f'{m}_min': None, f'{m}_max': None})
+    b['count'] += 1
+    for m, col in MEASURES.items():
+        v = row[col]
+        b[f'{m}_sum'] += v
+        b[f'{m}_sumsq'] += v * v
+        b[f'{m}_min'] = v if b[f'{m}_min'] is None else min(b[f'{m}_min'], v)
+        b[f'{m}_max'] = v if b[f'{m}_max'] is None else max(b[f'{m}_max'], v)
+    b['rainfall_sum'] += row['total_rainfall'] or 0
+    gust = row['wind_gust_ms']
+    b['wind_gust_max'] = gust if b['wind_gust_max'] is None else max(b['wind_gust_max'], gust)
+
+
+def _merge_on_conflict(stmt, table):
+    """ON CONFLICT clause that merges an incoming bucket into the stored one."""
+    ex = stmt.excluded
+    set_ = {
+        'count': table.c.count + ex.count,
+        'rainfall_sum': table.c.rainfall_sum + ex.rainfall_sum,
+        'wind_gust_max': _greatest(func.coalesce(table.c.wind_gust_max, ex.wind_gust_max), ex.wind_gust_max),
+    }
+    for m in MEASURES:
+        set_[f'{m}_sum'] = table.c[f'{m}_sum'] + ex[f'{m}_sum']
+        set_[f'{m}_sumsq'] = table.c[f'{m}_sumsq'] + ex[f'{m}_sumsq']
+        set_[f'{m}_min'] = _least(func.coalesce(table.c[f'{m}_min'], ex[f'{m}_min']), ex[f'{m}_min'])
+        set_[f'{m}_max'] = _greatest(func.coalesce(table.c[f'{m}_max'], ex[f'{m}_max']), ex[f'{m}_max'])
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.station_id, table.c.bucket_start], set_=set_
+    )
+
+
+def _upsert(db, model, buckets):
+    if not buckets:
+        return
+    table = model.__table__
+    db.execute(_merge_on_conflict(dialect_insert(table), table), list(buckets.values()))
+
+
+def _system_on_conflict(stmt):
+    table = SystemRollupHourly.__table__
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.bucket_start],
+        set_={'count': table.c.count + stmt.excluded.count,
+              'temperature_sum': table.c.temperature_sum + stmt.excluded.temperature_sum},
+    )
+
+
+def _system_rows(hourly):
+    system = {}
+    for b in hourly.values():
+        s = system.setdefault(b['bucket_start'], {
+            'bucket_start': b['bucket_start'], 'count': 0, 'temperature_sum': 0.0
+        })
+        s['count'] += b['count']
+        s['temperature_sum'] += b['temperature_sum']
+    return list(system.values())
+
+
+def _upsert_system(db, hourly):
+    rows = _system_rows(hourly)
+    if rows:
+        db.execute(_system_on_conflict(dialect_insert(SystemRollupHourly.__table__)), rows)
+
+
+def apply_rollups(db, rows):
+    """Fold freshly inserted rows into the hourly and daily rollups (per
+    station and fleet-wide). Runs inside the ingest transaction."""
+    hourly, daily = {}, {}
+    for row in rows:
+        _fold(hourly, (row['station_id'], _hour(row['timestamp'])), row)
+        _fold(daily, (row['station_id'], _day(row['timestamp'])), row)
+    _upsert(db, WeatherRollupHourly, hourly)
+    _upsert(db, WeatherRollupDaily, daily)
+    _upsert_system(db, hourly)
+
+
+def stored_datetimes(values):
+    """datetime64 array -> list of what the driver should bind for a
+    DateTime column: on SQLite the same text the ORM stores
+    ('YYYY-MM-DD HH:MM:SS.ffffff'), elsewhere datetime objects."""
+    values = values.astype('datetime64[us]')
+    if engine.dialect.name != 'sqlite':
+        return values.astype(object).tolist()
+    text = np.datetime_as_string(values, unit='us')
+    if len(text):
+        # 'T' -> ' ' sobre los códigos UCS-4 en sitio: np.char.replace cuesta 10x
+        text.view(np.uint32).reshape(len(text), -1)[:, 10] = ord(' ')
+    return text.tolist()
+
+
+def _bucket_columns(codes, names, units, columns):
+    """Group by (station code, time unit) with one sort and reduceat.
+    Returns {column: array}, one entry per bucket."""
+    t = units.astype(np.int64)
+    key = codes * (int(t.max() - t.min()) + 1) + (t - t.min())
+    order = np.argsort(key, kind='stable')
+    key = key[order]
+    starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    first = order[starts]
+    out = {
+        'station_id': names[codes[first]],
+        'bucket_start': units[first],
+        'count': np.diff(np.r_[starts, len(key)]),
+        'rainfall_sum': np.add.reduceat(np.nan_to_num(columns['total_rainfall'][order]), starts),
+        'wind_gust_max': np.maximum.reduceat(columns['wind_gust_ms'][order], starts),
+    }
+    for m, col in MEASURES.items():
+        v = columns[col][order]
+        out[f'{m}_sum'] = np.add.reduceat(v, starts)
+        out[f'{m}_sumsq'] = np.add.reduceat(v * v, starts)
+        out[f'{m}_min'] = np.minimum.reduceat(v, starts)
+        out[f'{m}_max'] = np.maximum.reduceat(v, starts)
+    return out
+
+
+def _system_columns(hourly):
+    """_system_rows for _bucket_columns output."""
+    hours, inverse = np.unique(hourly['bucket_start'], return_inverse=True)
+    return {
+        'bucket_start': hours,
+        'count': np.bincount(inverse, weights=hourly['count'], minlength=len(hours)).astype(np.int64),
+        'temperature_sum': np.bincount(inverse, weights=hourly['temperature_sum'], minlength=len(hours)),
+    }
+
+
+def _executemany(conn, stmt, columns):
+    """Run an upsert for column arrays through the driver's executemany:
+    for the bucket lists of a bulk load SQLAlchemy's per-row parameter
+    processing costs more than the upsert itself."""
+    if not len(columns['bucket_start']):
+        return
+    compiled = stmt.compile(dialect=engine.dialect, column_keys=list(columns))
+    # Mismo texto que guarda el ORM: si no, el ON CONFLICT no casa
+    values = {k: stored_datetimes(v) if k == 'bucket_start' else v.tolist() for k, v in columns.items()}
+    if compiled.positiontup:
+        rows = list(zip(*[values[k] for k in compiled.positiontup]))
+    else:
+        rows = [dict(zip(values, row)) for row in zip(*values.values())]
+    conn.exec_driver_sql(compiled.string, rows)
+
+
+def apply_rollup_columns(conn, stations, timestamps, columns):
+    """apply_rollups for bulk loads, vectorized: stations is one id or a
+    sequence of ids, timestamps a datetime64 array and columns maps the
+    weather_data measures to float arrays. conn is a Core Connection."""
+    if isinstance(stations, str):
+        names, codes = np.array([stations]), np.zeros(len(timestamps), dtype=np.int64)
+    else:
+        names, codes = np.unique(np.asarray(stations), return_inverse=True)
+    hourly = _bucket_columns(codes, names, timestamps.astype('datetime64[h]'), columns)
+    daily = _bucket_columns(codes, names, timestamps.astype('datetime64[D]'), columns)
+    for model, buckets in ((WeatherRollupHourly, hourly), (WeatherRollupDaily, daily)):
+        table = model.__table__
+        _executemany(conn, _merge_on_conflict(dialect_insert(table), table), buckets)
+    _executemany(conn, _system_on_conflict(dialect_insert(SystemRollupHourly.__table__)),
+                 _system_columns(hourly))
+
+
+def rebuild_rollups(db, chunk_size=50000):
+    """Recompute both rollup tables from weather_data and its partitions,
+    streaming the raw rows in chunks. Returns the number of readings folded."""
+    db.execute(delete(WeatherRollupHourly))
+    db.execute(delete(WeatherRollupDaily))
+    db.execute(delete(SystemRollupHourly))
+
+    total = 0
+    for table in all_tables(db):
+        columns = [table.c[c] for c in _RAW_COLUMNS]
+        last_id = 0
+        while True:
+            chunk = db.execute(
+                select(table.c.id, *columns).where(table.c.id > last_id).order_by(table.c.id).limit(chunk_size)
+            ).all()
+            if not chunk:
+                break
+            rows = [r._asdict() for r in chunk]
+            apply_rollups(db, rows)
+            last_id = chunk[-1].id
+            total += len(chunk)
+
+    db.commit()
+    logger.info(f"Rollups rebuilt from {total} readings")
+    return total
+
+
+def remove_station_rollups(db, station_id):
+    """Drop a station's rollups and take its share out of the fleet-wide
+    hourly totals. Runs inside the delete_station transaction."""
+    h = WeatherRollupHourly
+    for b in db.query(h.bucket_start, h.count, h.temperature_sum).filter(h.station_id == station_id):
+        db.query(SystemRollupHourly).filter(SystemRollupHourly.bucket_start == b.bucket_start).update({
+            SystemRollupHourly.count: SystemRollupHourly.count - b.count,
+            SystemRollupHourly.temperature_sum: SystemRollupHourly.temperature_sum - b.temperature_sum,
+        }, synchronize_session=False)
+    for model in (WeatherRollupHourly, WeatherRollupDaily):
+        db.query(model).filter(model.station_id == station_id).delete(synchronize_session=False)
+
+
+def ensure_rollups(db):
+    """Build the rollups on first start against an existing database."""
+    if db.query(WeatherRollupHourly.station_id).first() is None and db.query(WeatherData.id).first() is not None:
+        rebuild_rollups(db)
+
+
+# ── Query side ─────────────────────────────────────────────────────────────────
+
+def _empty():
+    agg = {'count': 0, 'rainfall_sum': 0.0, 'wind_gust_max': None}
+    for m in MEASURES:
+        agg.update({f'{m}_sum': 0.0, f'{m}_sumsq': 0.0, f'{m}_min': None, f'{m}_max': None})
+    return agg
+
+
+def _merge(agg, part):
+    if not part or not part['count']:
+        return
+    agg['count'] += part['count']
+    agg['rainfall_sum'] += part['rainfall_sum'] or 0
+    for key in [f'{m}_{s}' for m in MEASURES for s in ('sum', 'sumsq')]:
+        agg[key] += part[key] or 0
+    for key, pick in [(f'{m}_min', min) for m in MEASURES] + \
+                     [(f'{m}_max', max) for m in MEASURES] + [('wind_gust_max', max)]:
+        if part[key] is not None:
+            agg[key] = part[key] if agg[key] is None else pick(agg[key], part[key])
+
+
+def _rollup_part(db, model, ranges, station_id):
+    ranges = [(a, b) for a, b in ranges if a < b]
+    if not ranges:
+        return None
+    cols = [func.sum(model.count).label('count'),
+            func.sum(model.rainfall_sum).label('rainfall_sum'),
+            func.max(model.wind_gust_max).label('wind_gust_max')]
+    for m in MEASURES:
+        cols += [func.sum(getattr(model, f'{m}_sum')).label(f'{m}_sum'),
+                 func.sum(getattr(model, f'{m}_sumsq')).label(f'{m}_sumsq'),
+                 func.min(getattr(model, f'{m}_min')).label(f'{m}_min'),
+                 func.max(getattr(model, f'{m}_max')).label(f'{m}_max')]
+    query = db.query(*cols).filter(
+        or_(*[and_(model.bucket_start >= a, model.bucket_start < b) for a, b in ranges])
+    )
+    if station_id is not None:
+        query = query.filter(model.station_id == station_id)
+    return query.one()._asdict()
+
+
+def _raw_part(db, ranges, station_id):
+    """Aggregate raw readings in SQL; ranges may be open-ended (end=None)."""
+    ranges = [(a, b) for a, b in ranges if b is None or a < b]
+    if not ranges:
+        return None
+    cols = [func.count(WeatherData.id).label('count'),
+            func.sum(WeatherData.total_rainfall).label('rainfall_sum'),
+            func.max(WeatherData.wind_gust_ms).label('wind_gust_max')]
+    for m, col in MEASURES.items():
+        c = getattr(WeatherData, col)
+        cols += [func.sum(c).label(f'{m}_sum'),
+                 func.sum(c * c).label(f'{m}_sumsq'),
+                 func.min(c).label(f'{m}_min'),
+                 func.max(c).label(f'{m}_max')]
+    conds = [and_(WeatherData.timestamp >= a, WeatherData.timestamp < b) if b is not None
+             else WeatherData.timestamp >= a for a, b in ranges]
+    stmt = select(*cols).where(or_(*conds))
+    if station_id is not None:
+        stmt = stmt.where(WeatherData.station_id == station_id)
+    end = None if any(b is None for _, b in ranges) else max(b for _, b in ranges)
+    return db.execute(route(db, stmt, min(a for a, _ in ranges), end)).one()._asdict()
+
+
+def window_aggregates(db, since, until, station_id=None):
+    """Merged aggregates for readings with timestamp >= since.
+
+    Whole days come from the daily rollup, whole hours from the hourly one
+    and only [since, first hour) and [last hour, ...) are read raw, so the
+    cost depends on the number of buckets, not on the number of readings."""
+    agg = _empty()
+    hour_start = _ceil(since, _hour, timedelta(hours=1))
+    hour_end = _hour(until)
+
+    if hour_start >= hour_end:
+        _merge(agg, _raw_part(db, [(since, None)], station_id))
+        return agg
+
+    day_start = _ceil(hour_start, _day, timedelta(days=1))
+    day_end = _day(hour_end)
+    if day_start < day_end:
+        _merge(agg, _rollup_part(db, WeatherRollupDaily, [(day_start, day_end)], station_id))
+        hourly = [(hour_start, day_start), (day_end, hour_end)]
+    else:
+        hourly = [(hour_start, hour_end)]
+    _merge(agg, _rollup_part(db, WeatherRollupHourly, hourly, station_id))
+    _merge(agg, _raw_part(db, [(since, hour_start), (hour_end, None)], station_id))
+    return agg
+
+
+def fleet_avg_temperature(db, since, until):
+    """Fleet-wide average temperature for readings with timestamp >= since:
+    at most ~24 rows of system_rollup_hourly plus the raw edges."""
+    hour_start = _ceil(since, _hour, timedelta(hours=1))
+    hour_end = _hour(until)
+    count, total = 0, 0.0
+    raw = [(since, None)]
+    if hour_start < hour_end:
+        row = db.query(func.sum(SystemRollupHourly.count), func.sum(SystemRollupHourly.temperature_sum)).filter(
+            SystemRollupHourly.bucket_start >= hour_start, SystemRollupHourly.bucket_start < hour_end
+        ).one()
+        count, total = row[0] or 0, row[1] or 0.0
+        raw = [(since, hour_start), (hour_end, None)]
+    edges = _raw_part(db, raw, None)
+    if edges and edges['count']:
+        count += edges['count']
+        total += edges['temperature_sum']
+    return total / count if count else None
+
+
+def describe(agg, measure):
+    """avg/min/max/std_dev of one measure, in the /stats response shape."""
+    n = agg['count']
+    if not n:
+        return None
+    total, sumsq = agg[f'{measure}_sum'], agg[f'{measure}_sumsq']
+    std = 0
+    if n > 1:
+        std = math.sqrt(max(sumsq - total * total / n, 0.0) / (n - 1))
+    return {
+        "avg": round(total / n, 2),
+        "min": round(agg[f'{measure}_min'], 2),
+        "max": round(agg[f'{measure}_max'], 2),
+        "std_dev": round(std, 2)
+    }
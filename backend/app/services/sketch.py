@@ -0,0 +1,71 @@
+"""Mergeable streaming quantile sketch (DDSketch-style).
+
+Values are counted in logarithmic bins whose width guarantees a relative
+error of at most `relative_accuracy` on every quantile. Memory depends on
+the dynamic range of the data, not on the number of values, and two
+sketches merge by adding their bin counts."""
+import math
+
+import numpy as np
+
+
+class QuantileSketch:
+    def __init__(self, relative_accuracy=0.01, min_value=1e-6):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _add_keys(self, store, magnitudes):
+        keys = np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64)
+        uniq, counts = np.unique(keys, return_counts=True)
+        for k, c in zip(uniq.tolist(), counts.tolist()):
+            store[k] = store.get(k, 0) + c
+
+    def add_array(self, values):
+        """Add a NumPy array of values (NaN is ignored)."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return
+        pos = values[values > self.min_value]
+        neg = -values[values < -self.min_value]
+        if pos.size:
+            self._add_keys(self.positive, pos)
+        if neg.size:
+            self._add_keys(self.negative, neg)
+        self.zero_count += int(values.size - pos.size - neg.size)
+        self.count += int(values.size)
+
+    def merge(self, other):
+        for mine, theirs in ((self.positive, other.positive), (self.negative, other.negative)):
+            for k, c in theirs.items():
+                mine[k] = mine.get(k, 0) + c
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def _value(self, key):
+        # punto medio del bin en escala relativa
+        return 2 * self.gamma ** key / (1 + self.gamma)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for k in sorted(self.negative, reverse=True):
+            seen += self.negative[k]
+            if seen > rank:
+                return -self._value(k)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for k in sorted(self.positive):
+            seen += self.positive[k]
+            if seen > rank:
+                return self._value(k)
+        return self._value(max(self.positive)) if self.positive else 0.0
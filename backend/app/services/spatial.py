@@ -0,0 +1,197 @@
+"""Spatial index of stations: bounding-box and nearest-station queries.
+
+On SQLite the index is an R*Tree virtual table (station_rtree) with one
+point box per station and the station id as an auxiliary column. A row's
+rid is a 63-bit hash of the station id (station_rid), so a station is
+moved or removed by rowid instead of scanning the auxiliary column; the
+table is created by init_db(). Lookups
+are range searches of the tree, logarithmic in the number of stations;
+R*Tree keeps 32-bit coordinates rounded outwards, so the exact
+latitude/longitude of weather_stations is checked afterwards. Like
+station_latest it is derived data: the station CRUD keeps it in sync and
+ensure_spatial() rebuilds it if it does not match weather_stations.
+
+Other dialects have no R*Tree; the same functions then filter on the
+coordinates alone (a scan)."""
+import hashlib
+import logging
+import math
+
+import numpy as np
+from sqlalchemy import (DDL, Column, Float, Integer, MetaData, String, Table, and_, event,
+                        func, or_, select)
+
+from app.core.database import IS_SQLITE, Base
+from app.models.station import WeatherStation
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+# Caja inicial de nearest (~11 km); se duplica hasta contener k estaciones
+_START_DEGREES = 0.1
+
+# Fuera de Base.metadata: create_all no sabe crear tablas virtuales
+_metadata = MetaData()
+station_rtree = Table(
+    "station_rtree", _metadata,
+    Column("rid", Integer, primary_key=True),
+    Column("min_lat", Float), Column("max_lat", Float),
+    Column("min_lon", Float), Column("max_lon", Float),
+    Column("station_id", String(36)),
+)
+
+_CREATE = DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS station_rtree "
+    "USING rtree(rid, min_lat, max_lat, min_lon, max_lon, +station_id)"
+)
+# init_db() (create_all) crea también el índice: la CLI no pasa por ensure_spatial
+event.listen(Base.metadata, "after_create", _CREATE.execute_if(dialect="sqlite"))
+
+
+def station_rid(station_id):
+    """rid of a station in station_rtree: the first 63 bits of its blake2b."""
+    digest = hashlib.blake2b(station_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 1
+
+
+def parse_bbox(value):
+    """'west,south,east,north' in degrees (Leaflet's toBBoxString order).
+    west > east means the box crosses the antimeridian."""
+    try:
+        west, south, east, north = (float(v) for v in value.split(','))
+    except ValueError:
+        raise ValueError("bbox debe ser 'oeste,sur,este,norte' en grados")
+    if not (-90 <= south <= north <= 90) or not (-180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError("bbox fuera de rango (lat -90..90, lon -180..180, sur <= norte)")
+    return west, south, east, north
+
+
+def _lon_ranges(west, east):
+    """One or two [west, east] ranges, split at the antimeridian."""
+    if west <= east:
+        return [(west, east)]
+    return [(west, 180.0), (-180.0, east)]
+
+
+def within_clause(west, south, east, north):
+    """WHERE clause on WeatherStation for stations inside the box."""
+    exact = and_(
+        WeatherStation.latitude.between(south, north),
+        or_(*[WeatherStation.longitude.between(w, e) for w, e in _lon_ranges(west, east)]),
+    )
+    if not IS_SQLITE:
+        return exact
+    r = station_rtree.c
+    candidates = select(r.station_id).where(
+        r.max_lat >= south, r.min_lat <= north,
+        or_(*[and_(r.max_lon >= w, r.min_lon <= e) for w, e in _lon_ranges(west, east)]),
+    )
+    return and_(WeatherStation.id.in_(candidates), exact)
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distance from (lat, lon) to arrays of points."""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _search_box(lat, lon, degrees):
+    """(west, south, east, north) around the point and the radius in km
+    that the box is guaranteed to contain."""
+    south, north = max(lat - degrees, -90.0), min(lat + degrees, 90.0)
+    if abs(lat) + degrees >= 90:
+        # La caja toca el polo: todas las longitudes
+        return (-180.0, south, 180.0, north), degrees * KM_PER_DEGREE
+    widest = math.cos(math.radians(abs(lat) + degrees))
+    half_lon = degrees / widest
+    if half_lon >= 180:
+        return (-180.0, south, 180.0, north), degrees * KM_PER_DEGREE
+    west, east = lon - half_lon, lon + half_lon
+    west = west + 360 if west < -180 else west
+    east = east - 360 if east > 180 else east
+    # Distancia del centro al meridiano del borde este/oeste
+    to_side = math.degrees(math.asin(min(1.0, math.cos(math.radians(lat)) *
+                                         math.sin(math.radians(min(half_lon, 90))))))
+    return (west, south, east, north), min(degrees, to_side) * KM_PER_DEGREE
+
+
+def nearest(db, lat, lon, k):
+    """[(station_id, distance_km)] of the k stations closest to the point,
+    nearest first. Grows a search box until it holds k stations and the
+    k-th is no farther than the box's inscribed radius."""
+    degrees = _START_DEGREES
+    while True:
+        box, radius_km = _search_box(lat, lon, degrees)
+        rows = db.query(WeatherStation.id, WeatherStation.latitude, WeatherStation.longitude).filter(
+            within_clause(*box)
+        ).all()
+        whole_world = degrees >= 180
+        if len(rows) >= k or whole_world:
+            if not rows:
+                return []
+            distances = haversine_km(lat, lon, np.array([r[1] for r in rows]),
+                                     np.array([r[2] for r in rows]))
+            order = np.argsort(distances, kind='stable')[:k]
+            if whole_world or distances[order[-1]] <= radius_km:
+                return [(rows[i][0], round(float(distances[i]), 3)) for i in order]
+        # Con pocas estaciones en la caja se salta directamente a una que tenga ~k
+        grow = math.sqrt(k / len(rows)) if rows else 4.0
+        degrees = min(degrees * max(2.0, grow), 180.0)
+
+
+# ── Mantenimiento del índice ───────────────────────────────────────────────────
+
+def _create(db):
+    db.execute(_CREATE)
+
+
+def _row(station_id, latitude, longitude):
+    return {'rid': station_rid(station_id), 'min_lat': latitude, 'max_lat': latitude,
+            'min_lon': longitude, 'max_lon': longitude, 'station_id': station_id}
+
+
+def index_station(db, station_id, latitude, longitude):
+    """Add or move a station in the index (caller's transaction)."""
+    if not IS_SQLITE:
+        return
+    unindex_station(db, station_id)
+    db.execute(station_rtree.insert().values(**_row(station_id, latitude, longitude)))
+
+
+def unindex_station(db, station_id):
+    if IS_SQLITE:
+        db.execute(station_rtree.delete().where(station_rtree.c.rid == station_rid(station_id)))
+
+
+def rebuild_spatial(db):
+    """Recreate station_rtree from weather_stations. Returns the row count."""
+    if not IS_SQLITE:
+        return 0
+    _create(db)
+    db.execute(station_rtree.delete())
+    stations = db.execute(select(WeatherStation.id, WeatherStation.latitude, WeatherStation.longitude))
+    rows = [_row(*s) for s in stations]
+    if rows:
+        db.execute(station_rtree.insert(), rows)
+    db.commit()
+    count = db.execute(select(func.count()).select_from(station_rtree)).scalar()
+    logger.info(f"station_rtree rebuilt: {count} stations")
+    return count
+
+
+def ensure_spatial(db):
+    """Create the index on first start, or rebuild it when stations were
+    written without it or its rids are not station_rid() (older versions)."""
+    if not IS_SQLITE:
+        return
+    _create(db)
+    db.commit()
+    indexed = db.execute(select(func.count()).select_from(station_rtree)).scalar()
+    sample = db.execute(select(station_rtree.c.rid, station_rtree.c.station_id).limit(1)).first()
+    if (indexed != db.query(func.count(WeatherStation.id)).scalar()
+            or (sample is not None and sample.rid != station_rid(sample.station_id))):
+        rebuild_spatial(db)
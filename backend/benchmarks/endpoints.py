@@ -0,0 +1,388 @@
+"""
+Benchmark de todas las rutas de stations_routes y data_routes.
+
+Siembra bases SQLite a varias escalas (se guardan en benchmarks/data/ y se
+reutilizan), ejecuta cada ruta con el test client de Flask y mide latencia
+(p50/p95/p99), RSS máximo durante la primera llamada y número de consultas
+SQL por petición. Compara contra una línea base guardada y marca las
+regresiones (código de salida 1).
+
+Cada escala corre en un proceso aparte: el motor de SQLAlchemy se crea al
+importar la app con DATABASE_URL, y así el RSS de una escala no contamina
+la siguiente.
+
+Uso:  python benchmarks/endpoints.py                       # escala small
+      python benchmarks/endpoints.py --scales small,medium --iterations 30
+      python benchmarks/endpoints.py --scales large --reseed
+      python benchmarks/endpoints.py --save-baseline         # guarda benchmarks/baseline.json
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent))
+
+# escala -> (estaciones, lecturas totales); una lectura por minuto y estación
+SCALES = {
+    'small': (10, 10_000),
+    'medium': (100, 1_000_000),
+    'large': (1000, 10_000_000),
+}
+READING_INTERVAL_S = 60
+SEED_CHUNK = 100_000
+DATA_DIR = HERE / 'data'
+DEFAULT_BASELINE = HERE / 'baseline.json'
+
+# Umbrales de regresión
+NOISE_MS = 2.0
+RSS_SLACK_MB = 8.0
+# Techos fijos de consultas, con o sin línea base: un lote de 500 lecturas
+# debe costar un número constante de sentencias, no una por fila
+QUERY_LIMITS = {
+    'data.submit_batch': 12,
+}
+
+
+# ── Siembra ────────────────────────────────────────────────────────────────────
+
+def _seed(n_stations, n_readings):
+    """Fill an empty database with bulk_load (the simulator's model, as
+    manage.py seed) plus the derived tables it does not maintain.
+    Returns seconds spent."""
+    from app.core.database import SessionLocal
+    from app.models.station import WeatherStation
+    from app.services.bulk_load import bulk_load, synthetic_batches
+    from app.services.counters import rebuild_counters
+    from app.services.spatial import rebuild_spatial
+
+    t0 = time.perf_counter()
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    per_station = n_readings // n_stations
+    with SessionLocal() as db:
+        sids = []
+        for i in range(n_stations):
+            station = WeatherStation(
+                id=f"bench-{i:05d}", name=f"bench_{i:05d}", location="benchmark",
+                latitude=19.4 + i / n_stations, longitude=-99.1 - i / n_stations,
+            )
+            db.add(station)
+            sids.append(station.id)
+        db.commit()
+
+    start = now - timedelta(seconds=per_station * READING_INTERVAL_S)
+    bulk_load(synthetic_batches(sids, start, now, interval_s=READING_INTERVAL_S, chunk=SEED_CHUNK, seed=42))
+    with SessionLocal() as db:
+        rebuild_counters(db)
+        rebuild_spatial(db)
+    return time.perf_counter() - t0
+
+
+# ── Medición ───────────────────────────────────────────────────────────────────
+
+class QueryCounter:
+    def __init__(self, engines):
+        from sqlalchemy import event
+        self.count = 0
+        for eng in set(engines):
+            event.listen(eng, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+class RssSampler:
+    """Samples /proc/self/statm every millisecond while active."""
+
+    def __init__(self):
+        self.page = os.sysconf('SC_PAGE_SIZE')
+        self.peak = 0
+        self.active = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def rss(self):
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * self.page
+
+    def _run(self):
+        while True:
+            self.active.wait()
+            self.peak = max(self.peak, self.rss())
+            time.sleep(0.001)
+
+    def start(self):
+        self.peak = self.rss()
+        self.active.set()
+        return self.peak
+
+    def stop(self):
+        self.active.clear()
+        return max(self.peak, self.rss())
+
+
+def _percentile(sorted_values, p):
+    k = max(0, -(-len(sorted_values) * p // 100) - 1)
+    return sorted_values[int(k)]
+
+
+def _routes(client, ctx):
+    """name -> callable returning (method, path, json body). Setup work done
+    inside the callable (e.g. creating the station to delete) is not timed."""
+    sid, ids, hours = ctx['station'], ctx['stations'], ctx['hours']
+    writer = ctx['writer']
+    some = ','.join(ids[:10])
+
+    def delete_station():
+        new = client.post('/api/stations/', json={
+            'name': 'bench_delete', 'location': 'benchmark', 'latitude': 0, 'longitude': 0,
+        }).get_json()['id']
+        client.post('/api/data/submit/batch', json={'station_id': new, 'readings': [
+            {'temperature': 20.0, 'humidity': 50.0} for _ in range(100)
+        ]})
+        return 'DELETE', f'/api/stations/{new}', None
+
+    def create_station():
+        return 'POST', '/api/stations/', {
+            'name': 'bench_created', 'location': 'benchmark', 'latitude': 0, 'longitude': 0,
+        }
+
+    return {
+        'stations.list': lambda: ('GET', '/api/stations/?limit=100', None),
+        'stations.list_page2': lambda: ('GET', f"/api/stations/?limit=100&cursor={ctx['cursor']}", None)
+        if ctx['cursor'] else ('GET', '/api/stations/?limit=100', None),
+        'stations.get': lambda: ('GET', f'/api/stations/{sid}', None),
+        'stations.create': create_station,
+        'stations.update': lambda: ('PUT', f'/api/stations/{writer}', {'description': 'bench'}),
+        'stations.delete': delete_station,
+        'stations.data_raw': lambda: ('GET', f'/api/stations/{sid}/data?hours={hours}&limit=2000', None),
+        'stations.data_avg': lambda: ('GET', f'/api/stations/{sid}/data?hours={hours}&buckets=300', None),
+        'stations.data_lttb': lambda: ('GET', f'/api/stations/{sid}/data?hours={hours}&buckets=300&mode=lttb', None),
+        'stations.stats': lambda: ('GET', f'/api/stations/{sid}/stats?hours={hours}', None),
+        'stations.stats_pct': lambda: ('GET', f'/api/stations/{sid}/stats?hours={hours}&percentiles=true', None),
+        'stations.overview': lambda: ('GET', '/api/stations/stats/overview', None),
+        'stations.within': lambda: ('GET', '/api/stations/within?bbox=-99.6,19.0,-98.6,20.0', None),
+        'stations.nearest': lambda: ('GET', '/api/stations/nearest?lat=19.9&lon=-99.6&k=10', None),
+        'stations.compare': lambda: ('GET', f'/api/stations/compare?station_ids={some}&hours={hours}&resolution=5m', None),
+        'stations.export_json': lambda: ('GET', f'/api/stations/bulk/export?station_ids={some}&hours={hours}', None),
+        'stations.export_csv': lambda: ('GET', f'/api/stations/bulk/export?station_ids={some}&hours={hours}&format=csv', None),
+        'stations.export_npz': lambda: ('GET', f'/api/stations/bulk/export?station_ids={some}&hours={hours}&format=npz', None),
+        'stations.live_replay': lambda: ('STREAM', f"/api/stations/live?last_event_id={ctx['max_id'] - 500}", 500),
+        'stations.live_station': lambda: (
+            'STREAM', f"/api/stations/{sid}/live?last_event_id={ctx['station_replay_from']}", 500),
+        'data.submit': lambda: ('POST', '/api/data/submit', {
+            'station_id': writer, 'temperature': 21.5, 'humidity': 48.0, 'wind_speed_ms': 2.0,
+        }),
+        'data.submit_batch': lambda: ('POST', '/api/data/submit/batch', {
+            'station_id': writer, 'readings': [{'temperature': 20.0 + k / 100, 'humidity': 50.0}
+                                               for k in range(500)],
+        }),
+        'data.station': lambda: ('GET', f'/api/data/station/{sid}?hours={hours}&limit=100', None),
+    }
+
+
+def _call(client, method, path, body):
+    if method == 'STREAM':
+        # Solo el replay (body = eventos esperados): retry + un fragmento por
+        # evento. Un replay incompleto cuenta como error
+        resp = client.get(path, buffered=False)
+        chunks = sum(1 for _ in islice(resp.response, body + 1))
+        resp.close()
+        return (resp.status_code if chunks == body + 1 else 500), None
+    resp = client.open(path, method=method, json=body)
+    resp.get_data()
+    return resp.status_code, resp
+
+
+def run_scale(scale, iterations, reseed, only):
+    """Seed (if needed) and benchmark one scale in this process."""
+    n_stations, n_readings = SCALES[scale]
+    DATA_DIR.mkdir(exist_ok=True)
+    db_path = DATA_DIR / f'bench_{scale}.db'
+    if reseed:
+        for suffix in ('', '-wal', '-shm'):
+            Path(f'{db_path}{suffix}').unlink(missing_ok=True)
+    fresh = not db_path.exists()
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    os.environ.setdefault('RETENTION_INTERVAL_MIN', '0')
+    # Se mide el trabajo de cada ruta, no los aciertos de la caché compartida
+    os.environ.setdefault('RESPONSE_CACHE_ENABLED', 'false')
+
+    from main import app
+    from app.core.database import ReadSessionLocal, engine, read_engine
+    from app.services.live import max_reading_id
+    from app.models.station import WeatherData
+
+    seed_s = _seed(n_stations, n_readings) if fresh else None
+    client = app.test_client()
+    with ReadSessionLocal() as db:
+        from sqlalchemy import func
+        newest = db.query(func.max(WeatherData.timestamp)).scalar()
+        max_id = max_reading_id(db)
+    # Ventana de 24 h que termina en la última lectura sembrada, aunque la base sea de otro día
+    age_h = int((datetime.now(timezone.utc).replace(tzinfo=None) - newest).total_seconds() // 3600)
+    stations = [s['id'] for s in client.get('/api/stations/?limit=1000').get_json()
+                if s['id'].startswith('bench-')]
+    with ReadSessionLocal() as db:
+        # Id tras el que quedan las últimas 500 lecturas de la estación medida
+        station_replay_from = db.query(WeatherData.id).filter(
+            WeatherData.station_id == stations[0]
+        ).order_by(WeatherData.id.desc()).offset(500).limit(1).scalar()
+    first_page = client.get('/api/stations/?limit=100')
+    writer = client.post('/api/stations/', json={
+        'name': 'bench_writer', 'location': 'benchmark', 'latitude': 0, 'longitude': 0,
+    }).get_json()['id']
+    ctx = {
+        'station': stations[0], 'stations': stations, 'hours': age_h + 24, 'max_id': max_id,
+        'writer': writer, 'cursor': first_page.headers.get('X-Next-Cursor'),
+        'station_replay_from': station_replay_from,
+    }
+
+    counter = QueryCounter([engine, read_engine])
+    sampler = RssSampler()
+    results = {}
+    created = []
+    try:
+        for name, make in _routes(client, ctx).items():
+            if only and not any(o in name for o in only):
+                continue
+            latencies, queries, errors, rss_delta = [], [], 0, 0.0
+            for i in range(iterations + 1):
+                method, path, body = make()
+                counter.count = 0
+                before = sampler.start() if i == 0 else None
+                t0 = time.perf_counter()
+                status, resp = _call(client, method, path, body)
+                elapsed = (time.perf_counter() - t0) * 1000
+                if name == 'stations.create' and status == 201:
+                    created.append(resp.get_json()['id'])
+                if i == 0:
+                    # Primera llamada: pico de memoria (después el allocator ya tiene las páginas)
+                    rss_delta = (sampler.stop() - before) / 2**20
+                    continue
+                if status >= 400:
+                    errors += 1
+                latencies.append(elapsed)
+                queries.append(counter.count)
+            latencies.sort()
+            results[name] = {
+                'p50_ms': round(_percentile(latencies, 50), 2),
+                'p95_ms': round(_percentile(latencies, 95), 2),
+                'p99_ms': round(_percentile(latencies, 99), 2),
+                'max_ms': round(latencies[-1], 2),
+                'queries': max(queries),
+                'rss_delta_mb': round(rss_delta, 1),
+                'errors': errors,
+            }
+    finally:
+        for sid in created + [writer]:
+            client.delete(f'/api/stations/{sid}')
+
+    return {
+        'scale': scale,
+        'stations': n_stations,
+        'readings': n_readings,
+        'seed_seconds': round(seed_s, 1) if seed_s else None,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'routes': results,
+    }
+
+
+# ── Comparación ────────────────────────────────────────────────────────────────
+
+def compare(current, baseline, tolerance):
+    """List of regression messages for one scale."""
+    issues = []
+    for name, now in current['routes'].items():
+        limit = QUERY_LIMITS.get(name)
+        if limit is not None and now['queries'] > limit:
+            issues.append(f"{name}: queries {now['queries']} > {limit} (límite fijo)")
+        base = baseline.get('routes', {}).get(name)
+        if not base:
+            continue
+        for key in ('p50_ms', 'p95_ms'):
+            limit = base[key] * (1 + tolerance) + NOISE_MS
+            if now[key] > limit:
+                issues.append(f"{name}: {key} {now[key]} > {base[key]} (+{tolerance:.0%})")
+        if now['queries'] > base['queries']:
+            issues.append(f"{name}: queries {now['queries']} > {base['queries']}")
+        if now['rss_delta_mb'] > base['rss_delta_mb'] * (1 + tolerance) + RSS_SLACK_MB:
+            issues.append(f"{name}: rss {now['rss_delta_mb']} MB > {base['rss_delta_mb']} MB")
+        if now['errors'] > base.get('errors', 0):
+            issues.append(f"{name}: {now['errors']} errores")
+    return issues
+
+
+def _print_scale(result, issues):
+    seeded = f", sembrada en {result['seed_seconds']} s" if result['seed_seconds'] else ""
+    print(f"\n  {result['scale']}: {result['stations']} estaciones × "
+          f"{result['readings']:,} lecturas{seeded}, RSS máx {result['peak_rss_mb']} MB\n")
+    print(f"  {'ruta':<24} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'consultas':>10} {'ΔRSS MB':>8}")
+    print("  " + "-" * 74)
+    flagged = {msg.split(':')[0] for msg in issues}
+    for name, r in result['routes'].items():
+        mark = ' ⚠' if name in flagged else ''
+        print(f"  {name:<24} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} "
+              f"{r['queries']:>10} {r['rss_delta_mb']:>8.1f}{mark}")
+    for msg in issues:
+        print(f"  ⚠ regresión: {msg}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de rutas de la API")
+    parser.add_argument("--scales", default="small", help=f"Lista separada por comas de {list(SCALES)}")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--routes", default="", help="Solo rutas que contengan alguno de estos textos")
+    parser.add_argument("--reseed", action="store_true", help="Vuelve a sembrar las bases")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Margen antes de marcar regresión de latencia/RSS (default: 0.25)")
+    parser.add_argument("--json", help="Escribe los resultados en este archivo")
+    parser.add_argument("--run-scale", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    only = [r for r in args.routes.split(',') if r]
+
+    if args.run_scale:
+        result = run_scale(args.run_scale, args.iterations, args.reseed, only)
+        print(json.dumps(result))
+        return 0
+
+    results = {}
+    for scale in [s for s in args.scales.split(',') if s]:
+        if scale not in SCALES:
+            parser.error(f"escala desconocida: {scale}")
+        cmd = [sys.executable, __file__, '--run-scale', scale, '--iterations', str(args.iterations),
+               '--routes', args.routes] + (['--reseed'] if args.reseed else [])
+        out = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, text=True).stdout
+        results[scale] = json.loads(out.strip().splitlines()[-1])
+
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    regressions = 0
+    for scale, result in results.items():
+        issues = compare(result, baseline.get(scale, {}), args.tolerance)
+        regressions += len(issues)
+        _print_scale(result, issues)
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        baseline.update(results)
+        baseline_path.write_text(json.dumps(baseline, indent=2) + "\n")
+        print(f"\n  Línea base guardada en {baseline_path}")
+        return 0
+    if not baseline:
+        print(f"\n  Sin línea base ({baseline_path}); usa --save-baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
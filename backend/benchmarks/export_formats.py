@@ -0,0 +1,93 @@
+"""
+Compara tamaño y tiempo de decodificación de los formatos de /bulk/export.
+
+Crea una base SQLite temporal, la llena con N lecturas por estación y
+exporta el mismo rango en json, ndjson, csv y npz.
+
+Uso:  python benchmarks/export_formats.py
+      python benchmarks/export_formats.py --stations 5 --readings 50000
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def _decode_json(body):
+    doc = json.loads(body)
+    return sum(len(v['data']) for v in doc.values())
+
+
+def _decode_ndjson(body):
+    return sum(1 for line in body.splitlines() if json.loads(line))
+
+
+def _decode_csv(body):
+    return sum(1 for _ in csv.DictReader(io.StringIO(body.decode())))
+
+
+def _decode_npz(body):
+    import numpy as np
+    with np.load(io.BytesIO(body)) as npz:
+        meta = json.loads(str(npz['meta']))
+        total = 0
+        for st in meta['stations']:
+            ts = npz[f"{st['id']}/timestamp"]
+            npz[f"{st['id']}/temperature"]
+            total += len(ts)
+    return total
+
+
+DECODERS = {'json': _decode_json, 'ndjson': _decode_ndjson, 'csv': _decode_csv, 'npz': _decode_npz}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de formatos de exportación")
+    parser.add_argument("--stations", type=int, default=3)
+    parser.add_argument("--readings", type=int, default=20000, help="Lecturas por estación")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+    from main import app
+
+    client = app.test_client()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    ids = []
+    for i in range(args.stations):
+        sid = client.post("/api/stations/", json={
+            "name": f"bench_{i}", "location": "bench", "latitude": 19.4, "longitude": -99.1,
+        }).get_json()["id"]
+        ids.append(sid)
+        for start in range(0, args.readings, 5000):
+            readings = [{
+                "temperature": 20 + (k % 100) / 10, "humidity": 50.0, "wind_speed_ms": 3.0,
+                "wind_gust_ms": 5.0, "wind_direction_degrees": 180.0,
+                "timestamp": (now - timedelta(seconds=30 * k)).isoformat(),
+            } for k in range(start, min(start + 5000, args.readings))]
+            client.post("/api/data/submit/batch", json={"station_id": sid, "readings": readings})
+
+    hours = args.readings * 30 // 3600 + 1
+    print(f"\n  {args.stations} estaciones × {args.readings} lecturas\n")
+    print(f"  {'formato':<8} {'tamaño':>12} {'servidor':>10} {'decodificar':>12} {'filas':>9}")
+    print("  " + "-" * 55)
+    for fmt, decode in DECODERS.items():
+        t0 = time.perf_counter()
+        resp = client.get(f"/api/stations/bulk/export?station_ids={','.join(ids)}&hours={hours}&format={fmt}")
+        body = resp.get_data()
+        t1 = time.perf_counter()
+        rows = decode(body)
+        t2 = time.perf_counter()
+        print(f"  {fmt:<8} {len(body) / 1e6:>9.2f} MB {t1 - t0:>9.3f}s {t2 - t1:>11.4f}s {rows:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,21 @@
-from flask import Flask, jsonify, send_from_directory
+from flask import Flask, Response, g, jsonify, request, send_from_directory
 from flask_cors import CORS
 import logging
+import time
 from pathlib import Path
 
 from app.core.config import settings
-from app.core.database import init_db
+from app.core.database import init_db, report_storage, SessionLocal
+from app.core import metrics, profiler
 # Importar modelos para que Base.metadata los registre antes de init_db()
 from app.models.station import WeatherStation, WeatherData  # noqa: F401
 from app.api import stations_routes, data_routes
+from app.services.ingest_queue import ingest_queue
+from app.services.latest import ensure_latest
+from app.services.rollups import ensure_rollups
+from app.services.counters import ensure_counters
+from app.services.spatial import ensure_spatial
+from app.services.retention import retention_scheduler
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,20 +24,74 @@ app = Flask(__name__)
 app.config['JSON_SORT_KEYS'] = False
 app.url_map.strict_slashes = False
 
-CORS(app, resources={r"/api/*": {"origins": "*"}})
+CORS(app, resources={r"/api/*": {"origins": "*"}},
+     expose_headers=["X-Next-Cursor", "Link", "Server-Timing", "X-Query-Count", "X-Cache"])
 
 # Crear tablas al arrancar
 init_db()
+report_storage()
+with SessionLocal() as _db:
+    try:
+        ensure_latest(_db)
+        ensure_rollups(_db)
+        ensure_counters(_db)
+        ensure_spatial(_db)
+    except Exception as e:
+        # Otro worker puede estar reconstruyendo a la vez
+        _db.rollback()
+        logger.warning(f"Derived tables not rebuilt at startup: {e}")
 
 app.register_blueprint(stations_routes.bp)
 app.register_blueprint(data_routes.bp)  
 
+# Ingesta diferida: el escritor vive en cada worker y vacía la cola al salir
+if settings.INGEST_MODE == 'buffered':
+    ingest_queue.start()
+
+# Retención periódica (RETENTION_INTERVAL_MIN > 0); un solo worker purga a la vez
+retention_scheduler.start()
+
 
 @app.route("/health", methods=["GET"])
 def health_check():
     return jsonify({"status": "ok", "service": "weather-api"}), 200
 
 
+# Métricas: un before/after_request por petición. /metrics exige token o IP
+# permitida (en Fly el backend es público); nginx no lo expone
+if settings.METRICS_ENABLED:
+    metrics.registry.start()
+
+    @app.before_request
+    def _metrics_start():
+        g.metrics_t0 = time.perf_counter()
+
+    @app.after_request
+    def _metrics_record(response):
+        t0 = g.pop('metrics_t0', None)
+        if t0 is not None:
+            # La regla (/api/stations/<station_id>) y no la URL: cardinalidad acotada
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            metrics.http_latency.observe(time.perf_counter() - t0, route, request.method)
+            metrics.http_requests.inc(route, request.method, str(response.status_code))
+            rows = g.pop('metrics_rows', None)
+            if rows is not None:
+                metrics.read_rows.observe(rows, route)
+        return response
+
+    if metrics.scrape_configured():
+        @app.route("/metrics", methods=["GET"])
+        def prometheus_metrics():
+            if not metrics.scrape_allowed(request):
+                return jsonify({"detail": "Forbidden"}), 403
+            return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+    else:
+        logger.info("/metrics disabled: set METRICS_TOKEN or METRICS_ALLOW to expose it")
+
+if settings.SQL_PROFILE:
+    profiler.install(app)
+
+
 # Detecta la carpeta frontend — prueba múltiples rutas
 _here = Path(__file__).parent
 FRONTEND_DIR = next(
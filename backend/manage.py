@@ -0,0 +1,178 @@
+"""
+Tareas de mantenimiento de la base de datos.
+
+Uso:  python manage.py rebuild-latest
+      python manage.py rebuild-rollups
+      python manage.py rebuild-counters
+      python manage.py rebuild-spatial
+      python manage.py purge [--days 30] [--no-archive]
+      python manage.py vacuum
+      python manage.py partition [--list]
+      python manage.py backfill-derived [--all]
+      python manage.py seed --stations 10 --years 2 [--interval 300]
+      python manage.py import-csv archivo.csv [--station-id <uuid>]
+"""
+import argparse
+import logging
+from datetime import datetime, timedelta, timezone
+
+from app.core.database import init_db, SessionLocal, engine, IS_SQLITE
+# Importar modelos para que Base.metadata los registre antes de init_db()
+from app.models.station import WeatherStation, WeatherData  # noqa: F401
+from app.services.latest import rebuild_latest
+from app.services.rollups import rebuild_rollups
+from app.services.counters import rebuild_counters
+from app.services.spatial import rebuild_spatial
+from app.services.retention import purge_expired
+from app.services.partitions import archive_months, describe_partitions
+from app.services.derived import backfill_derived
+from app.services.bulk_load import CsvSource, bulk_load, create_stations, synthetic_batches
+
+logging.basicConfig(level=logging.INFO)
+
+
+def cmd_rebuild_latest(args):
+    with SessionLocal() as db:
+        count = rebuild_latest(db)
+    print(f"station_latest: {count} estaciones")
+
+
+def cmd_rebuild_rollups(args):
+    with SessionLocal() as db:
+        total = rebuild_rollups(db, chunk_size=args.chunk_size)
+    print(f"rollups: {total} lecturas agregadas")
+
+
+def cmd_rebuild_counters(args):
+    with SessionLocal() as db:
+        values = rebuild_counters(db)
+    print("contadores: " + ", ".join(f"{k}={v}" for k, v in values.items()))
+
+
+def cmd_rebuild_spatial(args):
+    with SessionLocal() as db:
+        count = rebuild_spatial(db)
+    print(f"station_rtree: {count} estaciones")
+
+
+def cmd_purge(args):
+    report = purge_expired(days=args.days, batch_size=args.batch_size, archive=not args.no_archive)
+    print(f"retención: {report['deleted']} lecturas anteriores a {report['cutoff']} borradas "
+          f"en {report['batches']} lotes, {report['rollups_deleted']} buckets de rollup, "
+          f"{report['freed_pages']} páginas liberadas, {report['seconds']} s")
+
+
+def cmd_vacuum(args):
+    if not IS_SQLITE:
+        print("vacuum: solo aplica a SQLite")
+        return
+    # VACUUM reescribe el archivo completo: aplica auto_vacuum a una base existente
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql(f"PRAGMA auto_vacuum={args.mode}")
+        conn.exec_driver_sql("VACUUM")
+        mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+    print(f"vacuum: completado (auto_vacuum={mode})")
+
+
+def cmd_partition(args):
+    if not args.list:
+        report = archive_months(hot_months=args.hot_months)
+        print(f"particiones: {report['rows_moved']} lecturas movidas anteriores a {report['boundary']}, "
+              f"nuevas: {report['partitions_created'] or 'ninguna'}, {report['seconds']} s")
+    with SessionLocal() as db:
+        for p in describe_partitions(db):
+            print(f"  {p['name']:<22} {p['month_start'] or 'activa':<20} {p['rows']:>10} filas")
+
+
+def cmd_backfill_derived(args):
+    report = backfill_derived(chunk_size=args.chunk_size, only_missing=not args.all)
+    print(f"derivados: {report['rows']} lecturas actualizadas en {report['seconds']} s")
+
+
+def _print_load(report):
+    print(f"carga: {report['rows']} lecturas de {report['stations']} estaciones en {report['seconds']} s "
+          f"({report['rows_per_s']} filas/s, índices {report['index_seconds']} s)")
+
+
+def cmd_seed(args):
+    end = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    start = end - timedelta(days=round(365.25 * args.years))
+    station_ids = args.station_id or create_stations(args.stations, prefix=args.prefix)
+    batches = synthetic_batches(station_ids, start, end, interval_s=args.interval, seed=args.seed)
+    _print_load(bulk_load(batches, drop_indexes=not args.keep_indexes, commit_rows=args.commit_rows))
+
+
+def cmd_import_csv(args):
+    sources = [CsvSource(path, station_id=args.station_id) for path in args.files]
+    batches = (batch for source in sources for batch in source)
+    _print_load(bulk_load(batches, drop_indexes=not args.keep_indexes, commit_rows=args.commit_rows))
+    rejected = sum(s.rejected for s in sources)
+    if rejected:
+        print(f"  {rejected} filas descartadas (estación desconocida o valores inválidos)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mantenimiento de Weather Station API")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("rebuild-latest", help="Recalcula station_latest desde weather_data")
+    p.set_defaults(func=cmd_rebuild_latest)
+
+    p = sub.add_parser("rebuild-rollups", help="Recalcula las rollups horarias y diarias")
+    p.add_argument("--chunk-size", type=int, default=50000)
+    p.set_defaults(func=cmd_rebuild_rollups)
+
+    p = sub.add_parser("rebuild-counters", help="Recalcula system_counters con COUNT(*)")
+    p.set_defaults(func=cmd_rebuild_counters)
+
+    p = sub.add_parser("rebuild-spatial", help="Recalcula el índice R*Tree de estaciones")
+    p.set_defaults(func=cmd_rebuild_spatial)
+
+    p = sub.add_parser("purge", help="Borra lecturas anteriores a DATA_RETENTION_DAYS")
+    p.add_argument("--days", type=int, default=None)
+    p.add_argument("--batch-size", type=int, default=None)
+    p.add_argument("--no-archive", action="store_true",
+                   help="Borra también las rollups de ese periodo")
+    p.set_defaults(func=cmd_purge)
+
+    p = sub.add_parser("vacuum", help="VACUUM completo y activa auto_vacuum incremental")
+    p.add_argument("--mode", default="INCREMENTAL", choices=["NONE", "FULL", "INCREMENTAL"])
+    p.set_defaults(func=cmd_vacuum)
+
+    p = sub.add_parser("partition", help="Mueve los meses antiguos a particiones weather_data_AAAAMM")
+    p.add_argument("--hot-months", type=int, default=None)
+    p.add_argument("--list", action="store_true", help="Solo lista las particiones")
+    p.set_defaults(func=cmd_partition)
+
+    p = sub.add_parser("backfill-derived",
+                       help="Calcula punto de rocío, mph, rumbo e in/h de las lecturas existentes")
+    p.add_argument("--chunk-size", type=int, default=50000)
+    p.add_argument("--all", action="store_true", help="Recalcula también las filas ya completas")
+    p.set_defaults(func=cmd_backfill_derived)
+
+    load_args = argparse.ArgumentParser(add_help=False)
+    load_args.add_argument("--keep-indexes", action="store_true",
+                           help="No elimina los índices durante la carga (más lento)")
+    load_args.add_argument("--commit-rows", type=int, default=500_000)
+
+    p = sub.add_parser("seed", parents=[load_args], help="Genera historial sintético con el modelo del simulador")
+    p.add_argument("--stations", type=int, default=10)
+    p.add_argument("--station-id", action="append", help="Usa estaciones existentes (repetible)")
+    p.add_argument("--years", type=float, default=1)
+    p.add_argument("--interval", type=int, default=300, help="Segundos entre lecturas (default: 300)")
+    p.add_argument("--prefix", default="synth")
+    p.add_argument("--seed", type=int, default=None)
+    p.set_defaults(func=cmd_seed)
+
+    p = sub.add_parser("import-csv", parents=[load_args], help="Importa lecturas desde archivos CSV")
+    p.add_argument("files", nargs="+")
+    p.add_argument("--station-id", help="Estación para todas las filas (si el CSV no trae station_id)")
+    p.set_defaults(func=cmd_import_csv)
+
+    args = parser.parse_args()
+    init_db()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -62,7 +62,15 @@ class ProxyHandler(http.server.SimpleHTTPRequestHandler):
                     if k.lower() not in ("transfer-encoding",):
                         self.send_header(k, v)
                 self.end_headers()
-                self.wfile.write(resp.read())
+                if resp.headers.get("Content-Type", "").startswith("text/event-stream"):
+                    # SSE: reenviar cada evento según llega
+                    while chunk := resp.read1(65536):
+                        self.wfile.write(chunk)
+                        self.wfile.flush()
+                else:
+                    self.wfile.write(resp.read())
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # el navegador cerró el stream
         except urllib.error.HTTPError as e:
             self.send_response(e.code)
             for k, v in e.headers.items():
@@ -10,6 +10,7 @@ let sysStats   = null;
 let selected   = new Set();   // station IDs checked for research
 let charts     = {};          // active Chart.js instances keyed by name
 let timeMode   = 'range';     // 'range' | 'hours'
+let stationView = null;       // ID de la estación abierta en detalle
 
 // ─── Format helpers ──────────────────────────────────────────────────────────
 const fmt = {
@@ -81,7 +82,8 @@ async function getStationData(id, opts = {}) {
   const qs = opts.startDate && opts.endDate
     ? `start_date=${opts.startDate}&end_date=${opts.endDate}&limit=5000`
     : `hours=${opts.hours || 24}&limit=2000`;
-  return apiFetch(`/stations/${id}/data?${qs}`);
+  // buckets: el servidor agrega la serie (avg/min/max por intervalo)
+  return apiFetch(`/stations/${id}/data?${qs}${opts.buckets ? `&buckets=${opts.buckets}` : ''}`);
 }
 
 async function getStationStats(id, hours = 24) {
@@ -389,6 +391,7 @@ function emptyState(icon, text, extra = '') {
 async function openStation(id) {
   const s = stations.find(x => x.id === id);
   if (!s) return;
+  stationView = id;
 
   const app = document.getElementById('app');
   app.innerHTML = navHTML() + `
@@ -476,7 +479,7 @@ async function loadSeriesChart(stationId, hours) {
       ${active ? 'bg-sky-500 text-white' : 'bg-slate-700 text-slate-400 hover:bg-slate-600 hover:text-white'}`;
   });
 
-  const raw    = await getStationData(stationId, { hours });
+  const raw    = await getStationData(stationId, { hours, buckets: 1000 });
   const sorted = [...raw].reverse(); // oldest first for chart
 
   killChart('series');
@@ -591,7 +594,7 @@ async function runAnalytics() {
   if (!id) return;
 
   const [raw, stats] = await Promise.all([
-    getStationData(id, { hours }),
+    getStationData(id, { hours, buckets: 1000 }),
     getStationStats(id, hours),
   ]);
 
@@ -1221,7 +1224,7 @@ window.toggleAll = (c) => { toggleAll(c); render(); };
 // ═══════════════════════════════════════════════════════════════════════════════
 // ROUTER
 // ═══════════════════════════════════════════════════════════════════════════════
-function goto(p) { page = p; render(); }
+function goto(p) { page = p; stationView = null; render(); }
 window.goto = goto;
 window.openStation = openStation;
 
@@ -1257,6 +1260,31 @@ function render() {
   }
 }
 
+// ═══════════════════════════════════════════════════════════════════════════════
+// LIVE (SSE) — lecturas nuevas sin volver a pedir /stations
+// ═══════════════════════════════════════════════════════════════════════════════
+let liveRender = null;
+
+function startLive() {
+  if (!window.EventSource) return;
+  // EventSource reconecta solo y envía Last-Event-ID para recuperar lo perdido
+  const es = new EventSource(`${API}/stations/live`);
+  es.addEventListener('reading', e => {
+    const d = JSON.parse(e.data);
+    const s = stations.find(x => x.id === d.station_id);
+    if (!s) return;
+    if (s.latest_data && s.latest_data.timestamp > d.timestamp) return;
+    s.latest_data = d;
+    s.last_data_time = d.timestamp;
+    // Redibujar el dashboard como mucho cada 2 s y sin pisar modales ni el detalle
+    if (page !== 'dashboard' || stationView || liveRender) return;
+    liveRender = setTimeout(() => {
+      liveRender = null;
+      if (page === 'dashboard' && !stationView && !document.getElementById('modals').innerHTML) render();
+    }, 2000);
+  });
+}
+
 // ═══════════════════════════════════════════════════════════════════════════════
 // BOOT
 // ═══════════════════════════════════════════════════════════════════════════════
@@ -1264,6 +1292,7 @@ async function init() {
   try {
     await loadAll();
     render();
+    startLive();
   } catch (err) {
     console.error(err);
     document.getElementById('app').innerHTML = `
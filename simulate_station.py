@@ -1,22 +1,35 @@
 """
 Simulador de estación meteorológica ESP32.
 Crea automáticamente una estación de prueba y envía lecturas realistas
-cada 30 segundos al backend en http://localhost:8000.
+cada 30 segundos al backend (--base-url, por defecto producción).
+
+Con --stations N pasa a modo carga: simula N estaciones a la vez, con
+lecturas del dashboard mezcladas, y reporta throughput, errores y
+latencias p50/p95/p99 para dimensionar la VM. En este modo el backend no
+tiene valor por defecto: hay que dar --base-url (o $SIM_BASE_URL), para no
+llenar producción de estaciones sintéticas por descuido.
 
 Uso:  python3 simulate_station.py
       python3 simulate_station.py --interval 10   # cada 10 s
       python3 simulate_station.py --station-id <uuid>  # reusar ID existente
+      python3 simulate_station.py --base-url http://localhost:8000 \
+          --stations 2000 --interval 30 --ramp-up 60 --duration 300 --read-ratio 0.2
 """
 import argparse
+import heapq
 import json
 import math
+import os
 import random
+import threading
 import time
 import urllib.request
 import urllib.error
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
-BASE_URL = "https://weather-mx.fly.dev"
+PRODUCTION_URL = "https://weather-mx.fly.dev"
+BASE_URL = os.getenv("SIM_BASE_URL", PRODUCTION_URL)
 
 
 # ── helpers ──────────────────────────────────────────────────────────────────
@@ -29,7 +42,8 @@ def api(method: str, path: str, body: dict | None = None) -> dict:
         headers={"Content-Type": "application/json"} if data else {}
     )
     with urllib.request.urlopen(req, timeout=10) as r:
-        return json.loads(r.read())
+        body = r.read()
+    return json.loads(body) if body else {}
 
 
 def ensure_station(station_id: str | None) -> dict:
@@ -94,6 +108,173 @@ def sensor_reading(t: float, rain_event: bool) -> dict:
     }
 
 
+# ── load mode ────────────────────────────────────────────────────────────────
+
+READ_PATHS = [
+    "/api/stations/?limit=100",
+    "/api/stations/{sid}",
+    "/api/stations/{sid}/data?hours=24&buckets=200",
+    "/api/stations/stats/overview",
+]
+
+
+def percentile(sorted_values: list, p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[k]
+
+
+class LoadStats:
+    """Latencies (ms) and errors per request kind, thread-safe."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {"write": [], "read": []}
+        self.errors = {}
+        self.window = []
+
+    def record(self, kind: str, ms: float, error: str | None):
+        with self.lock:
+            if error:
+                self.errors[(kind, error)] = self.errors.get((kind, error), 0) + 1
+            else:
+                self.latencies[kind].append(ms)
+            self.window.append((ms, error is None))
+
+    def drain_window(self) -> list:
+        with self.lock:
+            window, self.window = self.window, []
+        return window
+
+
+def _timed_request(stats: LoadStats, kind: str, method: str, path: str,
+                   body: dict | None, scheduled: float):
+    error = None
+    try:
+        api(method, path, body)
+    except urllib.error.HTTPError as e:
+        error = f"HTTP {e.code}"
+    except Exception as e:
+        error = type(e).__name__
+    # Desde la hora programada, no desde el envío: si el pool o el servidor se
+    # atrasan, la espera cuenta como latencia (sin "coordinated omission")
+    stats.record(kind, (time.monotonic() - scheduled) * 1000, error)
+
+
+def _activation(i: int, n: int, ramp_up: float, steps: int) -> float:
+    """Second at which station i starts sending (linear or step ramp-up)."""
+    if not ramp_up:
+        return 0.0
+    if steps:
+        return (i * steps // n) * ramp_up / steps
+    return ramp_up * i / n
+
+
+def _create_stations(pool: ThreadPoolExecutor, n: int) -> list:
+    run_id = datetime.now().strftime("%H%M%S")
+
+    def create(i):
+        return api("POST", "/api/stations/", {
+            "name": f"load_{run_id}_{i:05d}",
+            "location": "Prueba de carga",
+            "latitude": 19.4326 + random.uniform(-1, 1),
+            "longitude": -99.1332 + random.uniform(-1, 1),
+            "active": True,
+        })["id"]
+
+    return list(pool.map(create, range(n)))
+
+
+def _report_progress(stats: LoadStats, t0: float, every: float, stop: threading.Event):
+    while not stop.wait(every):
+        window = stats.drain_window()
+        ok = sorted(ms for ms, good in window if good)
+        errors = len(window) - len(ok)
+        print(f"  t={time.monotonic() - t0:>6.0f}s  {len(window) / every:>7.1f} req/s  "
+              f"errores {errors:>4}  p50 {percentile(ok, 50):>7.1f} ms  "
+              f"p95 {percentile(ok, 95):>7.1f} ms  p99 {percentile(ok, 99):>7.1f} ms")
+
+
+def _print_summary(stats: LoadStats, elapsed: float):
+    total = sum(len(v) for v in stats.latencies.values()) + sum(stats.errors.values())
+    print("\n  " + "-" * 72)
+    print(f"  {'tipo':<6} {'peticiones':>10} {'req/s':>8} {'errores':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind, values in stats.latencies.items():
+        values.sort()
+        errors = sum(n for (k, _), n in stats.errors.items() if k == kind)
+        count = len(values) + errors
+        if not count:
+            continue
+        print(f"  {kind:<6} {count:>10} {count / elapsed:>8.1f} {errors / count:>7.2%} "
+              f"{percentile(values, 50):>8.1f} {percentile(values, 95):>8.1f} "
+              f"{percentile(values, 99):>8.1f} {(values[-1] if values else 0):>8.1f}")
+    print(f"  total  {total:>10} {total / elapsed:>8.1f}")
+    for (kind, error), n in sorted(stats.errors.items()):
+        print(f"  ⚠ {kind}: {error} × {n}")
+
+
+def run_load(n_stations: int, interval: float, duration: float, ramp_up: float,
+             steps: int, read_ratio: float, concurrency: int, cleanup: bool):
+    """Simulate n_stations sending every `interval` seconds for `duration`
+    seconds, plus dashboard reads, and print latency percentiles."""
+    if not 0 <= read_ratio < 1:
+        raise SystemExit("--read-ratio debe estar en [0, 1)")
+    print("=" * 72)
+    print(f"  Prueba de carga: {n_stations} estaciones cada {interval} s "
+          f"(≈ {n_stations / interval:.1f} lecturas/s) contra {BASE_URL}")
+    print(f"  Rampa {ramp_up} s{f' en {steps} escalones' if steps else ''}, "
+          f"duración {duration} s, lecturas {read_ratio:.0%}, concurrencia {concurrency}")
+    print("=" * 72)
+
+    stats = LoadStats()
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    sids = _create_stations(pool, n_stations)
+    print(f"  {len(sids)} estaciones creadas\n")
+
+    t0 = time.monotonic()
+    # (hora programada, estación): cada estación arranca con su propia fase
+    due = [(t0 + _activation(i, n_stations, ramp_up, steps) + random.uniform(0, interval), i)
+           for i in range(n_stations)]
+    heapq.heapify(due)
+    reads_per_write = read_ratio / (1 - read_ratio)
+    reads_owed = 0.0
+    rain = [False] * n_stations
+
+    stop = threading.Event()
+    reporter = threading.Thread(target=_report_progress, args=(stats, t0, 10, stop), daemon=True)
+    reporter.start()
+    try:
+        while due:
+            scheduled, i = heapq.heappop(due)
+            if scheduled - t0 >= duration:
+                break
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            rain[i] = random.random() < (0.7 if rain[i] else 0.02)
+            payload = {"station_id": sids[i], **sensor_reading(time.time(), rain[i])}
+            pool.submit(_timed_request, stats, "write", "POST", "/api/data/submit", payload, scheduled)
+            reads_owed += reads_per_write
+            while reads_owed >= 1:
+                reads_owed -= 1
+                path = random.choice(READ_PATHS).format(sid=random.choice(sids))
+                pool.submit(_timed_request, stats, "read", "GET", path, None, scheduled)
+            heapq.heappush(due, (scheduled + interval, i))
+    except KeyboardInterrupt:
+        print("\n  Interrumpido, esperando peticiones en curso…")
+    pool.shutdown(wait=True)
+    stop.set()
+    _print_summary(stats, time.monotonic() - t0)
+
+    if cleanup:
+        with ThreadPoolExecutor(max_workers=min(concurrency, 16)) as cleaner:
+            list(cleaner.map(lambda sid: api("DELETE", f"/api/stations/{sid}"), sids))
+        print(f"\n  {len(sids)} estaciones de prueba eliminadas")
+
+
 # ── main loop ─────────────────────────────────────────────────────────────────
 
 def run(station_id: str | None, interval: int):
@@ -169,9 +350,32 @@ def run(station_id: str | None, interval: int):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Simulador ESP32")
-    parser.add_argument("--interval", type=int, default=30,
+    parser.add_argument("--interval", type=float, default=30,
                         help="Segundos entre lecturas (default: 30)")
     parser.add_argument("--station-id", type=str, default=None,
                         help="UUID de estación existente (si no se da, crea una nueva)")
+    parser.add_argument("--base-url", default=os.getenv("SIM_BASE_URL"),
+                        help=f"Backend (default: $SIM_BASE_URL o {PRODUCTION_URL}; "
+                             "obligatorio con --stations)")
+    load = parser.add_argument_group("modo carga")
+    load.add_argument("--stations", type=int, default=0,
+                      help="Simula N estaciones concurrentes y mide latencias")
+    load.add_argument("--duration", type=float, default=120, help="Segundos de prueba (default: 120)")
+    load.add_argument("--ramp-up", type=float, default=0,
+                      help="Segundos hasta que todas las estaciones envían (default: 0)")
+    load.add_argument("--steps", type=int, default=0,
+                      help="Rampa en N escalones en lugar de lineal")
+    load.add_argument("--read-ratio", type=float, default=0.1,
+                      help="Fracción de peticiones que son lecturas del dashboard (default: 0.1)")
+    load.add_argument("--concurrency", type=int, default=200,
+                      help="Peticiones simultáneas como máximo (default: 200)")
+    load.add_argument("--cleanup", action="store_true", help="Elimina las estaciones de prueba al final")
     args = parser.parse_args()
-    run(args.station_id, args.interval)
+    if args.stations and not args.base_url:
+        parser.error("--stations requiere --base-url (o $SIM_BASE_URL); no se carga producción por defecto")
+    BASE_URL = (args.base_url or PRODUCTION_URL).rstrip("/")
+    if args.stations:
+        run_load(args.stations, args.interval, args.duration, args.ramp_up, args.steps,
+                 args.read_ratio, args.concurrency, args.cleanup)
+    else:
+        run(args.station_id, args.interval)